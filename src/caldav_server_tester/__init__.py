@@ -1,2 +1,15 @@
-from .caldav_server_tester import check_server_compatibility
-from .checker import ServerQuirkChecker
+## The imports are done lazily - importing the checker pulls in the
+## caldav library and the HTTP stack, and that is not needed for
+## i.e. `--help` or `--list-checks`.
+
+
+def __getattr__(name):
+    if name == "check_server_compatibility":
+        from .caldav_server_tester import check_server_compatibility
+
+        return check_server_compatibility
+    if name == "ServerQuirkChecker":
+        from .checker import ServerQuirkChecker
+
+        return ServerQuirkChecker
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
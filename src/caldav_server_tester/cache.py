@@ -0,0 +1,106 @@
+"""
+Persistent cache of check results.
+
+Running all the checks towards a server takes time, and most of the
+time nothing has changed on the server since the last run.  The
+features found by each check is stored on disk, keyed by
+
+* the server URL
+* a server fingerprint (typically the Server and DAV headers,
+  so an upgrade of the server invalidates the cache)
+* a hash of the source code of the check (so changes in the check
+  invalidates the cache)
+
+Cached results older than max_age seconds are not used.  The cache
+file is shared between runs with different max_age (and between the
+servers), so entries are only removed from it when they are older
+than MAX_AGE.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from functools import cache
+
+## Entries older than this (in seconds) are removed when the cache
+## file is written
+MAX_AGE = 30 * 24 * 3600
+
+
+def default_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "caldav-server-tester", "results.json")
+
+
+@cache
+def check_version(check_class):
+    """
+    A hash of the source code of the check class
+    """
+    try:
+        source = inspect.getsource(check_class)
+    except (OSError, TypeError):
+        ## Source not available - use the qualified name, so that the
+        ## check is at least not mixed up with other checks
+        source = f"{check_class.__module__}.{check_class.__qualname__}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    The features found by each check, stored as a json file on disk.
+    """
+
+    def __init__(self, max_age, path=None):
+        self.max_age = max_age
+        self.path = path or default_path()
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {k: v for k, v in entries.items() if self._is_fresh(v, MAX_AGE)}
+
+    def _is_fresh(self, entry, max_age):
+        return time.time() - entry.get("ts", 0) <= max_age
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def key(self, url, fingerprint, check_class):
+        return hashlib.sha256(
+            "\n".join((url, fingerprint, check_class.__name__, check_version(check_class))).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached features (as a dict) or None if there is
+        no fresh cache entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry, self.max_age):
+                return None
+            return entry["features"]
+
+    def put(self, key, features):
+        with self._lock:
+            self._entries[key] = {"ts": time.time(), "features": features}
+            ## Other processes may have been writing to the cache file
+            ## in the meantime (like, in fleet mode) - the newest entry wins
+            for k, v in self._load().items():
+                if k not in self._entries or self._entries[k]["ts"] < v["ts"]:
+                    self._entries[k] = v
+            self._entries = {k: v for k, v in self._entries.items() if self._is_fresh(v, MAX_AGE)}
+            self._save()
@@ -4,13 +4,18 @@
 This is the CLI - the "click" application
 """
 
+import asyncio
+import sys
+
 import click
-from caldav.davclient import get_davclient
-from .checker import ServerQuirkChecker
+
+## The rest of the imports are done when needed - importing the
+## caldav library takes a while, and it's not needed for i.e. --help
+## or --list-checks
 
 
 @click.command()
-@click.option("--name", type=str, help="Choose a server by name", default=None)
+@click.option("--name", type=str, help="Choose a server by name.  May be given multiple times to check a fleet of servers", multiple=True)
 @click.option("--verbose/--quiet", default=None, help="More output")
 @click.option("--json/--text", help="JSON output.  Overrides verbose")
 ## TODO: lines below has been copied from the plann library.
@@ -30,25 +35,261 @@ from .checker import ServerQuirkChecker
     help="Password for the caldav server",
     metavar="URL",
 )
-# @click.option("--check-features", help="List of features to test")
+@click.option("--check-features", help="Features to check.  Only the checks needed for those features are run", multiple=True, metavar="FEATURE")
 @click.option("--run-checks", help="List of checks to run", multiple=True)
-def check_server_compatibility(verbose, json, name, run_checks, **kwargs):
-    click.echo("WARNING: this script is not production-ready")
+@click.option("--jobs", type=int, default=1, help="Number of checks to run in parallel")
+@click.option("--asyncio/--no-asyncio", "use_asyncio", default=False, help="Run the checks in an asyncio event loop")
+@click.option("--processes", type=int, default=None, help="Number of servers to check in parallel in fleet mode")
+@click.option("--max-age", type=int, default=None, help="Reuse cached check results up to this age (in seconds)", metavar="SECONDS")
+@click.option("--record", help="Record all HTTP traffic to a cassette in this directory", metavar="DIR")
+@click.option("--replay", help="Replay the HTTP traffic from a cassette in this directory rather than connecting to the server", metavar="DIR")
+@click.option("--load-test", is_flag=True, default=False, help="Ramp up concurrent simulated clients until the server is saturated")
+@click.option("--load-test-duration", type=float, default=10, help="Duration of each step in the load test", metavar="SECONDS")
+@click.option("--stream", is_flag=True, default=False, help="Write progress as NDJSON - one JSON record per line as features are checked, and the report as the last record")
+@click.option("--compare", help="Compare the report with a previous report (or list of reports) for the same server.  Exits with status 1 on regressions.  May be given multiple times", multiple=True, metavar="FILE")
+@click.option("--history", "history_file", help="Append the report to this history database (see caldav-server-tester-history)", metavar="FILE")
+@click.option("--debug-mode", type=click.Choice(["logging", "assert", "pdb", "report", "none"]), default="logging", help="What to do when a feature is not as expected: log it, fail, start the debugger, only list it in the report (diff1 and diff2), or nothing")
+@click.option("--list-checks", is_flag=True, default=False, help="List the checks and exit")
+@click.option("--list-features", is_flag=True, default=False, help="List the features and exit")
+def check_server_compatibility(verbose, json, name, check_features, run_checks, jobs, use_asyncio, processes, max_age, record, replay, load_test, load_test_duration, stream, compare, history_file, debug_mode, list_checks, list_features, **kwargs):
+    if list_checks or list_features:
+        _list(list_checks, list_features, json)
+        return
+
+    from caldav.davclient import get_davclient
+    from .cache import ResultCache
+    from .cassette import Cassette
+    from .checker import ServerQuirkChecker
+    from .compare import compare_with
+    from .compare import load_reports
+    from .stream import Stream
+
+    ## With --stream, stdout should be pure NDJSON
+    click.echo("WARNING: this script is not production-ready", err=stream)
+    if load_test and replay:
+        raise click.UsageError("--load-test can't be combined with --replay")
+    if use_asyncio and (run_checks or check_features or jobs > 1):
+        ## check_all_async runs all the checks in one event loop
+        raise click.UsageError("--asyncio can't be combined with --run-checks, --check-features or --jobs")
+
+    previous_reports = load_reports(compare) if compare else None
+    if debug_mode == "none":
+        debug_mode = None
+
+    if len(name) > 1:
+        ## The servers are checked by fleet.check_server, with all the checks
+        fleet_unsupported = {
+            "--stream": stream,
+            "--check-features": check_features,
+            "--run-checks": run_checks,
+            "--asyncio": use_asyncio,
+            "--record": record,
+            "--replay": replay,
+            "--load-test": load_test,
+            "--debug-mode pdb": debug_mode == "pdb",
+            "--caldav-url": kwargs.get("caldav_url"),
+            "--caldav-username": kwargs.get("caldav_username"),
+            "--caldav-password": kwargs.get("caldav_password"),
+        }
+        for option, value in fleet_unsupported.items():
+            if value:
+                raise click.UsageError(f"{option} can't be used when checking multiple servers")
+        if _check_fleet(name, processes=processes, jobs=jobs, max_age=max_age, debug_mode=debug_mode, previous_reports=previous_reports, history_file=history_file):
+            sys.exit(1)
+        return
+    name = name[0] if name else None
 
     ## Remove empty keys
     conn_keys = {}
     for x in kwargs:
         if x.startswith("caldav_") and kwargs[x]:
             conn_keys[x[7:]] = kwargs[x]
-    with get_davclient(name=name, testconfig=True, **conn_keys) as conn:
-        obj = ServerQuirkChecker(conn)
-        if not run_checks:
-            obj.check_all()
+    cassette = None
+    if replay:
+        cassette = Cassette.load(replay)
+        conn = cassette.client()
+    else:
+        conn = get_davclient(name=name, testconfig=True, **conn_keys)
+        if record:
+            cassette = Cassette()
+            cassette.record(conn)
+    with conn:
+        result_cache = ResultCache(max_age) if max_age is not None else None
+        obj = ServerQuirkChecker(
+            conn,
+            debug_mode=debug_mode,
+            result_cache=result_cache,
+            cassette=cassette,
+            stream=Stream(sys.stdout) if stream else None,
+        )
+        if check_features:
+            try:
+                classes = obj.checks_for_features(check_features)
+            except ValueError as e:
+                raise click.UsageError(str(e))
+            obj.run_check_classes(classes, jobs=jobs)
+        elif not run_checks and use_asyncio:
+            asyncio.run(obj.check_all_async())
+        elif not run_checks:
+            obj.check_all(jobs=jobs)
         for check in run_checks:
             obj.check_one(check)
+        if load_test:
+            obj.run_load_test(duration=load_test_duration)
     test_cal_info = obj.expected_features.is_supported('test-calendar.compatibility-tests', return_type=dict)
     obj.cleanup(force=False)
-    click.echo(obj.report(verbose=verbose, return_what="json" if json else str))
+    if record:
+        cassette.save(record)
+    if history_file:
+        from .history import History
+
+        with History(history_file) as history:
+            history.add(obj.report(return_what=dict))
+    if previous_reports is None and not stream:
+        click.echo(obj.report(verbose=verbose, return_what="json" if json else str))
+        return
+    report = obj.report(return_what=dict)
+    if previous_reports is not None:
+        report["comparison"] = compare_with(previous_reports, report)
+    if stream:
+        obj.stream.write("report", report=report)
+    else:
+        from json import dumps
+
+        click.echo(dumps(report, indent=4))
+    if report.get("comparison") and report["comparison"]["regressions"]:
+        sys.exit(1)
+
+def _list(list_checks, list_features, as_json):
+    """
+    Lists the checks and/or features from the precomputed metadata
+    """
+    from .metadata import load
+    from .metadata import plugin_checks
+
+    metadata = load()
+    if as_json:
+        from json import dumps
+
+        ret = {}
+        if list_checks:
+            ret["checks"] = metadata["checks"] + [{"name": x, "plugin": True} for x in plugin_checks()]
+        if list_features:
+            ret["features"] = metadata["features"]
+        click.echo(dumps(ret, indent=4))
+        return
+    if list_checks:
+        for check in metadata["checks"]:
+            opt_in = " (opt-in)" if check.get("opt_in") else ""
+            click.echo(f"{check['name']}{opt_in}: {check['description']}")
+            if check["features"]:
+                click.echo(f"    features: {', '.join(check['features'])}")
+        for name in plugin_checks():
+            click.echo(f"{name}: (from another package)")
+    if list_features:
+        for name, feature in metadata["features"].items():
+            click.echo(f"{name} ({feature['type']}): {feature['description']}")
+
+def _check_fleet(names, processes, jobs, max_age, debug_mode="logging", previous_reports=None, history_file=None):
+    """
+    Checks all the servers, and streams one combined JSON report (a
+    list with one report per server) as the servers are done.
+
+    If previous_reports is given, each report is compared with the
+    previous report for the server.  Returns True if there are
+    regressions.  If history_file is given, the reports are appended
+    to the history database.
+    """
+    from json import dumps
+    from .compare import compare_with
+    from .fleet import check_fleet
+    from .history import History
+
+    history = History(history_file) if history_file else None
+    regressions = False
+    click.echo("[")
+    first = True
+    for report in check_fleet(names, processes=processes, jobs=jobs, max_age=max_age, debug_mode=debug_mode):
+        if history is not None:
+            history.add(report)
+        if previous_reports is not None:
+            report["comparison"] = compare_with(previous_reports, report)
+            if report["comparison"] and report["comparison"]["regressions"]:
+                regressions = True
+        if not first:
+            click.echo(",")
+        first = False
+        click.echo(dumps(report, indent=4), nl=False)
+    click.echo("\n]")
+    if history is not None:
+        history.close()
+    return regressions
+
+
+@click.group()
+@click.option("--db", help="The history database", metavar="FILE")
+@click.pass_context
+def history(ctx, db):
+    """
+    Queries the history of check results (as appended with --history)
+    """
+    from .history import History
+
+    ctx.obj = ctx.with_resource(History(db))
+
+
+@history.command("import")
+@click.argument("files", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.pass_obj
+def history_import(history, files):
+    """
+    Adds stored JSON reports to the history
+    """
+    click.echo(f"{history.import_files(files)} reports added")
+
+
+@history.command()
+@click.argument("server")
+@click.argument("feature")
+@click.option("--json/--text", help="JSON output")
+@click.pass_obj
+def changes(history, server, feature, json):
+    """
+    When did the support for FEATURE change on SERVER?
+    """
+    from datetime import datetime
+
+    ret = history.changes(server, feature)
+    if json:
+        from json import dumps
+
+        click.echo(dumps(ret, indent=4))
+        return
+    for change in ret:
+        ts = datetime.fromtimestamp(change["ts"]).isoformat(timespec="seconds")
+        click.echo(f"{ts} {change['support']} (caldav {change['caldav_version']})")
+
+
+@history.command()
+@click.argument("feature")
+@click.option("--support", help="Only list the servers with this support level (i.e. full)")
+@click.option("--json/--text", help="JSON output")
+@click.pass_obj
+def servers(history, feature, support, json):
+    """
+    The support for FEATURE on all servers, as of the latest run
+    """
+    ret = history.servers(feature)
+    if support:
+        ret = {x: y for x, y in ret.items() if y == support}
+    if json:
+        from json import dumps
+
+        click.echo(dumps(ret, indent=4))
+        return
+    for server, support_ in ret.items():
+        click.echo(f"{server}: {support_}")
+
 
 if __name__ == "__main__":
     check_server_compatibility()
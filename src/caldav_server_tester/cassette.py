@@ -0,0 +1,201 @@
+"""
+Recording and replaying the HTTP traffic of a checker run.
+
+With `--record DIR`, every request sent by the client and the
+response from the server is stored in a "cassette" file.  With
+`--replay DIR`, the responses are taken from the cassette rather than
+from the server.  This makes it possible to rerun the checks within
+milliseconds while working on the check code, or to reproduce the
+results from some server without having access to it.
+
+Requests in a run will not be exactly the same as in the recorded
+run - the calendar data contains DTSTAMP, and some of the checks are
+using random UUIDs.  Those are normalized away before the requests
+are matched: UUIDs in the URLs and request bodies, and DTSTAMP in the
+calendar data sent with PUT.  REPORT and PROPFIND requests are
+matched exactly on the request body - the response to a query
+depends on the query.  If the same request is sent multiple times,
+the responses are replayed in the recorded order.
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from collections import deque
+
+from caldav.lib import error
+from caldav.lib.python_utilities import to_normal_str
+
+FILENAME = "cassette.json.gz"
+## Version 1 cassettes did not keep the request bodies
+VERSION = 2
+
+_uuid_re = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+_dtstamp_re = re.compile(r"^DTSTAMP[:;].*$", re.MULTILINE)
+
+
+class CassetteMiss(Exception):
+    """
+    A request was sent that isn't found in the cassette
+    """
+
+
+def _normalize(text):
+    text = to_normal_str(text or "")
+    return _uuid_re.sub("<uuid>", text).replace("\r\n", "\n").strip()
+
+
+def _normalize_body(method, body):
+    """
+    The request body, as used for matching requests
+    """
+    body = to_normal_str(body or "")
+    if method in ("REPORT", "PROPFIND"):
+        return body
+    if method == "PUT":
+        body = _dtstamp_re.sub("", body)
+    return _normalize(body)
+
+
+class _ReplayedResponse:
+    """
+    Quacks sufficiently like a requests/niquests Response object to
+    be passed to DAVResponse
+    """
+
+    def __init__(self, exchange):
+        from caldav.davclient import CaseInsensitiveDict
+        from caldav.lib.python_utilities import to_wire
+
+        self.status_code = exchange["status"]
+        self.reason = exchange["reason"]
+        self.headers = CaseInsensitiveDict(exchange["headers"])
+        self.text = exchange["body"]
+        self.content = to_wire(exchange["body"])
+
+
+class Cassette:
+    """
+    HTTP exchanges, with some metadata about the server, stored as
+    gzipped json.
+    """
+
+    def __init__(self, url=None, name=None, features=None, exchanges=None):
+        self.url = url
+        self.name = name
+        ## The expected features for the server when recording, so
+        ## that the checker can compare against them when replaying
+        self.features = features or {}
+        self.exchanges = exchanges or []
+        self.replaying = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, directory):
+        with gzip.open(os.path.join(directory, FILENAME), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != VERSION:
+            raise ValueError(f"The cassette in {directory} is from another version of the tester, it has to be recorded again")
+        return cls(data["url"], data["name"], data["features"], data["exchanges"])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "version": VERSION,
+            "url": self.url,
+            "name": self.name,
+            "features": self.features,
+            "exchanges": self.exchanges,
+        }
+        with gzip.open(os.path.join(directory, FILENAME), "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def client(self):
+        """
+        Returns a client for the recorded server, replaying from the
+        cassette.
+        """
+        from caldav.davclient import DAVClient
+
+        client = DAVClient(url=self.url, features=self.features)
+        client.server_name = self.name
+        self.replay(client)
+        return client
+
+    def record(self, client):
+        """
+        Wraps the request method of the client, so that all requests
+        are recorded in the cassette.
+        """
+        self.url = str(client.url)
+        self.name = getattr(client, "server_name", None)
+        self.features = client.features.dotted_feature_set_list()
+        request = client.request
+
+        def recorded_request(url, method="GET", body="", headers=None):
+            exchange = {
+                "method": method,
+                "url": str(url),
+                "request_body": to_normal_str(body or ""),
+            }
+            try:
+                response = request(url, method, body, headers)
+            except Exception as e:
+                exchange["error"] = e.__class__.__name__
+                exchange["error_url"] = getattr(e, "url", None)
+                exchange["reason"] = getattr(e, "reason", str(e))
+                with self._lock:
+                    self.exchanges.append(exchange)
+                raise
+            exchange["status"] = response.status
+            exchange["reason"] = response.reason
+            exchange["headers"] = dict(response.headers)
+            exchange["body"] = to_normal_str(response._raw or "")
+            with self._lock:
+                self.exchanges.append(exchange)
+            return response
+
+        client.request = recorded_request
+
+    def replay(self, client):
+        """
+        Replaces the request method of the client, so that no requests
+        are sent to the server, the responses are taken from the
+        cassette instead.
+        """
+        from caldav.davclient import DAVResponse
+
+        self.replaying = True
+        by_request = defaultdict(deque)
+        for exchange in self.exchanges:
+            method = exchange["method"]
+            key = (method, _normalize(exchange["url"]), _normalize_body(method, exchange["request_body"]))
+            by_request[key].append(exchange)
+        ## The last exchange is kept around, repeated requests (like
+        ## when polling) will get the last recorded response
+        last = {}
+
+        def find(key):
+            queue = by_request.get(key)
+            if queue:
+                last[key] = queue.popleft()
+            return last.get(key)
+
+        def replayed_request(url, method="GET", body="", headers=None):
+            with self._lock:
+                exchange = find((method, _normalize(str(url)), _normalize_body(method, body)))
+            if exchange is None:
+                raise CassetteMiss(f"{method} {url} not found in the cassette")
+            if "error" in exchange:
+                error_class = getattr(error, exchange["error"], None)
+                if isinstance(error_class, type) and issubclass(error_class, error.DAVError):
+                    raise error_class(url=exchange["error_url"], reason=exchange["reason"])
+                raise RuntimeError(f"{exchange['error']}: {exchange['reason']}")
+            return DAVResponse(_ReplayedResponse(exchange), client)
+
+        client.request = replayed_request
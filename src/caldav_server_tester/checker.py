@@ -1,10 +1,21 @@
 import caldav
 import time
-import inspect
 from caldav.compatibility_hints import FeatureSet
 
 from . import checks
-from .checks_base import Check
+from . import instrumentation
+from . import loadtest
+from . import querycache
+from . import ratelimit
+from .checks_base import all_checks
+from .checks_base import checks_for_features
+from .checks_base import compare_expectation
+from .checks_base import find_check
+from .checks_base import in_definition_order
+from .checks_base import _lock
+from .scheduler import dependency_graph
+from .scheduler import run_checks
+from .scheduler import run_checks_async
 
 class ServerQuirkChecker:
     """This class will ...
@@ -15,33 +26,288 @@ class ServerQuirkChecker:
     * Methods for checking all features or a specific feature
     """
 
-    def __init__(self, client_obj, debug_mode='logging'):
+    def __init__(self, client_obj, debug_mode='logging', result_cache=None, cassette=None, stream=None):
+        """
+        debug_mode decides what to do when a check finds something
+        else than the expected features: 'logging', 'assert', 'pdb'
+        or None.  With 'report', nothing is done during the run - the
+        differences are found in diff1 and diff2 in the report.
+
+        result_cache is an optional cache.ResultCache.  Checks with
+        fresh results in the cache will be skipped.
+
+        cassette is an optional cassette.Cassette the client is
+        recording to or replaying from.
+
+        stream is an optional stream.Stream, progress records are
+        written to it while the checks are running.
+        """
         self._client_obj = client_obj
         self._features_checked = FeatureSet()
         self._default_calendar = None
         self._checks_run = set()  ## checks that has already been running
         self.expected_features = self._client_obj.features
         self.debug_mode = debug_mode
+        self._async_client_obj = None
+        self._result_cache = result_cache
+        self._fingerprint = None
+        self.checks_cached = set()
+        self._cassette = cassette
+        ## time and traffic spent by each check
+        self.timings = {}
+        self.load_test = None
+        self.stream = stream
+
+        ## Requests are counted in the timings of the running check.
+        ## This goes inside the rate limiter, time spent waiting for
+        ## the rate limiter is not time spent waiting for the server.
+        self._client_obj.request = instrumentation.wrap(self._client_obj.request)
+
+        ## All requests from all checks goes through the same rate limiter
+        ## (except when replaying - then there are no requests to the server)
+        self._rate_limiter = None
+        if cassette is None or not cassette.replaying:
+            self._rate_limiter = ratelimit.from_features(self.expected_features)
+        if self._rate_limiter is not None:
+            self._client_obj.request = self._rate_limiter.wrap(self._client_obj.request)
+
+        ## Identical REPORT queries are only sent once, as long as
+        ## nothing is written to the server in between
+        self._query_cache = querycache.QueryCache()
+        self._client_obj.request = self._query_cache.wrap(self._client_obj.request, self._client_obj)
 
-    def check_all(self):
-        classes = [
-            obj
-            for name, obj in inspect.getmembers(checks, inspect.isclass)
-            if obj.__module__ == checks.__name__
-            and issubclass(obj, Check)
-            and obj is not Check
-        ]
+    def _check_classes(self, plugins=True):
+        return all_checks(plugins=plugins)
+
+    def check_all(self, jobs=1):
+        """
+        Runs all the checks (except the opt-in checks).  With jobs>1,
+        independent checks will be run in parallel.
+        """
+        classes = [x for x in self._check_classes() if not x.opt_in]
+        self._load_cached_results(classes)
+        if jobs > 1:
+            run_checks(self, classes, jobs=jobs)
+            return
         for cl in classes:
             cl(self).run_check(only_once=True)
 
+    async def check_all_async(self):
+        """
+        Runs all the checks in an event loop.  The AsyncCheck checks
+        will drive an async client, so their requests may be
+        overlapped without spending threads.
+        """
+        classes = [x for x in self._check_classes() if not x.opt_in]
+        self._load_cached_results(classes)
+        self._async_client_obj = self._make_async_client()
+        try:
+            await run_checks_async(self, classes)
+        finally:
+            if self._async_client_obj is not None:
+                await self._async_client_obj.close()
+            self._async_client_obj = None
+
+    def _make_async_client(self):
+        """
+        Returns an async client with the same connection details as
+        the sync client, or None if the caldav library is too old
+        to have one.
+        """
+        if self._cassette is not None:
+            ## The cassette only covers the sync client
+            return None
+        try:
+            from caldav.aio import AsyncDAVClient
+        except ImportError:
+            ## caldav < 3.0.  The AsyncCheck checks will fall back to
+            ## do the blocking calls in worker threads.
+            return None
+        async_client = AsyncDAVClient(url=str(self._client_obj.url), **self._connection_keys())
+        async_client.request = instrumentation.wrap(async_client.request)
+        if self._rate_limiter is not None:
+            async_client.request = self._rate_limiter.wrap(async_client.request)
+        async_client.request = self._query_cache.wrap(async_client.request, async_client)
+        ## Workarounds should not be applied while checking
+        async_client.features = self._features_checked
+        return async_client
+
+    def _connection_keys(self):
+        """
+        The connection details of the client, for making more
+        clients towards the same server
+        """
+        conn_keys = {}
+        for key in ("username", "password", "auth", "proxy", "timeout", "ssl_verify_cert", "ssl_cert"):
+            if getattr(self._client_obj, key, None) is not None:
+                conn_keys[key] = getattr(self._client_obj, key)
+        return conn_keys
+
+    def async_calendar(self, calendar):
+        """
+        Returns a twin of the calendar object bound to the async
+        client, or None if no async client is in use.
+        """
+        if self._async_client_obj is None:
+            return None
+        return calendar.__class__(client=self._async_client_obj, url=calendar.url)
+
+    def checks_for_features(self, features):
+        """
+        The check classes needed for checking the given features (and
+        the checks they depend on).  Raises ValueError for unknown
+        features.
+        """
+        ## The entry points for the checks from other packages are
+        ## only loaded if the built-in checks don't cover the features
+        try:
+            return checks_for_features(self._check_classes(plugins=False), features)
+        except ValueError:
+            return checks_for_features(self._check_classes(), features)
+
+    def check_features(self, features, jobs=1):
+        """
+        Runs only the checks needed for checking the given features
+        (and the checks they depend on)
+        """
+        self.run_check_classes(self.checks_for_features(features), jobs=jobs)
+
+    def run_check_classes(self, classes, jobs=1):
+        """
+        Runs the given check classes (as from checks_for_features)
+        """
+        self._load_cached_results(classes)
+        if jobs > 1:
+            run_checks(self, classes, jobs=jobs)
+            return
+        for cl in in_definition_order(classes):
+            cl(self).run_check(only_once=True)
+
     def check_one(self, check_name):
-        check = getattr(checks, check_name)(self)
+        check = find_check(check_name)(self)
+        self._load_cached_results(dependency_graph([check.__class__]))
         check.run_check()
 
+    def run_load_test(self, duration=10, max_clients=64):
+        """
+        Ramps up concurrent simulated clients towards the test
+        calendar until the server is saturated.  The result is given
+        under load_test in the report.
+        """
+        from caldav.davclient import DAVClient
+
+        if self.replaying:
+            raise RuntimeError("A load test can't be done on a replayed cassette")
+        ## The test calendar is needed, even if the results from
+        ## setting it up were taken from the cache
+        prerequisites = {x for x in self.checks_cached if x.prerequisite}
+        self._checks_run -= prerequisites
+        self.checks_cached -= prerequisites
+        checks.PrepareCalendar(self).run_check()
+
+        def make_client():
+            client = DAVClient(url=str(self._client_obj.url), **self._connection_keys())
+            client.features = self.expected_features
+            if self._rate_limiter is not None:
+                client.request = self._rate_limiter.wrap(client.request)
+            return client
+
+        object_urls = [x.url for x in self.calendar.events()]
+        self.load_test = loadtest.run_load_test(
+            make_client, self.calendar.url, object_urls, duration=duration, max_clients=max_clients
+        )
+        self.load_test["rate_limited"] = self._rate_limiter is not None
+        return self.load_test
+
+    def server_fingerprint(self):
+        """
+        Something identifying the server software and version - the
+        Server and DAV headers from an OPTIONS request.
+        """
+        if self._fingerprint is None:
+            try:
+                headers = self._client_obj.options(str(self._client_obj.url)).headers
+            except Exception:
+                headers = {}
+            self._fingerprint = "\n".join(
+                f"{x}: {headers.get(x, '')}" for x in ("Server", "DAV")
+            )
+        return self._fingerprint
+
+    def _cache_key(self, check_class):
+        return self._result_cache.key(
+            str(self._client_obj.url), self.server_fingerprint(), check_class
+        )
+
+    def _load_cached_results(self, classes):
+        """
+        Copies cached results into the checked features, and marks
+        the checks as already run.  Prerequisite checks (like
+        PrepareCalendar) are only taken from the cache if no check
+        depending on them is to be run.
+        """
+        if self._result_cache is None:
+            return
+        graph = dependency_graph(classes)
+        cached = {}
+        for cl in graph:
+            if not cl.cacheable or cl in self._checks_run:
+                continue
+            features = self._result_cache.get(self._cache_key(cl))
+            if features is not None:
+                cached[cl] = features
+
+        ## The checks the checks still to be run depends on
+        needed = set()
+        todo = [cl for cl in graph if cl not in cached and cl not in self._checks_run]
+        while todo:
+            for dep in todo.pop().depends_on:
+                if dep not in needed:
+                    needed.add(dep)
+                    todo.append(dep)
+
+        for cl, features in cached.items():
+            if cl.prerequisite and cl in needed:
+                continue
+            with _lock:
+                self._features_checked.copyFeatureSet(features, collapse=False)
+            self._checks_run.add(cl)
+            self.checks_cached.add(cl)
+            if self.stream is not None:
+                self.stream.check_cached(cl)
+
+    def _check_done(self, check):
+        """
+        Called by Check.run_check after a check has been run
+        """
+        with _lock:
+            self.timings[check.__class__.__name__] = check.timing.as_dict()
+        if self.stream is not None:
+            self.stream.check_done(check)
+        if self._result_cache is None or not check.cacheable:
+            return
+        self._result_cache.put(self._cache_key(check.__class__), check.journal.features())
+
     @property
     def features_checked(self):
         return self._features_checked
 
+    @property
+    def partial(self):
+        """
+        True if not all the checks have been run (i.e. with
+        check_one or check_features rather than check_all)
+        """
+        return any(x not in self._checks_run for x in self._check_classes() if not x.opt_in)
+
+    @property
+    def replaying(self):
+        """
+        True if the responses are taken from a cassette rather than
+        from the server
+        """
+        return self._cassette is not None and self._cassette.replaying
+
     def cleanup(self, force=True):
         """
         Remove anything added by the PrepareCalendar check - if 
@@ -50,6 +316,9 @@ class ServerQuirkChecker:
             test_cal_info = self.expected_features.is_supported('test-calendar.compatibility-tests', return_type=dict)
             if not test_cal_info.get("cleanup", False):
                 return
+        if getattr(self, "calendar", None) is None:
+            ## The test calendar was not set up in this run
+            return
         if self.features_checked.is_supported("create-calendar") and self.features_checked.is_supported("delete-calendar"):
             self.calendar.delete()
             if self.tasklist != self.calendar:
@@ -76,18 +345,49 @@ class ServerQuirkChecker:
                         ## TODO: investigate
                         pass
 
+    def expectation_diff(self):
+        """
+        Compares all the observed features with the expected
+        features, in one pass.  Returns a tuple of two dicts -
+        `{feature: expected}` and `{feature: observed}` for the
+        features not being as expected (diff1 and diff2 in the
+        report).
+        """
+        diff1 = {}
+        diff2 = {}
+        with _lock:
+            observed = self._features_checked.dotted_feature_set_list()
+        for feature, value in sorted(observed.items()):
+            diff = compare_expectation(feature, value, self.expected_features, self._features_checked)
+            if diff is not None:
+                diff1[feature], diff2[feature] = diff
+        return (diff1, diff2)
+
     def report(self, verbose=False, return_what=str):
+        with _lock:
+            features = self._features_checked.dotted_feature_set_list(compact=True)
+            features_checked = sorted(self._features_checked.dotted_feature_set_list())
         ret = {
             "caldav_version": caldav.__version__,
             "ts": time.time(),
             "name": getattr(self._client_obj, "server_name"),
             "url": str(self._client_obj.url),
-            "features": self._features_checked.dotted_feature_set_list(compact=True),
+            "features": features,
+            ## all the features written by the checks (see the compare module)
+            "features_checked": features_checked,
+            ## not all the checks were run (see the history module)
+            "partial": self.partial,
+            "checks_cached": sorted(x.__name__ for x in self.checks_cached),
+            "timings": dict(sorted(self.timings.items())),
+            "query_cache": self._query_cache.stats(),
             "error": "Not fully implemnted yet - TODO",
             # "flags_checked": self.flags_checked,
-            # "diff1": list(self.diff1),
-            # "diff2": list(self.diff2),
         }
+        ## Features not as expected - diff1 is what was expected, diff2 what was observed
+        ret["diff1"], ret["diff2"] = self.expectation_diff()
+
+        if self.load_test is not None:
+            ret["load_test"] = self.load_test
 
         if return_what == "json":
             from json import dumps
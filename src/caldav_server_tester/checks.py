@@ -1,15 +1,32 @@
+import asyncio
+import contextvars
+import math
 import re
-import time
+import statistics
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 from datetime import datetime
 from datetime import date
+from datetime import timedelta
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape as xml_escape
 
+import icalendar
 from caldav.compatibility_hints import FeatureSet
 from caldav.lib.error import NotFoundError, AuthorizationError, ReportError
 from caldav.calendarobjectresource import Event, Todo, Journal
+from caldav.elements import cdav
+from caldav.elements import dav
 
+from . import features  ## registers the latency features
+from . import querycache
+from .checks_base import AsyncCheck
 from .checks_base import Check
+from .instrumentation import Timing
+from .polling import wait_until
 
 utc = timezone.utc
 
@@ -21,9 +38,9 @@ def _filter_2000(objects):
     content we let (almost) all test objects be in year 2000.  The
     work on the checker was initiated in 2025.  It's pretty rare that
     people have calendars with 25 years old data in it, but it could
-    happen.  TODO: perhaps we rather should filter by the uid?  TODO:
-    RFC2445 is from 1998, we would be even safer if using 1997 rather
-    than 2000?
+    happen.  Objects not made by the checker (with an UID not starting
+    with csc_) are filtered out as well.  TODO: RFC2445 is from 1998,
+    we would be even safer if using 1997 rather than 2000?
     """
     asdate = lambda foo: foo if type(foo) == date else foo.date()
 
@@ -34,19 +51,18 @@ def _filter_2000(objects):
             return x.start
         if "due" in x or "dtend" in x:
             return x.end
-        return date(1980)
+        return date(1980, 1, 1)
 
     def d(obj):
         return asdate(dt(obj))
 
-    return (x for x in objects if date(2000, 1, 1) <= d(x) <= date(2001, 1, 1))
+    def ours(obj):
+        return str(obj.component.get("uid", "")).startswith("csc_")
 
+    return (x for x in objects if ours(x) and date(2000, 1, 1) <= d(x) <= date(2001, 1, 1))
 
-## WORK IN PROGRESS
 
-## TODO: We need some collector framework that can collect all checks,
-## build a dependency graph and mapping from a feature to the relevant
-## check.
+## WORK IN PROGRESS
 
 
 class CheckGetCurrentUserPrincipal(Check):
@@ -56,6 +72,7 @@ class CheckGetCurrentUserPrincipal(Check):
 
     features_to_be_checked = {"get-current-user-principal"}
     depends_on = set()
+    prerequisite = True  ## sets checker.principal
 
     def _run_check(self):
         try:
@@ -145,9 +162,7 @@ class CheckMakeDeleteCalendar(Check):
                 cal = None
             ## Delete throw no exceptions, but was the calendar deleted?
             if not cal or (
-                self.flags_checked.get(
-                    "non_existing_calendar_found" and len(events) == 0
-                )
+                self.feature_checked("create-calendar.auto") and len(events) == 0
             ):
                 self.set_feature("delete-calendar")
                 ## Calendar probably deleted OK.
@@ -157,38 +172,53 @@ class CheckMakeDeleteCalendar(Check):
             else:
                 ## Calendar not deleted.
                 ## Perhaps the server needs some time to delete the calendar
-                time.sleep(10)
-                try:
-                    cal = self.checker.principal.calendar(cal_id=cal_id)
-                    assert cal
-                    cal.events()
+                not_found = []
+
+                def calendar_gone():
+                    try:
+                        self.checker.principal.calendar(cal_id=cal_id).events()
+                        return False
+                    except NotFoundError as e:
+                        not_found.append(e)
+                        return True
+
+                delay = wait_until(calendar_gone, timeout=10, replaying=self.checker.replaying)
+                if delay is None:
                     ## Calendar not deleted, but no exception thrown.
                     ## Perhaps it's a "move to thrashbin"-regime on the server
                     self.set_feature(
                         "delete-calendar",
                         {"support": "unknown", "behaviour": "move to trashbin?"},
                     )
-                except NotFoundError as e:
+                else:
                     ## Calendar was deleted, it just took some time.
                     self.set_feature(
                         "delete-calendar",
-                        {"support": "fragile", "behaviour": "delayed deletion"},
+                        {"support": "fragile", "behaviour": "delayed deletion", "delay": round(delay, 1)},
                     )
-                    return (calmade, e)
+                    return (calmade, not_found[0])
             return (calmade, None)
         except Exception as e:
-            time.sleep(10)
-            try:
-                cal.delete()
+            ## Perhaps the calendar can be deleted if we give it some time
+            def delete_calendar():
+                try:
+                    cal.delete()
+                    return True
+                except Exception:
+                    return False
+
+            delay = wait_until(delete_calendar, timeout=10, replaying=self.checker.replaying)
+            if delay is None:
+                self.set_feature("delete-calendar", False)
+            else:
                 self.set_feature(
                     "delete-calendar",
                     {
                         "support": "fragile",
                         "behaviour": "deleting a recently created calendar causes exception",
+                        "delay": round(delay, 1),
                     },
                 )
-            except Exception as e2:
-                self.set_feature("delete-calendar", False)
             return (calmade, None)
 
     def _run_check(self):
@@ -249,6 +279,45 @@ class CheckMakeDeleteCalendar(Check):
             self.set_feature("create-calendar", False)
 
 
+def _concurrently(func, items, workers=None):
+    """
+    Runs func on all the items in a thread pool (of `workers` threads,
+    by default one per item), and returns a list with the results.
+    The first failure (in the order of the items) is raised.
+    """
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or len(items)) as executor:
+        ## The context is copied so the requests are counted on the running check
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def _fixture_values(data):
+    """
+    The UID, SUMMARY, DTSTART and DUE of a fixture - given as the
+    keyword arguments for save_object, or as icalendar data (then
+    from the component, for recurrences the master)
+    """
+    if isinstance(data, dict):
+        ret = {key: data.get(key) for key in ("uid", "summary", "dtstart", "due")}
+        for key, value in ret.items():
+            if isinstance(value, datetime) and value.tzinfo is None:
+                ## The caldav library saves naive timestamps as UTC (from the local time)
+                ret[key] = value.astimezone(utc)
+        return ret
+    component = next(
+        x for x in icalendar.Calendar.from_ical(data).subcomponents
+        if not isinstance(x, icalendar.Timezone) and "RECURRENCE-ID" not in x
+    )
+    ret = {}
+    for key in ("uid", "summary", "dtstart", "due"):
+        value = component.get(key)
+        ret[key] = None if value is None else getattr(value, "dt", str(value))
+    return ret
+
+
 class PrepareCalendar(Check):
     """
     This "check" doesn't check anything, but ensures the calendar has some known events
@@ -256,12 +325,14 @@ class PrepareCalendar(Check):
 
     features_to_be_checked = set()
     depends_on = {CheckMakeDeleteCalendar}
+    prerequisite = True  ## sets up the test calendar
     features_to_be_checked = {
         "save-load.event.recurrences",
         "save-load.todo.recurrences",
         "save-load.event",
         "save-load.todo",
         "save-load.todo.mixed-calendar",
+        "multiget",
     }
 
     def _run_check(self):
@@ -282,31 +353,29 @@ class PrepareCalendar(Check):
         self.checker.calendar = calendar
         self.checker.tasklist = calendar
 
-        ## TODO: replace this with one search if possible(?)
-        events_from_2000 = calendar.search(
-            event=True, start=datetime(2000, 1, 1), end=datetime(2001, 1, 1)
-        )
-        tasks_from_2000 = calendar.search(
-            todo=True, start=datetime(2000, 1, 1), end=datetime(2001, 1, 1)
-        )
-
         object_by_uid = {}
 
         self.checker.cnt = 0
+        cnt_lock = threading.Lock()
 
-        for obj in _filter_2000(events_from_2000 + tasks_from_2000):
+        for obj in _filter_2000(self._existing_objects(calendar)):
             object_by_uid[obj.component["uid"]] = obj
 
         def add_if_not_existing(*largs, **kwargs):
-            self.checker.cnt += 1
             cal = self.checker.tasklist if largs[0] == Todo else self.checker.calendar
             if "uid" in kwargs:
                 uid = kwargs["uid"]
             elif not kwargs:
                 uid = re.search("UID:(.*)\n", largs[1]).group(1)
             if uid in object_by_uid:
-                return object_by_uid.pop(uid)
-            return cal.save_object(*largs, **kwargs)
+                obj = object_by_uid.pop(uid)
+            else:
+                obj = cal.save_object(*largs, **kwargs)
+            ## Only count objects actually in the calendar - a failed
+            ## attempt on saving a task is retried in a separate tasklist
+            with cnt_lock:
+                self.checker.cnt += 1
+            return obj
 
         try:
             task_with_dtstart = add_if_not_existing(
@@ -344,90 +413,96 @@ class PrepareCalendar(Check):
             self.set_feature("save-load.todo")
             self.set_feature("save-load.todo.mixed-calendar", False)
 
-        simple_event = add_if_not_existing(
-            Event,
-            summary="simple event with a start time and an end time",
-            uid="csc_simple_event1",
-            dtstart=datetime(2000, 1, 1, 12, 0, 0, tzinfo=utc),
-            dtend=datetime(2000, 1, 1, 13, 0, 0, tzinfo=utc),
-        )
-        simple_event.load()
-        self.set_feature("save-load.event")
-
-        non_duration_event = add_if_not_existing(
-            Event,
-            summary="event with a start time but no end time",
-            uid="csc_simple_event2",
-            dtstart=datetime(2000, 1, 2, 12, 0, 0, tzinfo=utc),
-        )
-
-        one_day_event = add_if_not_existing(
-            Event,
-            summary="event with a start date but no end date",
-            uid="csc_simple_event3",
-            dtstart=date(2000, 1, 3),
-        )
-
-        two_days_event = add_if_not_existing(
-            Event,
-            summary="event with a start date and end date",
-            uid="csc_simple_event4",
-            dtstart=date(2000, 1, 4),
-            dtend=date(2000, 1, 6),
-        )
-
-        event_with_categories = add_if_not_existing(
-            Event,
-            summary="event with categories",
-            uid="csc_event_with_categories",
-            categories="hands,feet,head",
-            dtstart=datetime(2000, 1, 7, 12, 0, 0),
-            dtend=datetime(2000, 1, 7, 13, 0, 0),
-        )
-
-        task_with_due = add_if_not_existing(
-            Todo,
-            summary="task with a due date",
-            uid="csc_simple_task2",
-            due=date(2000, 1, 8),
-        )
-
-        task_with_dtstart_and_due = add_if_not_existing(
-            Todo,
-            summary="task with a dtstart time and due time",
-            uid="csc_simple_task3",
-            dtstart=datetime(2000, 1, 9, 12, 0, 0, tzinfo=utc),
-            due=datetime(2000, 1, 9, 13, 0, 0, tzinfo=utc),
-        )
-
-        ## TODO: there are more variants to be tested - dtstart date and due date,
-        ## dtstart and duration, only duration, no time spec at all, ...
-
-        recurring_event = add_if_not_existing(
-            Event,
-            summary="monthly recurring event",
-            uid="csc_monthly_recurring_event",
-            rrule={"FREQ": "MONTHLY"},
-            dtstart=datetime(2000, 1, 12, 12, 0, 0, tzinfo=utc),
-            dtend=datetime(2000, 1, 12, 13, 0, 0, tzinfo=utc),
-        )
-        recurring_event.load()
-        self.set_feature("save-load.event.recurrences")
-
-        recurring_task = add_if_not_existing(
-            Todo,
-            summary="monthly recurring task",
-            uid="csc_monthly_recurring_task",
-            rrule={"FREQ": "MONTHLY"},
-            dtstart=datetime(2000, 1, 12, 12, 0, 0, tzinfo=utc),
-            due=datetime(2000, 1, 12, 13, 0, 0, tzinfo=utc),
-        )
-        recurring_task.load()
-        self.set_feature("save-load.todo.recurrences")
-
-        recurring_event_with_exception = add_if_not_existing(
-            Event,
-            """BEGIN:VCALENDAR
+        ## The rest of the fixtures are independent of each other,
+        ## so they are uploaded (and verified) concurrently.  With a
+        ## high-latency server, this saves lots of time.
+        fixtures = {
+            "simple_event": (
+                Event,
+                dict(
+                    summary="simple event with a start time and an end time",
+                    uid="csc_simple_event1",
+                    dtstart=datetime(2000, 1, 1, 12, 0, 0, tzinfo=utc),
+                    dtend=datetime(2000, 1, 1, 13, 0, 0, tzinfo=utc),
+                ),
+            ),
+            "non_duration_event": (
+                Event,
+                dict(
+                    summary="event with a start time but no end time",
+                    uid="csc_simple_event2",
+                    dtstart=datetime(2000, 1, 2, 12, 0, 0, tzinfo=utc),
+                ),
+            ),
+            "one_day_event": (
+                Event,
+                dict(
+                    summary="event with a start date but no end date",
+                    uid="csc_simple_event3",
+                    dtstart=date(2000, 1, 3),
+                ),
+            ),
+            "two_days_event": (
+                Event,
+                dict(
+                    summary="event with a start date and end date",
+                    uid="csc_simple_event4",
+                    dtstart=date(2000, 1, 4),
+                    dtend=date(2000, 1, 6),
+                ),
+            ),
+            "event_with_categories": (
+                Event,
+                dict(
+                    summary="event with categories",
+                    uid="csc_event_with_categories",
+                    categories="hands,feet,head",
+                    dtstart=datetime(2000, 1, 7, 12, 0, 0),
+                    dtend=datetime(2000, 1, 7, 13, 0, 0),
+                ),
+            ),
+            "task_with_due": (
+                Todo,
+                dict(
+                    summary="task with a due date",
+                    uid="csc_simple_task2",
+                    due=date(2000, 1, 8),
+                ),
+            ),
+            "task_with_dtstart_and_due": (
+                Todo,
+                dict(
+                    summary="task with a dtstart time and due time",
+                    uid="csc_simple_task3",
+                    dtstart=datetime(2000, 1, 9, 12, 0, 0, tzinfo=utc),
+                    due=datetime(2000, 1, 9, 13, 0, 0, tzinfo=utc),
+                ),
+            ),
+            ## TODO: there are more variants to be tested - dtstart date and due date,
+            ## dtstart and duration, only duration, no time spec at all, ...
+            "recurring_event": (
+                Event,
+                dict(
+                    summary="monthly recurring event",
+                    uid="csc_monthly_recurring_event",
+                    rrule={"FREQ": "MONTHLY"},
+                    dtstart=datetime(2000, 1, 12, 12, 0, 0, tzinfo=utc),
+                    dtend=datetime(2000, 1, 12, 13, 0, 0, tzinfo=utc),
+                ),
+            ),
+            "recurring_task": (
+                Todo,
+                dict(
+                    summary="monthly recurring task",
+                    uid="csc_monthly_recurring_task",
+                    rrule={"FREQ": "MONTHLY"},
+                    dtstart=datetime(2000, 1, 12, 12, 0, 0, tzinfo=utc),
+                    due=datetime(2000, 1, 12, 13, 0, 0, tzinfo=utc),
+                ),
+            ),
+            "recurring_event_with_exception": (
+                Event,
+                """BEGIN:VCALENDAR
 VERSION:2.0
 PRODID:-//tobixen//Caldav-Server-Tester//en_DK
 BEGIN:VEVENT
@@ -447,7 +522,34 @@ DTSTAMP:20240429T181103Z
 SUMMARY:February recurrence with different summary
 END:VEVENT
 END:VCALENDAR""",
-        )
+            ),
+        }
+        def add_fixture(name):
+            objclass, data = fixtures[name]
+            if isinstance(data, dict):
+                return add_if_not_existing(objclass, **data)
+            else:
+                return add_if_not_existing(objclass, data)
+
+        expected = {}
+        kinds = {}
+        for objclass, data in fixtures.values():
+            values = _fixture_values(data)
+            expected[values["uid"]] = values
+            kinds[values["uid"]] = objclass
+        changed = self._verify_fixtures(_concurrently(add_fixture, fixtures), expected)
+
+        ## Objects not coming back from the server as they were saved
+        changed_events = sorted(x for x in changed if kinds[x] == Event)
+        changed_tasks = sorted(x for x in changed if kinds[x] == Todo)
+        if changed_events:
+            self.set_feature("save-load.event", {"support": "fragile", "behaviour": f"changed when saved: {', '.join(changed_events)}"})
+        else:
+            self.set_feature("save-load.event")
+        if changed_tasks:
+            self.set_feature("save-load.todo", {"support": "fragile", "behaviour": f"changed when saved: {', '.join(changed_tasks)}"})
+        self.set_feature("save-load.event.recurrences")
+        self.set_feature("save-load.todo.recurrences")
 
         ## No more existing IDs in the calendar from 2000 ... otherwise,
         ## more work is needed to ensure those won't pollute the tests nor be
@@ -456,8 +558,77 @@ END:VCALENDAR""",
         assert self.checker.calendar.events()
         assert self.checker.tasklist.todos()
 
+    def _verify_fixtures(self, objects, expected):
+        """
+        Loads the fixtures back from the server and compares them
+        with what was saved (`expected`, as given by _fixture_values).
+        All of them are fetched in one calendar-multiget REPORT per
+        calendar.  If multiget is not supported (or misses some
+        objects), they are fetched one by one.
+
+        Returns the set of UIDs of the objects not coming back as
+        saved.
+        """
+        by_uid = {str(x.component["uid"]): x for x in objects}
+        found = {}
+        calendars = [self.checker.calendar]
+        if self.checker.tasklist is not self.checker.calendar:
+            calendars.append(self.checker.tasklist)
+        try:
+            for calendar in calendars:
+                urls = [x.url for x in objects if x.parent is calendar]
+                if not urls:
+                    continue
+                for obj in calendar.multiget(urls):
+                    uid = re.search(r"^UID:(.*?)\r?$", obj.data or "", re.M)
+                    if uid and uid.group(1) in by_uid:
+                        found[uid.group(1)] = obj.data
+        except Exception:
+            self.set_feature("multiget", False)
+        else:
+            self.set_feature("multiget", True if len(found) == len(by_uid) else "fragile")
+        for uid, data in found.items():
+            by_uid[uid].data = data
+
+        _concurrently(lambda obj: obj.load(), [x for uid, x in by_uid.items() if uid not in found])
+        return {uid for uid, obj in by_uid.items() if _fixture_values(obj.data) != expected[uid]}
+
+    def _existing_objects(self, calendar):
+        """
+        Finds the events and tasks already in the calendar.
+
+        Multiple comp-filters in one calendar-query are AND'ed (RFC
+        4791 section 9.7.1), so events and tasks can't be found with
+        one search.  A sync-collection REPORT gives the URLs of all
+        the objects in one request (without the calendar data, the
+        calendar may be a big and important one), and the test
+        objects (csc_*.ics) are then fetched with one multiget - on a
+        new calendar, the sync-collection REPORT is the only request.
+        If the server doesn't support it (the REPORT or the multiget
+        fails), fall back to searching for events and tasks in 2000
+        separately.
+        """
+        if self.expected_features.is_supported("sync-token") and self.expected_features.is_supported("multiget"):
+            try:
+                urls = [
+                    x.url for x in calendar.objects_by_sync_token()
+                    if str(x.url).rstrip("/").rsplit("/", 1)[-1].startswith("csc_")
+                ]
+                objects = [x for x in calendar.multiget(urls) if x.data and x.component is not None] if urls else []
+            except Exception:
+                pass
+            else:
+                return objects
+        events_from_2000 = calendar.search(
+            event=True, start=datetime(2000, 1, 1), end=datetime(2001, 1, 1)
+        )
+        tasks_from_2000 = calendar.search(
+            todo=True, start=datetime(2000, 1, 1), end=datetime(2001, 1, 1)
+        )
+        return events_from_2000 + tasks_from_2000
+
 
-class CheckSearch(Check):
+class CheckSearch(AsyncCheck):
     depends_on = {PrepareCalendar}
     features_to_be_checked = {
         "search.time-range.event",
@@ -469,50 +640,82 @@ class CheckSearch(Check):
         "search.combined-is-logical-and",
     }  ## TODO: we can do so much better than this
 
-    def _run_check(self):
+    async def _run_check(self):
         cal = self.checker.calendar
         tasklist = self.checker.tasklist
-        events = cal.search(
-            start=datetime(2000, 1, 1, tzinfo=utc),
-            end=datetime(2000, 1, 2, tzinfo=utc),
-            event=True,
+
+        ## All the searches below are independent of each other, so
+        ## they are sent in one go.  Some of them are only relevant
+        ## if the category search works - if not, the results (or
+        ## exceptions) are thrown away.
+        (
+            events,
+            tasks,
+            category_events,
+            fullstring_events,
+            smart_events,
+            events1,
+            events2,
+        ) = await asyncio.gather(
+            self.search(
+                cal,
+                start=datetime(2000, 1, 1, tzinfo=utc),
+                end=datetime(2000, 1, 2, tzinfo=utc),
+                event=True,
+            ),
+            self.search(
+                tasklist,
+                start=datetime(2000, 1, 9, tzinfo=utc),
+                end=datetime(2000, 1, 10, tzinfo=utc),
+                todo=True,
+                include_completed=True,
+            ),
+            self.search(cal, category="hands", event=True),
+            self.search(cal, category="hands,feet,head", event=True),
+            self.search(cal, category="feet,head,hands", event=True),
+            self.search(cal, category="hands", event=True, start=datetime(2000, 1, 1, 11, 0, 0), end=datetime(2000, 1, 13, 14, 0, 0)),
+            self.search(cal, category="hands", event=True, start=datetime(2000, 1, 1, 9, 0, 0), end=datetime(2000, 1, 6, 14, 0, 0)),
+            return_exceptions=True,
         )
+        for result in (events, tasks):
+            if isinstance(result, BaseException):
+                raise result
+
         self.set_feature("search.time-range.event", len(events) == 1)
-        tasks = tasklist.search(
-            start=datetime(2000, 1, 9, tzinfo=utc),
-            end=datetime(2000, 1, 10, tzinfo=utc),
-            todo=True,
-            include_completed=True,
-        )
         self.set_feature("search.time-range.todo", len(tasks) == 1)
 
         ## search.category
-        try:
-            events = cal.search(category="hands", event=True)
-            self.set_feature("search.category", len(events) == 1)
-        except ReportError:
+        if isinstance(category_events, ReportError):
             self.set_feature("search.category", "ungraceful")
+        elif isinstance(category_events, BaseException):
+            raise category_events
+        else:
+            self.set_feature("search.category", len(category_events) == 1)
         if self.feature_checked("search.category", str) != 'ungraceful':
-            events = cal.search(category="hands,feet,head", event=True)
-            self.set_feature("search.category.fullstring", len(events) == 1)
-            if len(events) == 1:
-                events = cal.search(category="feet,head,hands", event=True)
-                self.set_feature("search.category.fullstring.smart", len(events) == 1)
+            if isinstance(fullstring_events, BaseException):
+                raise fullstring_events
+            self.set_feature("search.category.fullstring", len(fullstring_events) == 1)
+            if len(fullstring_events) == 1:
+                if isinstance(smart_events, BaseException):
+                    raise smart_events
+                self.set_feature("search.category.fullstring.smart", len(smart_events) == 1)
 
         ## search.combined
         if self.feature_checked("search.category"):
-            events1 = cal.search(category="hands", event=True, start=datetime(2000, 1, 1, 11, 0, 0), end=datetime(2000, 1, 13, 14, 0, 0))
-            events2 = cal.search(category="hands", event=True, start=datetime(2000, 1, 1, 9, 0, 0), end=datetime(2000, 1, 6, 14, 0, 0))
+            for result in (events1, events2):
+                if isinstance(result, BaseException):
+                    raise result
             self.set_feature("search.combined-is-logical-and", len(events1) == 1 and len(events2) == 0)
 
         try:
             if self.feature_checked("search.time-range.todo"):
-                objects = cal.search(
+                objects = await self.search(
+                    cal,
                     start=datetime(2000, 1, 1, tzinfo=utc),
                     end=datetime(2001, 1, 1, tzinfo=utc),
                 )
             else:
-                objects = _filter_2000(cal.search())
+                objects = list(_filter_2000(await self.search(cal)))
             if len(objects) == 0:
                 self.set_feature(
                     "search.comp-type-optional",
@@ -533,7 +736,8 @@ class CheckSearch(Check):
                 cal != tasklist
                 and len(objects)
                 + len(
-                    tasklist.search(
+                    await self.search(
+                        tasklist,
                         start=datetime(2000, 1, 1, tzinfo=utc),
                         end=datetime(2001, 1, 1, tzinfo=utc),
                     )
@@ -562,7 +766,7 @@ class CheckSearch(Check):
             self.set_feature("search.comp-type-optional", {"support": "ungraceful"})
 
 
-class CheckRecurrenceSearch(Check):
+class CheckRecurrenceSearch(AsyncCheck):
     depends_on = {CheckSearch}
     features_to_be_checked = {
         "search.recurrences.includes-implicit.todo",
@@ -574,101 +778,111 @@ class CheckRecurrenceSearch(Check):
         "search.recurrences.expanded.exception",
     }
 
-    def _run_check(self):
+    async def _run_check(self):
         cal = self.checker.calendar
         tl = self.checker.tasklist
-        events = cal.search(
-            start=datetime(2000, 1, 12, tzinfo=utc),
-            end=datetime(2000, 1, 13, tzinfo=utc),
-            event=True,
-            post_filter=False,
-        )
-        assert len(events) == 1
-        if self.checker.features_checked.is_supported("search.time-range.todo"):
-            todos = tl.search(
+
+        ## The searches are independent of each other, so they are
+        ## sent in one go and the results are evaluated afterwards.
+        ## A failing search only fails the check if the result is used
+        ## (see _result), the event searches are evaluated before the
+        ## task searches.
+        searches = {
+            "events": self.search(
+                cal,
                 start=datetime(2000, 1, 12, tzinfo=utc),
                 end=datetime(2000, 1, 13, tzinfo=utc),
+                event=True,
+                post_filter=False,
+            ),
+            "implicit_events": self.search(
+                cal,
+                start=datetime(2000, 2, 12, tzinfo=utc),
+                end=datetime(2000, 2, 13, tzinfo=utc),
+                event=True,
+                post_filter=False,
+            ),
+            "todos1": self.search(
+                tl,
+                start=datetime(2000, 2, 12, tzinfo=utc),
+                end=datetime(2000, 2, 13, tzinfo=utc),
                 todo=True,
                 include_completed=True,
                 post_filter=False,
-            )
-            assert len(todos) == 1
-        events = cal.search(
-            start=datetime(2000, 2, 12, tzinfo=utc),
-            end=datetime(2000, 2, 13, tzinfo=utc),
-            event=True,
-            post_filter=False,
-        )
-        self.set_feature("search.recurrences.includes-implicit.event", len(events) == 1)
-        todos1 = tl.search(
-            start=datetime(2000, 2, 12, tzinfo=utc),
-            end=datetime(2000, 2, 13, tzinfo=utc),
-            todo=True,
-            include_completed=True,
-            post_filter=False,
-        )
-        self.set_feature("search.recurrences.includes-implicit.todo", len(todos1) == 1)
-
-        if todos1:
-            todos2 = tl.search(
+            ),
+            "exception": self.search(
+                cal,
+                start=datetime(2000, 2, 13, 11, tzinfo=utc),
+                end=datetime(2000, 2, 13, 13, tzinfo=utc),
+                event=True,
+                post_filter=False,
+            ),
+            "far_future_recurrence": self.search(
+                cal,
+                start=datetime(2045, 3, 12, tzinfo=utc),
+                end=datetime(2045, 3, 13, tzinfo=utc),
+                event=True,
+                post_filter=False,
+            ),
+            ## server-side expansion
+            "expanded_events": self.search(
+                cal,
                 start=datetime(2000, 2, 12, tzinfo=utc),
                 end=datetime(2000, 2, 13, tzinfo=utc),
+                event=True,
+                server_expand=True,
+                post_filter=False,
+            ),
+            "expanded_todos": self.search(
+                cal,
+                start=datetime(2000, 2, 12, tzinfo=utc),
+                end=datetime(2000, 2, 13, tzinfo=utc),
+                todo=True,
+                server_expand=True,
+                post_filter=False,
+            ),
+            "expanded_exception": self.search(
+                cal,
+                start=datetime(2000, 2, 13, 11, tzinfo=utc),
+                end=datetime(2000, 2, 13, 13, tzinfo=utc),
+                event=True,
+                server_expand=True,
+                post_filter=False,
+            ),
+        }
+        if self.checker.features_checked.is_supported("search.time-range.todo"):
+            searches["todos"] = self.search(
+                tl,
+                start=datetime(2000, 1, 12, tzinfo=utc),
+                end=datetime(2000, 1, 13, tzinfo=utc),
                 todo=True,
+                include_completed=True,
                 post_filter=False,
             )
-            self.set_feature("search.recurrences.includes-implicit.todo.pending", len(todos2) == 1)
+        results = dict(zip(searches, await asyncio.gather(*searches.values(), return_exceptions=True)))
 
-        exception = cal.search(
-            start=datetime(2000, 2, 13, 11, tzinfo=utc),
-            end=datetime(2000, 2, 13, 13, tzinfo=utc),
-            event=True,
-            post_filter=False,
-        )
-        assert len(exception) == 1
-        far_future_recurrence = cal.search(
-            start=datetime(2045, 3, 12, tzinfo=utc),
-            end=datetime(2045, 3, 13, tzinfo=utc),
-            event=True,
-            post_filter=False,
-        )
+        def _result(name):
+            if isinstance(results[name], Exception):
+                raise results[name]
+            return results[name]
+
+        assert len(_result("events")) == 1
+        events = _result("implicit_events")
+        self.set_feature("search.recurrences.includes-implicit.event", len(events) == 1)
+
+        assert len(_result("exception")) == 1
         self.set_feature(
             "search.recurrences.includes-implicit.infinite-scope", len(events) == 1
         )
 
-        ## server-side expansion
-        events = cal.search(
-            start=datetime(2000, 2, 12, tzinfo=utc),
-            end=datetime(2000, 2, 13, tzinfo=utc),
-            event=True,
-            server_expand=True,
-            post_filter=False,
-        )
+        events = _result("expanded_events")
         self.set_feature(
             "search.recurrences.expanded.event",
             len(events) == 1
             and events[0].component["dtstart"]
             == datetime(2000, 2, 12, 12, 0, 0, tzinfo=utc),
         )
-        todos = cal.search(
-            start=datetime(2000, 2, 12, tzinfo=utc),
-            end=datetime(2000, 2, 13, tzinfo=utc),
-            todo=True,
-            server_expand=True,
-            post_filter=False,
-        )
-        self.set_feature(
-            "search.recurrences.expanded.todo",
-            len(todos) == 1
-            and todos[0].component["dtstart"]
-            == datetime(2000, 2, 12, 12, 0, 0, tzinfo=utc),
-        )
-        exception = cal.search(
-            start=datetime(2000, 2, 13, 11, tzinfo=utc),
-            end=datetime(2000, 2, 13, 13, tzinfo=utc),
-            event=True,
-            server_expand=True,
-            post_filter=False,
-        )
+        exception = _result("expanded_exception")
         self.set_feature(
             "search.recurrences.expanded.exception",
             len(exception) == 1
@@ -678,3 +892,443 @@ class CheckRecurrenceSearch(Check):
             == "February recurrence with different summary"
             and getattr(exception[0].component.get('RECURRENCE_ID'), 'dt', None) == datetime(2000, 2, 13, 12, tzinfo=utc)
         )
+
+        if "todos" in searches:
+            assert len(_result("todos")) == 1
+        todos1 = _result("todos1")
+        self.set_feature("search.recurrences.includes-implicit.todo", len(todos1) == 1)
+
+        if todos1:
+            todos2 = await self.search(
+                tl,
+                start=datetime(2000, 2, 12, tzinfo=utc),
+                end=datetime(2000, 2, 13, tzinfo=utc),
+                todo=True,
+                post_filter=False,
+            )
+            self.set_feature("search.recurrences.includes-implicit.todo.pending", len(todos2) == 1)
+
+        todos = _result("expanded_todos")
+        self.set_feature(
+            "search.recurrences.expanded.todo",
+            len(todos) == 1
+            and todos[0].component["dtstart"]
+            == datetime(2000, 2, 12, 12, 0, 0, tzinfo=utc),
+        )
+
+
+def _time(check, operation):
+    """
+    The time (in milliseconds) spent waiting for the server when
+    doing the operation, and the result of the operation.  Time spent
+    in the rate limiter is not included, and the query cache is
+    bypassed.
+    """
+    timing = Timing()
+    with timing.measure(), querycache.bypass():
+        result = operation()
+    check.timing.add(timing)
+    return timing.network * 1000, result
+
+
+class CheckServerLatency(Check):
+    """
+    Measures the response times for the basic operations towards the
+    test calendar.  Each operation is repeated `samples` times, and
+    the p50, p95 and p99 percentiles are recorded (in milliseconds).
+
+    The events used for PUT, GET and DELETE are in 1999, so they
+    won't show up in the searches done by the other checks.  They are
+    deleted again after each sample, even if the GET fails.  The
+    check is not run in parallel with other checks (exclusive), as
+    checks looking at all changes in the calendar (like a sync) would
+    see them.
+
+    This sends some hundred requests (many of them writes), which may
+    take a long time towards a rate limited server, so it's opt-in,
+    i.e. `--run-checks CheckServerLatency`.
+    """
+
+    depends_on = {PrepareCalendar}
+    opt_in = True
+    exclusive = True
+    features_to_be_checked = {
+        "latency.propfind",
+        "latency.report",
+        "latency.put",
+        "latency.get",
+        "latency.delete",
+    }
+    samples = 20
+
+    def _time(self, operation):
+        return _time(self, operation)[0]
+
+    def _observe(self, feature, latencies):
+        if len(latencies) < 2:
+            self.set_feature(feature, None)
+            return
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        self.set_feature(feature, {
+            "support": "full",
+            "p50": round(percentiles[49], 1),
+            "p95": round(percentiles[94], 1),
+            "p99": round(percentiles[98], 1),
+            "samples": len(latencies),
+        })
+
+    def _run_check(self):
+        cal = self.checker.calendar
+        query, comp_class = cal.build_search_xml_query(
+            event=True,
+            start=datetime(2000, 1, 1, tzinfo=utc),
+            end=datetime(2000, 2, 1, tzinfo=utc),
+        )
+        latencies = {x: [] for x in ("propfind", "report", "put", "get", "delete")}
+        for i in range(self.samples):
+            latencies["propfind"].append(self._time(lambda: cal.get_properties([dav.DisplayName()])))
+            latencies["report"].append(self._time(lambda: cal._query(query, 1, "report")))
+
+            url = str(cal.url.join(f"csc_latency_{i}.ics"))
+            data = f"""BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tobixen//Caldav-Server-Tester//en_DK
+BEGIN:VEVENT
+UID:csc_latency_{i}
+DTSTART:19991201T120000Z
+DTEND:19991201T130000Z
+DTSTAMP:20240429T181103Z
+SUMMARY:latency check event
+END:VEVENT
+END:VCALENDAR
+"""
+            try:
+                latencies["put"].append(self._time(
+                    lambda: self.client.put(url, data, {"Content-Type": 'text/calendar; charset="utf-8"'})
+                ))
+            except Exception:
+                ## Probably a read-only calendar - no point trying again
+                break
+            try:
+                try:
+                    latencies["get"].append(self._time(lambda: self.client.request(url)))
+                finally:
+                    ## Nothing should be left behind
+                    latencies["delete"].append(self._time(lambda: self.client.delete(url)))
+            except Exception:
+                break
+
+        for operation, observed in latencies.items():
+            self._observe(f"latency.{operation}", observed)
+
+
+_SYNC_QUERY = """<?xml version="1.0" encoding="utf-8"?>
+<D:sync-collection xmlns:D="DAV:">
+  <D:sync-token>{token}</D:sync-token>
+  <D:sync-level>1</D:sync-level>{limit}
+  <D:prop>
+    <D:getetag/>
+  </D:prop>
+</D:sync-collection>
+"""
+
+
+def _path(url):
+    return unquote(urlsplit(str(url)).path)
+
+
+class CheckSyncToken(Check):
+    """
+    Checks the sync-collection REPORT (RFC6578) on the test calendar
+    - that a sync token is given, that changes and deletions are
+    reported in an incremental sync, that invalid sync tokens are
+    refused and that the limit is respected.  The size of the
+    response to an incremental sync is compared with a full sync.
+
+    The event used for checking the incremental sync is in 1999, so
+    it won't show up in the searches done by the other checks.  The
+    check writes to the test calendar, so it's not run in parallel
+    with other checks (exclusive).  Other clients may still write to
+    the calendar, so the conclusions are drawn from the event added
+    by this check and the objects that were there from before only.
+    The efficiency is not recorded if other changes were included in
+    the incremental sync.
+    """
+
+    depends_on = {PrepareCalendar}
+    exclusive = True
+    features_to_be_checked = {
+        "sync-token",
+        "sync-token.incremental",
+        "sync-token.incremental.delete",
+        "sync-token.invalid-token",
+        "sync-token.limit",
+        "sync-token.efficiency",
+    }
+
+    def _sync(self, token="", limit=None):
+        """
+        Sends a sync-collection REPORT asking for the etags.  Returns
+        a dict with the status, the (path, status) of each response
+        element, the new sync token and the size of the response.
+        """
+        limit = f"\n  <D:limit><D:nresults>{limit}</D:nresults></D:limit>" if limit is not None else ""
+        query = _SYNC_QUERY.format(token=xml_escape(token), limit=limit)
+        try:
+            ## The response size should be measured, not taken from the cache
+            with querycache.bypass():
+                response = self.client.report(str(self.checker.calendar.url), query, depth=1)
+        except AuthorizationError:
+            ## The caldav library raises on 403
+            return {"status": 403, "results": [], "token": None, "size": 0}
+        ret = {"status": response.status, "results": [], "token": None, "size": len(response._raw or b"")}
+        if response.status == 207 and response.tree is not None:
+            for element in response.tree.iter(dav.Response.tag):
+                ret["results"].append((_path(element.findtext(dav.Href.tag)), element.findtext(dav.Status.tag)))
+            ret["token"] = response.tree.findtext(dav.SyncToken.tag)
+        return ret
+
+    def _check_incremental(self, full, after_put, after_delete, path):
+        changed = [x for x in after_put["results"] if x[0] == path]
+        ## Objects from before that are reported as changed.  If all
+        ## of them are, the server is ignoring the sync token
+        existing = {x[0] for x in full["results"]}
+        unchanged = {x[0] for x in after_put["results"]} & existing
+        if after_put["status"] != 207:
+            self.set_feature("sync-token.incremental", "ungraceful")
+        elif not changed:
+            self.set_feature("sync-token.incremental", {"support": "broken", "behaviour": "new object not reported"})
+        elif existing and unchanged == existing:
+            self.set_feature("sync-token.incremental", {"support": "unsupported", "behaviour": "full sync on every request"})
+        else:
+            self.set_feature("sync-token.incremental")
+
+        deleted = [x for x in after_delete["results"] if x[0] == path]
+        if after_delete["status"] != 207:
+            self.set_feature("sync-token.incremental.delete", "ungraceful")
+        elif deleted and deleted[0][1] and "404" in deleted[0][1]:
+            self.set_feature("sync-token.incremental.delete")
+        else:
+            self.set_feature("sync-token.incremental.delete", False)
+
+        if len(after_put["results"]) > len(changed) + len(unchanged):
+            ## Changes done by someone else in the meantime
+            self.set_feature("sync-token.efficiency", None)
+            return
+        self.set_feature("sync-token.efficiency", {
+            "support": "full",
+            "full_bytes": full["size"],
+            "full_objects": len(full["results"]),
+            "incremental_bytes": after_put["size"],
+            "incremental_objects": len(after_put["results"]),
+            "ratio": round(after_put["size"] / full["size"], 3) if full["size"] else None,
+        })
+
+    def _check_invalid_token(self):
+        try:
+            invalid = self._sync("http://caldav-server-tester.invalid/sync/1")
+        except Exception:
+            self.set_feature("sync-token.invalid-token", "ungraceful")
+            return
+        if invalid["status"] in (403, 409):
+            self.set_feature("sync-token.invalid-token")
+        elif invalid["status"] == 207:
+            self.set_feature("sync-token.invalid-token", {"support": "unsupported", "behaviour": "full sync"})
+        else:
+            self.set_feature("sync-token.invalid-token", "ungraceful")
+
+    def _check_limit(self):
+        collection = _path(self.checker.calendar.url)
+        try:
+            limited = self._sync(limit=1)
+        except Exception:
+            self.set_feature("sync-token.limit", "ungraceful")
+            return
+        if 400 <= limited["status"] < 500:
+            self.set_feature("sync-token.limit", {"support": "unsupported", "behaviour": "limit refused"})
+            return
+        if limited["status"] != 207:
+            self.set_feature("sync-token.limit", "ungraceful")
+            return
+        objects = [x for x in limited["results"] if x[0].rstrip("/") != collection.rstrip("/")]
+        truncated = any(x[1] and "507" in x[1] for x in limited["results"] if x not in objects)
+        if len(objects) > 1:
+            self.set_feature("sync-token.limit", {"support": "unsupported", "behaviour": "limit ignored"})
+        elif truncated:
+            self.set_feature("sync-token.limit")
+        else:
+            self.set_feature("sync-token.limit", "fragile")
+
+    def _run_check(self):
+        cal = self.checker.calendar
+        try:
+            full = self._sync()
+        except Exception:
+            full = None
+        if full is None or full["status"] != 207 or not full["token"]:
+            self.set_feature("sync-token", False)
+            return
+        self.set_feature("sync-token")
+
+        url = str(cal.url.join("csc_sync_event.ics"))
+        data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tobixen//Caldav-Server-Tester//en_DK
+BEGIN:VEVENT
+UID:csc_sync_event
+DTSTART:19991201T120000Z
+DTEND:19991201T130000Z
+DTSTAMP:20240429T181103Z
+SUMMARY:sync check event
+END:VEVENT
+END:VCALENDAR
+"""
+        try:
+            self.client.put(url, data, {"Content-Type": 'text/calendar; charset="utf-8"'})
+        except Exception:
+            ## Probably a read-only calendar
+            for feature in ("sync-token.incremental", "sync-token.incremental.delete", "sync-token.efficiency"):
+                self.set_feature(feature, None)
+        else:
+            try:
+                after_put = self._sync(full["token"])
+            finally:
+                self.client.delete(url)
+            after_delete = self._sync(after_put["token"] or full["token"])
+            self._check_incremental(full, after_put, after_delete, _path(url))
+
+        self._check_invalid_token()
+        self._check_limit()
+
+
+class CheckCalendarScaling(Check):
+    """
+    Measures how the search latency grows with the size of the
+    calendar.  A dedicated calendar is filled up with synthetic
+    events (100, 1000 and 10000), and at each size the time-range
+    search, the category search and the listing of all events are
+    timed (median of `samples` runs, in milliseconds).  Searches
+    giving fewer objects than expected are reported as truncated.
+
+    The growth curve is given for each operation, and the exponent
+    is the slope in log-log scale between the smallest and the
+    largest calendar - 0 means constant time, 1 linear growth.
+
+    This is slow and puts some load on the server, so it's opt-in,
+    i.e. `--run-checks CheckCalendarScaling`.  The calendar is
+    deleted afterwards.
+    """
+
+    depends_on = {CheckMakeDeleteCalendar}
+    features_to_be_checked = {
+        "scaling.time-range-search",
+        "scaling.category-search",
+        "scaling.list",
+    }
+    opt_in = True
+    sizes = (100, 1000, 10000)
+    samples = 3
+    ## Number of concurrent uploads when filling up the calendar
+    workers = 16
+    cal_id = "caldav-server-checker-scaling"
+
+    @staticmethod
+    def _event(i):
+        ## One event per day through 2000, every 10th is a needle
+        dtstart = datetime(2000, 1, 1, 12, tzinfo=utc) + timedelta(days=i % 365)
+        return f"""BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tobixen//Caldav-Server-Tester//en_DK
+BEGIN:VEVENT
+UID:csc_scaling_{i}
+DTSTART:{dtstart.strftime("%Y%m%dT%H%M%SZ")}
+DTEND:{(dtstart + timedelta(hours=1)).strftime("%Y%m%dT%H%M%SZ")}
+DTSTAMP:20240429T181103Z
+CATEGORIES:{"needle" if i % 10 == 0 else "hay"}
+SUMMARY:scaling check event {i}
+END:VEVENT
+END:VCALENDAR
+"""
+
+    def _operations(self, cal):
+        """
+        {operation: (search, expected number of results for n objects)}
+        """
+        return {
+            "time-range-search": (
+                lambda: cal.search(event=True, start=datetime(2000, 1, 1, tzinfo=utc), end=datetime(2000, 2, 1, tzinfo=utc)),
+                lambda n: sum(1 for i in range(n) if i % 365 < 31),
+            ),
+            "category-search": (
+                lambda: cal.search(event=True, category="needle"),
+                lambda n: len(range(0, n, 10)),
+            ),
+            "list": (
+                lambda: cal.events(),
+                lambda n: n,
+            ),
+        }
+
+    def _measure(self, search, size, expected):
+        point = {"objects": size, "ms": None, "results": None, "expected": expected}
+        latencies = []
+        try:
+            for _ in range(self.samples):
+                latency, found = _time(self, search)
+                latencies.append(latency)
+        except Exception as e:
+            point["error"] = e.__class__.__name__
+            return point
+        point["ms"] = round(statistics.median(latencies), 1)
+        point["results"] = len(found)
+        return point
+
+    def _observe(self, feature, curve):
+        measured = [x for x in curve if x["ms"]]
+        if not measured:
+            self.set_feature(feature, None)
+            return
+        first, last = measured[0], measured[-1]
+        exponent = None
+        if last["objects"] > first["objects"]:
+            exponent = round(math.log(last["ms"] / first["ms"]) / math.log(last["objects"] / first["objects"]), 2)
+        self.set_feature(feature, {
+            "support": "full",
+            "curve": curve,
+            "exponent": exponent,
+            "truncated": [x["objects"] for x in curve if x["results"] is not None and x["results"] < x["expected"]],
+        })
+
+    def _run_check(self):
+        try:
+            try:
+                self.checker.principal.calendar(cal_id=self.cal_id).delete()
+            except Exception:
+                pass
+            cal = self.checker.principal.make_calendar(cal_id=self.cal_id, name="Calendar for checking server scaling")
+        except Exception:
+            ## Without a dedicated calendar, there is nothing to check
+            for feature in self.features_to_be_checked:
+                self.set_feature(feature, None)
+            return
+
+        try:
+            operations = self._operations(cal)
+            curves = {x: [] for x in operations}
+            cnt = 0
+            for size in self.sizes:
+                try:
+                    _concurrently(lambda i: cal.save_event(self._event(i)), range(cnt, size), workers=self.workers)
+                except Exception:
+                    ## The calendar is full, or the server is giving up
+                    break
+                cnt = size
+                for operation, (search, expected) in operations.items():
+                    curves[operation].append(self._measure(search, size, expected(size)))
+            for operation, curve in curves.items():
+                self._observe(f"scaling.{operation}", curve)
+        finally:
+            try:
+                cal.delete()
+            except Exception:
+                pass
@@ -1,12 +1,99 @@
 from caldav.compatibility_hints import FeatureSet
+from contextlib import contextmanager
+import asyncio
 import copy
+import importlib
 import logging
+import threading
+import types
+
+from . import metadata
+from .instrumentation import Timing
+
+## Checks may run concurrently (see scheduler.py).  The FeatureSet is
+## not thread safe, so the writes to the checked features (through
+## the FeatureJournal and when loading cached results) and the reads
+## done by the checker and Check.feature_checked are done while
+## holding this lock.  The caldav library itself reads client.features
+## (which is the checked feature set while the checks are running)
+## without the lock - it may see a feature being written by a check
+## running in parallel.
+_lock = threading.RLock()
 
 ## WORK IN PROGRESS
 
-## TODO: We need some collector framework that can collect all checks,
-## build a dependency graph and mapping from a feature to the relevant
-## check.
+## The dependency graph is built in scheduler.py, the mapping from a
+## feature to the relevant checks is built by feature_index below.
+
+## Every check class is registered here when it's defined (see
+## Check.__init_subclass__).  Use all_checks() or find_check() rather
+## than accessing it directly, those will load the check modules.
+_registry = []
+
+## Checks from other packages are found through entry points, see
+## metadata.ENTRY_POINT_GROUP
+_BUILTIN_MODULE = "caldav_server_tester.checks"
+
+
+def compare_expectation(feature, observed, expected_features, feature_set):
+    """
+    Compares the observed value for a feature with the expected
+    value.  Returns None if it's as expected (or can't be checked
+    reliably), otherwise a tuple (expected, observed).
+    """
+    feat_def = feature_set.find_feature(feature)
+    feat_type = feat_def.get('type', 'server-feature')
+    sup = observed.get('support', feat_def.get('default', 'full'))
+
+    if feat_type not in ('server-peculiarity', 'server-feature'):
+        ## client-behaviour, tests-behaviour or client-feature
+        ## cannot be checked for reliably (and is not supposed to
+        ## be checked by the script).  server-observation is unreliable.
+        assert(feat_type in ('server-observation',))
+        return None
+
+    ## Fragile support is ... fragile and should be ignored
+    if sup == 'fragile' or expected_features.is_supported(feature, str) == 'fragile':
+        return None
+
+    expected = expected_features.is_supported(feature, dict)
+
+    ## Strip all free-text information from both observed and expected.
+    ## Observed delays varies from run to run, so those are stripped as well.
+    strip = ("behaviour", "description", "delay")
+    if {x: y for x, y in observed.items() if x not in strip} == {x: y for x, y in expected.items() if x not in strip}:
+        return None
+    return (expected, observed)
+
+
+class FeatureJournal:
+    """
+    Records the features written by one check.  All writes from a
+    check goes through the journal (see Check.set_feature), so the
+    bookkeeping after the check is proportional to what the check has
+    touched rather than to the size of the whole feature set.
+    """
+
+    def __init__(self):
+        ## (feature, value) for every write, in order
+        self.entries = []
+        ## The resulting value for every feature written
+        self._features = {}
+
+    def write(self, feature_set, feature, value):
+        with _lock:
+            feature_set.copyFeatureSet({feature: value}, collapse=False)
+            self.entries.append((feature, value))
+            self._features.setdefault(feature, {}).update(value)
+
+    def keys(self):
+        return set(self._features)
+
+    def features(self):
+        """
+        `{feature: value}` for all the features written
+        """
+        return copy.deepcopy(self._features)
 
 
 class Check:
@@ -21,10 +108,34 @@ class Check:
 
     features_checked = set()
     depends_on = set()
+    ## Checks with results not to be cached at all
+    cacheable = True
+    ## Checks setting up state for other checks (like the test
+    ## calendar) needs to be run whenever a check depending on them
+    ## is run.  The results are only taken from the cache when no
+    ## such check is to be run.
+    prerequisite = False
+    ## Slow or intrusive checks are only run when explicitly asked
+    ## for (check_one, check_features), not by check_all
+    opt_in = False
+    ## Checks writing to the shared test calendar are not run in
+    ## parallel with any other checks (see the scheduler module)
+    exclusive = False
+
+    def __init_subclass__(cls, abstract=False, **kwargs):
+        ## Base classes for checks (like AsyncCheck) should be
+        ## declared with abstract=True
+        super().__init_subclass__(**kwargs)
+        if not abstract:
+            _registry.append(cls)
 
     def __init__(self, checker):
         self.checker = checker
         self.client = checker._client_obj
+        ## features set by this very check instance
+        self.journal = FeatureJournal()
+        ## time and traffic spent by this very check instance
+        self.timing = Timing()
 
     def set_feature(self, feature, value=True):
         fs = self.checker._features_checked
@@ -40,52 +151,34 @@ class Check:
             fc = {feature: {"support": "unknown"}}
         else:
             assert False
-        fs.copyFeatureSet(fc, collapse=False)
-        feat_def = self.checker._features_checked.find_feature(feature)
-        feat_type = feat_def.get('type', 'server-feature')
-        sup = fc[feature].get('support', feat_def.get('default', 'full'))
+        self.journal.write(fs, feature, fc[feature])
+        if self.checker.stream is not None:
+            self.checker.stream.feature(self, feature, fc[feature])
 
         ## The last bit is about verifying that the expectations are met.
 
-        ## We skip this if debug_mode is None
-        if self.checker.debug_mode is None:
-            return
-        
-        if feat_type not in ('server-peculiarity', 'server-feature'):
-            ## client-behaviour, tests-behaviour or client-feature
-            ## cannot be checked for reliably (and is not supposed to
-            ## be checked by the script).  server-observation is unreliable.
-            assert(feat_type in ('server-observation',))
+        ## We skip this if debug_mode is None.  With debug_mode
+        ## 'report', all the features are compared in one go after
+        ## the run (see ServerQuirkChecker.expectation_diff)
+        if self.checker.debug_mode in (None, 'report'):
             return
 
-        ## Fragile support is ... fragile and should be ignored
-        if sup == 'fragile' or self.expected_features.is_supported(feature, str) == 'fragile':
+        diff = compare_expectation(feature, fc[feature], self.expected_features, fs)
+        if diff is None:
             return
 
-        expected_ = self.expected_features.is_supported(feature, dict)
-        expected = copy.deepcopy(expected_)
-        observed = copy.deepcopy(fc[feature])
-
-        ## Strip all free-text information from both observed and expected
-        for stripdict in observed, expected:
-                for y in ("behaviour", "description"):
-                    if y in stripdict:
-                        stripdict.pop(y)
-
         if self.checker.debug_mode == 'assert':
-            assert(observed == expected)
-            return
-        
-        if observed != expected:
-            if self.checker.debug_mode == 'logging':
-                logging.error(f"Server checker found something unexpected for {feature}.  Expected: {expected_}, observed: {fc[feature]}")
-            elif self.checker.debug_mode == 'pdb':
-                import pdb; pdb.set_trace()
-            else:
-                assert(False)
+            assert(False)
+        elif self.checker.debug_mode == 'logging':
+            logging.error(f"Server checker found something unexpected for {feature}.  Expected: {diff[0]}, observed: {diff[1]}")
+        elif self.checker.debug_mode == 'pdb':
+            import pdb; pdb.set_trace()
+        else:
+            assert(False)
 
     def feature_checked(self, feature, return_type=bool):
-        return self.checker._features_checked.is_supported(feature, return_type)
+        with _lock:
+            return self.checker._features_checked.is_supported(feature, return_type)
 
     def run_check(self, only_once=True):
         if only_once:
@@ -94,29 +187,41 @@ class Check:
         for foo in self.depends_on:
             foo(self.checker).run_check(only_once=only_once)
 
-        ## TODO: record what new features are checked.  Everything in
-        ## self.features_checked should be covered, everyhing not in
-        ## self.features_checked should not be checked.
-        keys_before = set(
-            self.checker._features_checked.dotted_feature_set_list().keys()
-        )
-        
-        ## expected_features is the preconfigured feature set for this server.
-        self.expected_features = self.checker._client_obj.features
-        try:
-            ## we should blank out the non-checked features -
-            ## otherwise various workarounds may be invoked in the
-            ## code, and we'll check nothing
-            self.checker._client_obj.features = self.checker._features_checked
+        with self._checking():
             self._run_check()
-        finally:
-            self.checker._client_obj.features = self.expected_features
 
-        ## Check that all the declared checking has been done
-        keys_after = set(
-            self.checker._features_checked.dotted_feature_set_list().keys()
-        )
-        new_keys = keys_after - keys_before
+    @contextmanager
+    def _checking(self):
+        """
+        Wraps around the _run_check call - blanks out the expected
+        features while the check is running and verifies that the
+        declared features have been checked afterwards.
+        """
+        if self.checker.stream is not None:
+            self.checker.stream.check_started(self)
+        if self.checker._client_obj.features is self.checker._features_checked:
+            ## The scheduler has already blanked out the features for
+            ## the whole (parallel) run
+            self.expected_features = self.checker.expected_features
+            with self.timing.measure():
+                yield
+        else:
+            ## expected_features is the preconfigured feature set for this server.
+            self.expected_features = self.checker._client_obj.features
+            try:
+                ## we should blank out the non-checked features -
+                ## otherwise various workarounds may be invoked in the
+                ## code, and we'll check nothing
+                self.checker._client_obj.features = self.checker._features_checked
+                with self.timing.measure():
+                    yield
+            finally:
+                self.checker._client_obj.features = self.expected_features
+
+        ## Check that all the declared checking has been done.  Other
+        ## checks may be running in parallel, so only the keys set by
+        ## this check counts - as recorded in the journal.
+        new_keys = self.journal.keys()
         missing_keys = self.features_to_be_checked - new_keys
         parent_keys = ()
 
@@ -127,7 +232,7 @@ class Check:
             feature_ = missing
             while "." in feature_:
                 feature_ = feature_[: feature_.rfind(".")]
-                if feature_ in keys_after:
+                if feature_ in new_keys:
                     missing_keys.remove(missing)
                     parent_keys.add(feature_)
                     break
@@ -142,8 +247,157 @@ class Check:
         assert not extra_keys
 
         self.checker._checks_run.add(self.__class__)
+        self.checker._check_done(self)
 
     def _run_check(self):
         raise NotImplementedError(
             f"A subclass {self.__class__} hasn't implemented the _run_check method"
         )
+
+
+class AsyncCheck(Check, abstract=True):
+    """
+    Base class for checks with an `async _run_check`.
+
+    Typically used for checks doing lots of independent requests
+    towards the server, those can be overlapped with asyncio.gather.
+    The sync run_check API is still available, it will run the
+    check in it's own event loop.
+    """
+
+    def run_check(self, only_once=True):
+        asyncio.run(self.run_check_async(only_once=only_once))
+
+    async def run_check_async(self, only_once=True):
+        if only_once:
+            if self.__class__ in self.checker._checks_run:
+                return
+        for foo in self.depends_on:
+            dep = foo(self.checker)
+            if isinstance(dep, AsyncCheck):
+                await dep.run_check_async(only_once=only_once)
+            else:
+                await asyncio.to_thread(dep.run_check, only_once=only_once)
+
+        with self._checking():
+            await self._run_check()
+
+    async def search(self, calendar, **searchargs):
+        """
+        Does calendar.search(**searchargs) without blocking the event loop.
+
+        When the checker is driving an async client (see
+        ServerQuirkChecker.check_all_async), the search is done
+        through it.  Otherwise the blocking search is done in a
+        worker thread.
+        """
+        acal = self.checker.async_calendar(calendar)
+        if acal is None:
+            return await asyncio.to_thread(calendar.search, **searchargs)
+        return await acal.search(**searchargs)
+
+    async def _run_check(self):
+        raise NotImplementedError(
+            f"A subclass {self.__class__} hasn't implemented the _run_check method"
+        )
+
+
+def _entry_points():
+    return metadata.entry_points()
+
+
+def _module_name(obj):
+    return obj.__name__ if isinstance(obj, types.ModuleType) else obj.__module__
+
+
+def _checks_in(modules):
+    return [cl for cl in _registry if cl.__module__ in modules]
+
+
+def in_definition_order(classes):
+    """
+    Returns the check classes as a list, in the order they were defined
+    """
+    return [cl for cl in _registry if cl in classes]
+
+
+def all_checks(plugins=True):
+    """
+    Returns all the check classes - the ones in the checks module,
+    and (unless plugins=False) the ones from other packages (found
+    through the entry points).  Only classes from those modules are
+    returned, so check classes defined i.e. in the tests are not
+    included.
+    """
+    importlib.import_module(_BUILTIN_MODULE)
+    modules = {_BUILTIN_MODULE}
+    if plugins:
+        for entry_point in _entry_points():
+            modules.add(_module_name(entry_point.load()))
+    return _checks_in(modules)
+
+
+def find_check(name):
+    """
+    Returns the check class with the given name.  Entry points for
+    other checks are only loaded if the check is not a built-in one,
+    and then only the one with the given name.
+    """
+    importlib.import_module(_BUILTIN_MODULE)
+    for cl in _checks_in({_BUILTIN_MODULE}):
+        if cl.__name__ == name:
+            return cl
+    for entry_point in _entry_points():
+        if entry_point.name == name:
+            obj = entry_point.load()
+            return getattr(obj, name) if isinstance(obj, types.ModuleType) else obj
+    raise ValueError(f"No check named {name}")
+
+
+def feature_index(classes):
+    """
+    Returns a dict `{feature: set of check classes checking it}`,
+    built from `features_to_be_checked` of the check classes.
+    """
+    index = {}
+    for cl in classes:
+        for feature in getattr(cl, "features_to_be_checked", ()):
+            index.setdefault(feature, set()).add(cl)
+    return index
+
+
+def checks_for_features(classes, features):
+    """
+    Returns the set of check classes needed for checking the
+    features, including the checks they depend on.
+
+    For a feature that isn't checked directly, the checks for
+    the subfeatures (`search.recurrences` -> all the
+    `search.recurrences.*`-features) are used - or, if there are
+    none, the checks for the nearest parent feature.  A ValueError is
+    raised for features no check knows anything about.
+    """
+    index = feature_index(classes)
+    ret = set()
+    for feature in features:
+        found = set(index.get(feature, ()))
+        if not found:
+            for checked, checks in index.items():
+                if checked.startswith(feature + "."):
+                    found.update(checks)
+        parent = feature
+        while not found and "." in parent:
+            parent = parent[: parent.rfind(".")]
+            found = set(index.get(parent, ()))
+        if not found:
+            raise ValueError(f"No check found for the feature {feature}")
+        ret.update(found)
+
+    ## ... and the checks they depend on
+    todo = list(ret)
+    while todo:
+        for dep in todo.pop().depends_on:
+            if dep not in ret:
+                ret.add(dep)
+                todo.append(dep)
+    return ret
@@ -0,0 +1,171 @@
+"""
+Comparing a report with a previous report for the same server.
+
+The features in a report are in the compact form - features with the
+default value are left out, and subfeatures having the same value
+are collapsed into the parent.  A feature missing in a report has the
+value of the nearest parent given, or else the default value (as in
+FeatureSet.is_supported).  The comparison is done directly on the
+dicts, without building FeatureSet objects, so that hundreds of
+reports can be compared quickly.
+
+Only server features and server peculiarities are compared - server
+observations (like the latency) will differ from run to run.
+
+A run may check only some of the features (--check-features,
+--run-checks).  The report then lists the features actually checked
+in `features_checked`, and only features checked in both runs are
+compared.  A feature is checked if it or one of its parents was
+written by a check.  Reports without `features_checked` (from older
+versions) are considered to be from a full run.
+"""
+
+import json
+from functools import lru_cache
+
+## Support levels, from the best to the worst.  A feature moving
+## down the list is a regression, a feature moving up is an
+## improvement.  "unknown" is not ranked.
+SUPPORT_LEVELS = ("full", "quirk", "fragile", "unsupported", "ungraceful", "broken")
+_RANK = {x: i for i, x in enumerate(SUPPORT_LEVELS)}
+
+
+@lru_cache(maxsize=None)
+def _definition(feature):
+    from caldav.compatibility_hints import FeatureSet
+
+    from . import features  ## registers the features defined by the tester
+
+    ## Old reports may contain features no longer defined
+    return FeatureSet.FEATURES.get(feature, {})
+
+
+def _compared(feature):
+    return _definition(feature).get("type", "server-feature") in ("server-feature", "server-peculiarity")
+
+
+def lookup(features, feature):
+    """
+    The value of a feature in the compact feature dict of a report,
+    or None if neither the feature nor any of its parents are given
+    """
+    while True:
+        if feature in features:
+            return features[feature]
+        if "." not in feature:
+            return None
+        feature = feature[: feature.rfind(".")]
+
+
+def with_parents(feature):
+    """
+    The feature and all its parents, `a.b.c` -> `[a.b.c, a.b, a]`
+    """
+    ret = [feature]
+    while "." in feature:
+        feature = feature[: feature.rfind(".")]
+        ret.append(feature)
+    return ret
+
+
+def checked_features(report):
+    """
+    The set of features written by the checks in the run giving the
+    report, or None if the report doesn't tell
+    """
+    if "features_checked" not in report:
+        return None
+    return set(report["features_checked"])
+
+
+def is_checked(checked, feature):
+    """
+    Was the feature checked, given the checked_features of a report?
+    """
+    return checked is None or any(x in checked for x in with_parents(feature))
+
+
+def support_level(value, feature):
+    default = _definition(feature).get("default", {})
+    return (value or default).get("support", "full")
+
+
+def compare_reports(previous, current):
+    """
+    Compares the features checked in both reports (as dicts).
+    Returns a dict:
+
+    * added - features given in the current report only
+    * removed - features given in the previous report only
+    * changed - features with another support level, as
+      {feature: {"previous": ..., "current": ...}}
+    * regressions and improvements - the changed features with worse
+      or better support level
+    """
+    old = previous.get("features", {})
+    new = current.get("features", {})
+    old_checked = checked_features(previous)
+    new_checked = checked_features(current)
+    ## Features with the default value are only found in features_checked
+    candidates = old.keys() | new.keys() | (old_checked or set()) | (new_checked or set())
+    ret = {"added": {}, "removed": {}, "changed": {}, "regressions": [], "improvements": []}
+    for feature in sorted(candidates):
+        if not _compared(feature):
+            continue
+        if not is_checked(old_checked, feature) or not is_checked(new_checked, feature):
+            continue
+        old_value = lookup(old, feature)
+        new_value = lookup(new, feature)
+        if old_value is None and new_value is not None:
+            ret["added"][feature] = new_value
+        elif new_value is None and old_value is not None:
+            ret["removed"][feature] = old_value
+        old_support = support_level(old_value, feature)
+        new_support = support_level(new_value, feature)
+        if old_support == new_support:
+            continue
+        ret["changed"][feature] = {"previous": old_support, "current": new_support}
+        if old_support in _RANK and new_support in _RANK:
+            if _RANK[new_support] > _RANK[old_support]:
+                ret["regressions"].append(feature)
+            else:
+                ret["improvements"].append(feature)
+    return ret
+
+
+def server_key(report):
+    return report.get("name") or report.get("url")
+
+
+def load_reports(paths):
+    """
+    Loads previous reports from the given files.  A file may contain
+    one report or a list of reports (as given in fleet mode).  Returns
+    a dict with the newest report for each server.
+    """
+    ret = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            reports = json.load(f)
+        if isinstance(reports, dict):
+            reports = [reports]
+        for report in reports:
+            key = server_key(report)
+            if "error" in report and "features" not in report:
+                ## The server could not be checked
+                continue
+            if key not in ret or report.get("ts", 0) > ret[key].get("ts", 0):
+                ret[key] = report
+    return ret
+
+
+def compare_with(previous_reports, report):
+    """
+    Compares the report with the previous report for the same server
+    (from load_reports).  Returns None if there is no previous report
+    to compare with.
+    """
+    previous = previous_reports.get(server_key(report))
+    if previous is None or "features" not in report:
+        return None
+    return compare_reports(previous, report)
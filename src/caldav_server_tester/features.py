@@ -0,0 +1,93 @@
+"""
+Features checked by the server tester that are not (yet) defined in
+caldav.compatibility_hints.
+
+The FeatureSet class will refuse to deal with features it doesn't
+know about, so those are added to FeatureSet.FEATURES when this
+module is imported.  TODO: those should eventually be moved into the
+caldav library.
+"""
+
+from caldav.compatibility_hints import FeatureSet
+
+FEATURES = {
+    "latency": {
+        "type": "server-observation",
+        "description": "Response times observed from the client, in milliseconds (p50, p95 and p99 percentiles).  This will vary with network conditions and server load, so it's an observation rather than a feature.",
+    },
+    "latency.propfind": {
+        "type": "server-observation",
+        "description": "Response time for a PROPFIND on the test calendar",
+    },
+    "latency.report": {
+        "type": "server-observation",
+        "description": "Response time for a calendar-query REPORT with a time range on the test calendar",
+    },
+    "latency.put": {
+        "type": "server-observation",
+        "description": "Response time for saving a new event",
+    },
+    "latency.get": {
+        "type": "server-observation",
+        "description": "Response time for loading an event",
+    },
+    "latency.delete": {
+        "type": "server-observation",
+        "description": "Response time for deleting an event",
+    },
+    "scaling": {
+        "type": "server-observation",
+        "description": "How the response time grows with the size of the calendar.  Measured on calendars with 100, 1000 and 10000 events - the response time (median, in milliseconds) and the number of objects found for each size is given in the curve.  The exponent is the slope in log-log scale - 0 is constant time, 1 is linear growth.  Sizes where the server returned fewer objects than expected are listed as truncated.",
+    },
+    "scaling.time-range-search": {
+        "type": "server-observation",
+        "description": "Response time for a time-range search for one month of events",
+    },
+    "scaling.category-search": {
+        "type": "server-observation",
+        "description": "Response time for a search for events with a category (every tenth event)",
+    },
+    "scaling.list": {
+        "type": "server-observation",
+        "description": "Response time for listing all the events in the calendar",
+    },
+    "multiget": {
+        "description": "RFC4791 calendar-multiget REPORT is supported - multiple objects can be fetched in one request.  Fragile means some of the objects asked for were missing in the response",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc4791#section-7.9"],
+    },
+    "sync-token": {
+        "description": "RFC6578 sync-collection REPORT is supported - a client may fetch all changes in a calendar since the last time it synchronized",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc6578"],
+    },
+    "sync-token.incremental": {
+        "description": "A sync with the token from the previous sync returns only the objects changed since then.  Unsupported means the server returns everything",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc6578#section-3.3"],
+    },
+    "sync-token.incremental.delete": {
+        "description": "Objects deleted since the previous sync are reported (with status 404) in an incremental sync",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc6578#section-3.5"],
+    },
+    "sync-token.invalid-token": {
+        "description": "An invalid sync token is refused with a DAV:valid-sync-token error.  Unsupported means the server does a full sync instead, ungraceful means some other error",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc6578#section-3.2"],
+    },
+    "sync-token.limit": {
+        "description": "The DAV:limit element is respected - a truncated result is marked with status 507 for the collection.  Unsupported means the limit is refused or ignored (the behaviour tells which), fragile means the result was truncated without the 507 marker",
+        "links": ["https://datatracker.ietf.org/doc/html/rfc6578#section-3.6"],
+    },
+    "sync-token.efficiency": {
+        "type": "server-observation",
+        "description": "The size of the response to an incremental sync (after one change) compared to a full sync, both asking for the etags only.  Given in bytes and number of objects, and as the ratio between the incremental and the full response size",
+    },
+}
+
+
+def register():
+    for feature, definition in FEATURES.items():
+        FeatureSet.FEATURES.setdefault(feature, definition)
+    ## The feature tree is cached by FeatureSet, and needs to be rebuilt
+    if hasattr(FeatureSet, "_feature_tree"):
+        del FeatureSet._feature_tree
+
+
+register()
@@ -0,0 +1,53 @@
+"""
+Fleet mode - checking many servers in one go.
+
+Each server is checked in a separate worker process, so one
+misbehaving server (or one crashing check) does not affect the
+others, and the interpreter and the caldav library only needs to be
+loaded once per worker rather than once per server.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+
+def check_server(name, jobs=1, max_age=None, debug_mode="logging"):
+    """
+    Runs all checks towards the server `name` from the test config.
+    Cached results up to max_age seconds old are reused.  debug_mode
+    is passed on to the ServerQuirkChecker.
+
+    Returns the report as a dict.  Errors are not raised, but given
+    in the report.
+    """
+    from caldav.davclient import get_davclient
+    from .cache import ResultCache
+    from .checker import ServerQuirkChecker
+
+    try:
+        with get_davclient(name=name, testconfig=True) as conn:
+            result_cache = ResultCache(max_age) if max_age is not None else None
+            obj = ServerQuirkChecker(conn, debug_mode=debug_mode, result_cache=result_cache)
+            obj.check_all(jobs=jobs)
+            obj.cleanup(force=False)
+            return obj.report(return_what=dict)
+    except Exception as e:
+        return {"name": name, "error": f"{e.__class__.__name__}: {e}"}
+
+
+def check_fleet(names, processes=None, jobs=1, max_age=None, debug_mode="logging"):
+    """
+    Checks all the servers in `names` (as given in the test config)
+    concurrently, in a pool of `processes` worker processes.
+
+    Yields the report for each server (as a dict) as soon as it's
+    ready - the order is not the same as in `names`.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(check_server, name, jobs=jobs, max_age=max_age, debug_mode=debug_mode): name for name in names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                ## Most likely the worker process died
+                yield {"name": futures[future], "error": f"{e.__class__.__name__}: {e}"}
@@ -0,0 +1,195 @@
+"""
+History of the check results for many runs and many servers.
+
+The reports are appended to an SQLite database, with one row per run
+and one row per feature given in the report, indexed so that
+questions like "when did feature X change on server Y" and "which
+servers supports feature X" can be answered without loading every
+report.
+
+The features are stored as given in the report (the compact form), a
+feature not given has the value of the nearest parent given, or else
+the default value (see the compare module).  The whole report is
+stored as well.
+
+The features written by the checks (`features_checked` in the report)
+are stored too, so that partial runs (`partial` in the report, i.e.
+with --check-features or --run-checks) are not taken as full support
+for the features they didn't check.  Reports without `partial` are
+considered to be from a full run.
+"""
+
+import json
+import os
+import sqlite3
+
+from .compare import lookup
+from .compare import server_key
+from .compare import support_level
+from .compare import with_parents
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    server TEXT NOT NULL,
+    url TEXT,
+    caldav_version TEXT,
+    ts REAL NOT NULL,
+    report TEXT NOT NULL,
+    partial INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (server, ts)
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    feature TEXT NOT NULL,
+    support TEXT,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checked (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    feature TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_feature ON results (feature, run_id);
+CREATE INDEX IF NOT EXISTS checked_feature ON checked (feature, run_id);
+CREATE INDEX IF NOT EXISTS runs_caldav_version ON runs (caldav_version);
+"""
+
+
+def default_path():
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data_home, "caldav-server-tester", "history.sqlite")
+
+
+def _checked(features):
+    """
+    SQL condition selecting the runs where the feature (or a parent)
+    was checked
+    """
+    return f"""(NOT runs.partial OR EXISTS (
+        SELECT 1 FROM checked WHERE checked.run_id = runs.id
+        AND checked.feature IN ({",".join("?" * len(features))})))"""
+
+
+class History:
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def add(self, report):
+        """
+        Appends a report (as a dict) to the history.  Returns False if
+        the report was not added - reports without features (servers
+        that could not be checked) and reports already in the history
+        are skipped.
+        """
+        if "features" not in report:
+            return False
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO runs (server, url, caldav_version, ts, report, partial) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    server_key(report),
+                    report.get("url"),
+                    report.get("caldav_version"),
+                    report.get("ts", 0),
+                    json.dumps(report),
+                    bool(report.get("partial")),
+                ),
+            )
+            if not cursor.rowcount:
+                return False
+            self._db.executemany(
+                "INSERT INTO checked (run_id, feature) VALUES (?, ?)",
+                [(cursor.lastrowid, feature) for feature in report.get("features_checked", ())],
+            )
+            self._db.executemany(
+                "INSERT INTO results (run_id, feature, support, value) VALUES (?, ?, ?, ?)",
+                [
+                    (cursor.lastrowid, feature, value.get("support"), json.dumps(value))
+                    for feature, value in report["features"].items()
+                ],
+            )
+        return True
+
+    def import_files(self, paths):
+        """
+        Adds the reports in the given files.  A file may contain one
+        report or a list of reports (as given in fleet mode).  Returns
+        the number of reports added.
+        """
+        cnt = 0
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                reports = json.load(f)
+            if isinstance(reports, dict):
+                reports = [reports]
+            cnt += sum(self.add(x) for x in reports)
+        return cnt
+
+    def _values(self, feature, where, params):
+        """
+        The feature (and parent feature) values from the selected
+        runs, as {run_id: {feature: value}}
+        """
+        features = with_parents(feature)
+        rows = self._db.execute(
+            f"""SELECT results.run_id, results.feature, results.value
+                FROM results JOIN runs ON runs.id = results.run_id
+                WHERE results.feature IN ({",".join("?" * len(features))}) AND {where}""",
+            features + list(params),
+        )
+        ret = {}
+        for run_id, feature_, value in rows:
+            ret.setdefault(run_id, {})[feature_] = json.loads(value)
+        return ret
+
+    def changes(self, server, feature):
+        """
+        When did the support for the feature change on the server?
+        Returns a list of dicts (ts, caldav_version, support, value),
+        starting with the first run checking the feature.
+        """
+        features = with_parents(feature)
+        runs = self._db.execute(
+            f"SELECT id, ts, caldav_version FROM runs WHERE server = ? AND {_checked(features)} ORDER BY ts",
+            [server] + features,
+        ).fetchall()
+        values = self._values(feature, "runs.server = ?", (server,))
+        ret = []
+        for run_id, ts, caldav_version in runs:
+            value = lookup(values.get(run_id, {}), feature)
+            support = support_level(value, feature)
+            if ret and ret[-1]["support"] == support:
+                continue
+            ret.append({"ts": ts, "caldav_version": caldav_version, "support": support, "value": value})
+        return ret
+
+    def servers(self, feature):
+        """
+        The support for the feature on all servers, according to the
+        latest run checking the feature for each server.  Returns
+        {server: support}.
+        """
+        features = with_parents(feature)
+        ## The latest run per server, among the runs checking the feature
+        latest = f"""runs.id IN (
+            SELECT (SELECT id FROM runs WHERE runs.server = s.server AND {_checked(features)} ORDER BY ts DESC LIMIT 1)
+            FROM (SELECT DISTINCT server FROM runs) AS s)"""
+        runs = self._db.execute(f"SELECT id, server FROM runs WHERE {latest} ORDER BY server", features).fetchall()
+        values = self._values(feature, latest, features)
+        return {
+            server: support_level(lookup(values.get(run_id, {}), feature), feature)
+            for run_id, server in runs
+        }
@@ -0,0 +1,136 @@
+"""
+Instrumentation - where does the time go?
+
+For every check that is run, the wall clock time, the number of HTTP
+requests, the bytes sent and received and the time spent waiting for
+the server is recorded.  The rest of the wall clock time is spent in
+the client (parsing XML and icalendar data, the check logic, etc).
+
+Requests are attributed to the check running them through a context
+variable, so it works also when checks are run in parallel (threads
+or asyncio tasks).  Requests done outside the checks (like the
+OPTIONS request for the server fingerprint, or the cleanup) are not
+counted.
+"""
+
+import contextvars
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+from caldav.lib.python_utilities import to_wire
+
+_current = contextvars.ContextVar("caldav_server_tester_timing", default=None)
+
+
+class Timing:
+    """
+    Time and traffic spent by one check.
+
+    `network` is the time there has been at least one outstanding
+    request towards the server - if a check is doing concurrent
+    requests, the overlapping time is only counted once.
+    """
+
+    def __init__(self):
+        self.wall = 0.0
+        self.network = 0.0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._busy_since = None
+
+    @contextmanager
+    def measure(self):
+        """
+        Requests done within the context are counted in this Timing
+        """
+        token = _current.set(self)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall += time.perf_counter() - start
+            _current.reset(token)
+
+    def add(self, other):
+        """
+        Adds the requests counted in another Timing, measured within
+        this one
+        """
+        with self._lock:
+            self.network += other.network
+            self.requests += other.requests
+            self.bytes_sent += other.bytes_sent
+            self.bytes_received += other.bytes_received
+
+    def _request_started(self):
+        with self._lock:
+            self.requests += 1
+            if not self._inflight:
+                self._busy_since = time.perf_counter()
+            self._inflight += 1
+
+    def _request_done(self, sent, received):
+        with self._lock:
+            self._inflight -= 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            if not self._inflight:
+                self.network += time.perf_counter() - self._busy_since
+
+    def as_dict(self):
+        return {
+            "wall": round(self.wall, 3),
+            "network": round(self.network, 3),
+            "client": round(max(self.wall - self.network, 0), 3),
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+def _sent(largs, kwargs):
+    ## request(url, method="GET", body="", headers=None)
+    body = largs[2] if len(largs) > 2 else kwargs.get("body")
+    return len(to_wire(body or b""))
+
+
+def _received(response):
+    raw = getattr(response, "_raw", None)
+    return len(to_wire(raw)) if isinstance(raw, (bytes, str)) else 0
+
+
+def wrap(request):
+    """
+    Wraps a request method (sync or async), so that the request is
+    counted in the Timing of the running check.
+    """
+    if inspect.iscoroutinefunction(request):
+        async def instrumented_request(*largs, **kwargs):
+            timing = _current.get()
+            if timing is None:
+                return await request(*largs, **kwargs)
+            timing._request_started()
+            response = None
+            try:
+                response = await request(*largs, **kwargs)
+                return response
+            finally:
+                timing._request_done(_sent(largs, kwargs), _received(response))
+    else:
+        def instrumented_request(*largs, **kwargs):
+            timing = _current.get()
+            if timing is None:
+                return request(*largs, **kwargs)
+            timing._request_started()
+            response = None
+            try:
+                response = request(*largs, **kwargs)
+                return response
+            finally:
+                timing._request_done(_sent(largs, kwargs), _received(response))
+    return instrumented_request
@@ -0,0 +1,197 @@
+"""
+Load testing - how many concurrent clients can the server take?
+
+Simulated clients are doing a mix of searches, loads, property
+lookups and writes towards the test calendar (as provisioned by
+PrepareCalendar).  The number of clients is doubled for each step,
+until the server is saturated - that is, until the throughput stops
+scaling, the error rate goes up or the latency is climbing.
+
+Each simulated client has it's own connection to the server.  If a
+rate limit is configured for the server, it's respected also by the
+load test (and the saturation point found is probably the rate
+limit).
+"""
+
+import random
+import statistics
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+
+utc = timezone.utc
+
+## Relative weights of the operations done by the simulated clients
+OPERATIONS = {"search": 5, "get": 2, "propfind": 1, "write": 2}
+
+## Doubling the number of clients should give at least 10% more throughput
+SCALING_THRESHOLD = 1.1
+MAX_ERROR_RATE = 0.01
+## ... and the p95 latency should not be more than three times the
+## latency with one client
+MAX_LATENCY_GROWTH = 3
+
+_EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tobixen//Caldav-Server-Tester//en_DK
+BEGIN:VEVENT
+UID:{uid}
+DTSTART:19991115T120000Z
+DTEND:19991115T130000Z
+DTSTAMP:20240429T181103Z
+SUMMARY:load test event
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+class _SimulatedClient:
+    def __init__(self, client, calendar_url, object_urls, seed):
+        from caldav.collection import Calendar
+        from caldav.elements import dav
+
+        self.client = client
+        self.calendar = Calendar(client=client, url=calendar_url)
+        self.object_urls = object_urls
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.cnt = 0
+        self._displayname = [dav.DisplayName()]
+
+    def search(self):
+        month = self.random.randint(1, 12)
+        self.calendar.search(
+            event=True,
+            start=datetime(2000, month, 1, tzinfo=utc),
+            end=datetime(2000 + month // 12, month % 12 + 1, 1, tzinfo=utc),
+        )
+
+    def get(self):
+        if self.object_urls:
+            self.client.request(str(self.random.choice(self.object_urls)))
+        else:
+            self.search()
+
+    def propfind(self):
+        self.calendar.get_properties(self._displayname)
+
+    def write(self):
+        self.cnt += 1
+        event = self.calendar.save_event(_EVENT.format(uid=f"csc_load_{self.seed}_{self.cnt}"))
+        event.delete()
+
+    def run(self, deadline, results):
+        names = list(OPERATIONS)
+        weights = list(OPERATIONS.values())
+        while time.monotonic() < deadline:
+            operation = self.random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                getattr(self, operation)()
+                error = None
+            except Exception as e:
+                error = e.__class__.__name__
+            results.append((operation, time.perf_counter() - start, error))
+
+
+def _percentile(latencies, percentile):
+    if len(latencies) < 2:
+        return round(latencies[0] * 1000, 1) if latencies else None
+    return round(statistics.quantiles(latencies, n=100, method="inclusive")[percentile - 1] * 1000, 1)
+
+
+def run_level(make_client, calendar_url, object_urls, clients, duration):
+    """
+    Runs `clients` simulated clients concurrently for `duration`
+    seconds, and returns the statistics as a dict.
+    """
+    results = []
+    deadline = time.monotonic() + duration
+    connections = [make_client() for _ in range(clients)]
+    threads = [
+        threading.Thread(
+            target=_SimulatedClient(conn, calendar_url, object_urls, seed=i).run,
+            args=(deadline, results),
+        )
+        for i, conn in enumerate(connections)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    for conn in connections:
+        conn.close()
+
+    latencies = [x[1] for x in results if x[2] is None]
+    errors = {}
+    for operation, latency, error in results:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        "clients": clients,
+        "operations": len(results),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "error_rate": round(sum(errors.values()) / len(results), 3) if results else 0,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "errors": errors,
+    }
+
+
+def find_saturation(levels):
+    """
+    Given the statistics for the levels run so far (with increasing
+    number of clients), returns a dict with the number of clients the
+    server can take and the reason why more clients won't help - or
+    None if the server is not saturated yet.
+    """
+    best = None
+    for level in levels:
+        if level["error_rate"] > MAX_ERROR_RATE:
+            reason = "error rate"
+        elif best is not None and level["throughput"] < best["throughput"] * SCALING_THRESHOLD:
+            reason = "throughput stopped scaling"
+        elif (
+            levels[0]["p95"]
+            and level["p95"]
+            and level["p95"] > levels[0]["p95"] * MAX_LATENCY_GROWTH
+        ):
+            reason = "latency climbing"
+        else:
+            best = level
+            continue
+        return {
+            "clients": best["clients"] if best else 0,
+            "throughput": best["throughput"] if best else 0,
+            "reason": reason,
+        }
+    return None
+
+
+def run_load_test(make_client, calendar_url, object_urls, duration=10, max_clients=64):
+    """
+    Ramps up the number of concurrent clients (1, 2, 4, ...) until
+    the server is saturated or max_clients is reached.
+
+    make_client should return a new client connected to the server.
+    Returns the structured result for the report.
+    """
+    levels = []
+    saturation = None
+    clients = 1
+    while clients <= max_clients:
+        levels.append(run_level(make_client, calendar_url, object_urls, clients, duration))
+        saturation = find_saturation(levels)
+        if saturation is not None:
+            break
+        clients *= 2
+    return {
+        "duration": duration,
+        "operations_mix": OPERATIONS,
+        "levels": levels,
+        "saturation": saturation,
+        "max_throughput": max(x["throughput"] for x in levels),
+    }
@@ -0,0 +1,139 @@
+"""
+Metadata about the checks and the features.
+
+`--list-checks` and `--list-features` should be fast, without
+importing the caldav library (and the HTTP stack, icalendar, etc).
+The metadata is precomputed into metadata.json, shipped with the
+package.  It should be regenerated whenever the checks are changed::
+
+    python -m caldav_server_tester.metadata
+
+If the check definitions have been changed since the metadata was
+generated (as seen from a hash of the source files), the metadata is
+generated on the fly.  The feature list is a snapshot from the caldav
+library the metadata was generated with - it is used also with other
+versions of the caldav library, as the features are mostly added to,
+not changed.
+
+Checks from other packages (found through the entry point group
+below) are not included in the precomputed metadata.
+"""
+
+import hashlib
+import json
+import os
+
+FILENAME = os.path.join(os.path.dirname(__file__), "metadata.json")
+
+## The files where the checks and the tester's own features are defined
+SOURCES = ("checks_base.py", "checks.py", "features.py")
+
+## Checks from other packages are found through this entry point
+## group.  The name of the entry point should be the name of the
+## check class, and the value should point to the class, i.e.
+## `CheckFoo = "foo_checks.checks:CheckFoo"`
+ENTRY_POINT_GROUP = "caldav_server_tester.checks"
+
+
+def entry_points():
+    from importlib.metadata import entry_points
+
+    return entry_points(group=ENTRY_POINT_GROUP)
+
+
+def _caldav_version():
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version
+
+    try:
+        return version("caldav")
+    except PackageNotFoundError:
+        return None
+
+
+def _checks_hash():
+    """
+    A hash of the check definitions, or None if the source files
+    can't be read
+    """
+    ret = hashlib.sha256()
+    for name in SOURCES:
+        try:
+            with open(os.path.join(os.path.dirname(__file__), name), "rb") as f:
+                ret.update(f.read().replace(b"\r\n", b"\n"))
+        except OSError:
+            return None
+    return ret.hexdigest()
+
+
+def _description(cl):
+    doc = (cl.__doc__ or "").strip()
+    return " ".join(doc.split("\n\n")[0].split())
+
+
+def generate():
+    """
+    Collects the metadata from the check classes and the feature set.
+    This imports everything.
+    """
+    from caldav.compatibility_hints import FeatureSet
+
+    from . import features  ## registers the features defined by the tester
+    from .checks_base import all_checks
+
+    return {
+        ## the version the feature list was taken from
+        "caldav_version": _caldav_version(),
+        "checks_hash": _checks_hash(),
+        "checks": [
+            {
+                "name": cl.__name__,
+                "description": _description(cl),
+                "depends_on": sorted(x.__name__ for x in cl.depends_on),
+                "features": sorted(cl.features_to_be_checked),
+                "opt_in": cl.opt_in,
+            }
+            for cl in all_checks(plugins=False)
+        ],
+        "features": {
+            name: {
+                "type": definition.get("type", "server-feature"),
+                "description": definition.get("description", ""),
+            }
+            for name, definition in sorted(FeatureSet.FEATURES.items())
+        },
+    }
+
+
+def load():
+    """
+    Returns the precomputed metadata, or generates it if it's missing
+    or the checks have been changed since it was generated.
+    """
+    try:
+        with open(FILENAME, encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return generate()
+    checks_hash = _checks_hash()
+    if checks_hash is not None and metadata.get("checks_hash") != checks_hash:
+        return generate()
+    return metadata
+
+
+def plugin_checks():
+    """
+    Names of the checks from other packages.  Those are found
+    without loading them.
+    """
+    return sorted(x.name for x in entry_points())
+
+
+def save():
+    with open(FILENAME, "w", encoding="utf-8") as f:
+        json.dump(generate(), f, indent=1)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    save()
@@ -0,0 +1,46 @@
+"""
+Waiting for the server.
+
+Some servers does things asynchronously - like, a deleted calendar
+may still be around for some seconds.  Rather than sleeping some
+fixed time, we poll the server with exponential backoff until the
+condition is met or the deadline is passed.
+"""
+
+import time
+
+from . import querycache
+
+
+def wait_until(condition, timeout=10, interval=0.1, backoff=2, max_interval=2, replaying=False):
+    """
+    Calls `condition()` until it returns something true, first after
+    `interval` seconds, then with the interval multiplied by
+    `backoff` (up to `max_interval`) for each attempt.
+
+    Returns the number of seconds it took before the condition was
+    met, or None if it was not met within `timeout` seconds.
+
+    With replaying=True (the responses are taken from a cassette)
+    there is nothing to wait for.  The intervals are then counted
+    rather than slept.
+    """
+    start = time.monotonic()
+    elapsed = 0
+    while True:
+        if not replaying:
+            elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            return None
+        wait = min(interval, timeout - elapsed)
+        if replaying:
+            elapsed += wait
+        else:
+            time.sleep(wait)
+        ## Nothing is written to the server between the attempts, so
+        ## the query cache would give the same answer every time
+        with querycache.bypass():
+            met = condition()
+        if met:
+            return elapsed if replaying else time.monotonic() - start
+        interval = min(interval * backoff, max_interval)
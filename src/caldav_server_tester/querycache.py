@@ -0,0 +1,153 @@
+"""
+Memoization of REPORT queries within one checker run.
+
+Many of the checks are asking the server the same questions - like
+searching for the same time ranges in the test calendar.  As long as
+nothing has been written to the server, the answer will be the same,
+so the responses to REPORT requests are cached, keyed by the URL,
+the depth and the (normalized) query XML.  Any request that may
+change something on the server (PUT, DELETE, MKCALENDAR, PROPPATCH,
+etc) clears the cache.
+
+Some things may change on the server without us writing anything
+(like a calendar deletion taking some time to go through).  Polling
+the server (and measuring the server latency) should be done within
+`bypass()`.
+"""
+
+import contextvars
+import inspect
+import threading
+from contextlib import contextmanager
+
+from xml.etree.ElementTree import ParseError
+from xml.etree.ElementTree import canonicalize
+
+from caldav.lib.python_utilities import to_normal_str
+
+## Requests that does not change anything on the server
+READ_METHODS = {"GET", "HEAD", "OPTIONS", "PROPFIND", "REPORT"}
+
+_bypass = contextvars.ContextVar("caldav_server_tester_query_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass():
+    """
+    Requests done within the context are sent to the server, and
+    their responses are not cached
+    """
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def _normalize(body):
+    """
+    Canonical XML, so that i.e. namespace prefixes, attribute order
+    and the XML declaration does not matter.  Whitespace is kept, it
+    may be significant in a text-match.
+    """
+    body = to_normal_str(body)
+    try:
+        return canonicalize(body, rewrite_prefixes=True)
+    except ParseError:
+        return body
+
+
+def _args(largs, kwargs):
+    ## request(url, method="GET", body="", headers=None)
+    args = dict(zip(("url", "method", "body", "headers"), largs))
+    args.update(kwargs)
+    return (args.get("url"), args.get("method", "GET"), args.get("body", ""), args.get("headers"))
+
+
+class QueryCache:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        ## Bumped on every write - a response to a query that was
+        ## sent before or during a write should not be cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _key(self, url, method, body, headers):
+        if method != "REPORT" or _bypass.get():
+            return None
+        depth = (headers or {}).get("Depth")
+        return (str(url), depth, _normalize(body or ""))
+
+    def _lookup(self, key, client):
+        from caldav.davclient import DAVResponse
+
+        from .cassette import _ReplayedResponse
+
+        with self._lock:
+            exchange = self._cache.get(key)
+            if exchange is None:
+                self.misses += 1
+                return None, self._generation
+            self.hits += 1
+        ## A fresh response object every time, as the callers are
+        ## allowed to mess with it
+        return DAVResponse(_ReplayedResponse(exchange), client), None
+
+    def _store(self, key, generation, response):
+        if not 200 <= response.status < 300:
+            return
+        exchange = {
+            "status": response.status,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "body": to_normal_str(response._raw or ""),
+        }
+        with self._lock:
+            if generation == self._generation:
+                self._cache[key] = exchange
+
+    def wrap(self, request, client):
+        """
+        Wraps a request method (sync or async) of the client.  This
+        should be the outermost wrapping, so that cached responses
+        doesn't count as requests and aren't rate limited.
+        """
+        if inspect.iscoroutinefunction(request):
+            ## Responses from the async client are not cached, but
+            ## writes through it should still clear the cache
+            async def memoized_request(*largs, **kwargs):
+                if _args(largs, kwargs)[1] in READ_METHODS:
+                    return await request(*largs, **kwargs)
+                self.clear()
+                try:
+                    return await request(*largs, **kwargs)
+                finally:
+                    self.clear()
+        else:
+            def memoized_request(*largs, **kwargs):
+                url, method, body, headers = _args(largs, kwargs)
+                if method not in READ_METHODS:
+                    self.clear()
+                    try:
+                        return request(*largs, **kwargs)
+                    finally:
+                        self.clear()
+                key = self._key(url, method, body, headers)
+                if key is None:
+                    return request(*largs, **kwargs)
+                response, generation = self._lookup(key, client)
+                if response is None:
+                    response = request(*largs, **kwargs)
+                    self._store(key, generation, response)
+                return response
+        return memoized_request
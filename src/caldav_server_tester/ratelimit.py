@@ -0,0 +1,85 @@
+"""
+Rate limiting of the requests towards the server.
+
+Some servers (or the test setups for some servers) cannot take
+requests too fast.  This is configured through the `rate-limit`
+feature in the compatibility hints, as `count` requests per
+`interval` seconds.
+"""
+
+import asyncio
+import collections
+import inspect
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A sliding window rate limiter - at most `count` requests are sent
+    within any `interval` seconds.  (A token bucket starting full
+    would allow a burst of `count` requests, followed by the refill,
+    so up to 2*count-1 requests within one interval.)
+
+    Thread safe - all checks (also when run in parallel) share the
+    same limiter.
+    """
+
+    def __init__(self, count, interval):
+        self.count = count
+        self.interval = interval
+        ## The times for the last `count` requests (sent or scheduled)
+        self.times = collections.deque(maxlen=count)
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """
+        Reserves a time slot for one request, and returns how long the
+        caller has to wait before sending it.  Slots may be reserved
+        in the future, so that concurrent callers are queued up.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = now
+            if len(self.times) == self.count:
+                slot = max(now, self.times[0] + self.interval)
+            self.times.append(slot)
+            return slot - now
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def wrap(self, request):
+        """
+        Wraps a request method (sync or async) so that it will wait
+        for a time slot before sending the request.
+        """
+        if inspect.iscoroutinefunction(request):
+            async def rate_limited_request(*largs, **kwargs):
+                await self.acquire_async()
+                return await request(*largs, **kwargs)
+        else:
+            def rate_limited_request(*largs, **kwargs):
+                self.acquire()
+                return request(*largs, **kwargs)
+        return rate_limited_request
+
+
+def from_features(features):
+    """
+    Returns a RateLimiter configured from the `rate-limit` feature
+    in the feature set, or None if there is no rate limit.
+    """
+    rate_limit = features.is_supported('rate-limit', dict)
+    if not rate_limit.get('enable', True):
+        return None
+    if not rate_limit.get('interval') or not rate_limit.get('count'):
+        return None
+    return RateLimiter(rate_limit['count'], rate_limit['interval'])
@@ -0,0 +1,150 @@
+"""
+Running checks in parallel.
+
+Every check lists the checks it depends on in `Check.depends_on`.
+This gives a dependency graph (a DAG).  Checks that does not depend
+on each other may be run concurrently - with high-latency servers,
+most of the time running the checks is spent waiting for the network,
+so the total wall clock time will be closer to the longest path
+through the graph rather than the sum of all the checks.
+
+Checks may be run either on a thread pool (run_checks) or in an
+asyncio event loop (run_checks_async).
+
+The checks share the test calendar.  Checks writing to it (other than
+PrepareCalendar, which everything using the test calendar depends on)
+should be marked with `Check.exclusive` - those are run alone, as
+objects coming and going would confuse the searches and the syncs
+done by the other checks.
+
+The checks also share the one DAVClient, and with it one requests
+session.  It's assumed that concurrent requests through the session
+are safe as long as the session itself (auth, headers, cookies) is not
+changed during the run.  The authentication is negotiated by the
+first request, and every check depends (directly or not) on
+CheckGetCurrentUserPrincipal, so that is done before any checks are
+run in parallel.  Checks should not change the client or the session.
+"""
+
+import asyncio
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from .checks_base import AsyncCheck
+
+
+def dependency_graph(classes):
+    """
+    Returns a dict `{check class: set of check classes it depends on}`.
+
+    Dependencies not included in `classes` will also be included in
+    the graph.
+    """
+    graph = {}
+    todo = list(classes)
+    while todo:
+        cl = todo.pop()
+        if cl in graph:
+            continue
+        graph[cl] = set(cl.depends_on)
+        todo.extend(cl.depends_on)
+    return graph
+
+
+def _startable(ready, running):
+    """
+    The ready checks that may be started now, given the running
+    checks.  An exclusive check is only started when nothing else is
+    running, and nothing is started while it's running.
+    """
+    if any(x.exclusive for x in running):
+        return []
+    shared = [x for x in ready if not x.exclusive]
+    if shared or running:
+        return shared
+    return ready[:1]
+
+
+def run_checks(checker, classes, jobs=4):
+    """
+    Runs the checks in `classes` (and all their dependencies) on a
+    pool of `jobs` worker threads.  A check is started as soon as all
+    the checks it depends on are done.
+
+    Exceptions from the checks are passed on to the caller.
+    """
+    graph = dependency_graph(classes)
+    done = set(checker._checks_run)
+    pending = {cl: deps for cl, deps in graph.items() if cl not in done}
+    running = {}
+
+    ## The non-checked features are blanked out once for the whole
+    ## run, rather than for each check (see Check.run_check).
+    ## Otherwise, the checks would step on each others toes.
+    expected_features = checker._client_obj.features
+    checker._client_obj.features = checker._features_checked
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                ready = [cl for cl, deps in pending.items() if deps <= done]
+                for cl in _startable(ready, running.values()):
+                    del pending[cl]
+                    running[pool.submit(cl(checker).run_check, only_once=True)] = cl
+                if not running:
+                    raise RuntimeError(
+                        f"Circular dependencies between the checks {[x.__name__ for x in pending]}"
+                    )
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    cl = running.pop(future)
+                    future.result()
+                    done.add(cl)
+    finally:
+        checker._client_obj.features = expected_features
+
+
+async def run_checks_async(checker, classes):
+    """
+    Runs the checks in `classes` (and all their dependencies) in the
+    running event loop.  A check is started as soon as all the checks
+    it depends on are done.
+
+    AsyncCheck subclasses are run as asyncio tasks, the old blocking
+    checks are run in worker threads.
+    """
+    graph = dependency_graph(classes)
+    done = set(checker._checks_run)
+    pending = {cl: deps for cl, deps in graph.items() if cl not in done}
+    running = {}
+
+    expected_features = checker._client_obj.features
+    checker._client_obj.features = checker._features_checked
+    try:
+        while pending or running:
+            ready = [cl for cl, deps in pending.items() if deps <= done]
+            for cl in _startable(ready, running.values()):
+                del pending[cl]
+                check = cl(checker)
+                if isinstance(check, AsyncCheck):
+                    coro = check.run_check_async(only_once=True)
+                else:
+                    coro = asyncio.to_thread(check.run_check, only_once=True)
+                running[asyncio.ensure_future(coro)] = cl
+            if not running:
+                raise RuntimeError(
+                    f"Circular dependencies between the checks {[x.__name__ for x in pending]}"
+                )
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                cl = running.pop(task)
+                try:
+                    task.result()
+                except:
+                    for other in running:
+                        other.cancel()
+                    await asyncio.gather(*running, return_exceptions=True)
+                    raise
+                done.add(cl)
+    finally:
+        checker._client_obj.features = expected_features
@@ -0,0 +1,735 @@
+"""
+A small in-process CalDAV server to run the checks against.
+
+This is not a real calendar server - it keeps everything in memory,
+there is only one user, and only the parts of the protocol needed
+by the checks are implemented (principal discovery, MKCALENDAR,
+PUT, GET, DELETE and the calendar-query, calendar-multiget and
+sync-collection REPORTs).  The point is to have a fast and deterministic server,
+useful for benchmarking the checker itself, and for verifying that
+the checks detect the quirks they claim to detect.
+
+The server can be told to behave like a buggy server by giving it a
+quirk profile - a feature set, in the same format as the
+compatibility hints in the caldav library.  Those features are
+simulated:
+
+* `get-current-user-principal.has-calendar` - unsupported means no
+  default calendar
+* `create-calendar` - unsupported means MKCALENDAR is refused, quirk
+  with behaviour `mkcol-required` means only MKCOL is accepted
+* `create-calendar.auto` - supported means that calendars springs
+  into existence when accessed
+* `delete-calendar` - unsupported means DELETE is refused, fragile
+  with behaviour `delayed deletion` means the calendar stays around
+  for `delay` seconds
+* `save-load.todo.mixed-calendar` - unsupported means a calendar
+  holds events only, unless told otherwise on creation
+* `search.time-range.event`, `search.time-range.todo`
+* `search.category` (unsupported or ungraceful),
+  `search.category.fullstring.smart`
+* `search.combined-is-logical-and` - unsupported means the filters
+  are OR'ed
+* `search.comp-type-optional`
+* `search.recurrences.includes-implicit.event`,
+  `search.recurrences.includes-implicit.todo`
+* `search.recurrences.expanded.event`,
+  `search.recurrences.expanded.todo`
+* `multiget` - unsupported means the calendar-multiget REPORT is refused
+* `sync-token` - unsupported means the sync-collection REPORT is refused
+* `sync-token.incremental` - unsupported means sync tokens are
+  ignored, everything is returned on every sync
+* `sync-token.incremental.delete` - unsupported means deleted objects
+  are not reported in an incremental sync
+* `sync-token.invalid-token` - unsupported means an invalid sync
+  token gives a full sync rather than an error
+* `sync-token.limit` - unsupported means the limit is ignored
+
+Usage::
+
+    with StandInServer({"search.category": "ungraceful"}) as server:
+        checker = ServerQuirkChecker(server.client())
+        checker.check_all()
+"""
+
+import copy
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+import icalendar
+import recurring_ical_events
+from lxml import etree
+
+from caldav.compatibility_hints import FeatureSet
+
+from . import features  ## registers the multiget and sync-token features
+
+log = logging.getLogger(__name__)
+
+DAV = "DAV:"
+CALDAV = "urn:ietf:params:xml:ns:caldav"
+NSMAP = {"D": DAV, "C": CALDAV}
+
+PRINCIPAL = "/principals/user/"
+HOME = "/calendars/user/"
+
+## Far enough away to be "infinite" for open-ended time ranges
+_MIN = datetime(1900, 1, 1, tzinfo=timezone.utc)
+_MAX = datetime(2100, 1, 1, tzinfo=timezone.utc)
+
+
+def _tag(ns, name):
+    return f"{{{ns}}}{name}"
+
+
+class _Error(Exception):
+    """Some error, to be returned to the client with the given status"""
+
+    def __init__(self, status, reason="", precondition=None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        ## DAV:error element to return, like DAV:valid-sync-token
+        self.precondition = precondition
+
+
+class _Calendar:
+    def __init__(self, name=None, components=None):
+        self.name = name
+        self.components = components
+        self.objects = {}  ## object name -> (ical data, etag)
+        self.deleted_at = None
+        ## Bumped on every change to the objects, the sync token is
+        ## the revision
+        self.revision = 0
+        self.changes = {}  ## object name -> revision of the last change
+
+    def changed(self, obj_name):
+        self.revision += 1
+        self.changes[obj_name] = self.revision
+
+
+class StandInServer:
+    """
+    A CalDAV server running in a background thread, listening on
+    `host` and `port` (by default a random free port on the loopback
+    interface).
+    """
+
+    def __init__(self, quirks=None, host="127.0.0.1", port=0):
+        self.quirks = quirks or {}
+        self.features = FeatureSet(self.quirks)
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        self._calendars = {}
+        self._httpd = None
+        self._thread = None
+        if self.features.is_supported("get-current-user-principal.has-calendar"):
+            self._calendars["calendar"] = _Calendar("Calendar")
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            standin = server
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def client(self, **kwargs):
+        """
+        Returns a client connected to the server, expecting the
+        features from the quirk profile.
+        """
+        from caldav.davclient import DAVClient
+
+        client = DAVClient(url=self.url, features=self.quirks, **kwargs)
+        client.server_name = "stand-in"
+        return client
+
+    ## Storage
+
+    def _calendar(self, cal_id, autocreate=True):
+        """
+        The calendar with the given id, or None.  Should be called
+        with the lock held.
+        """
+        cal = self._calendars.get(cal_id)
+        if cal is not None and cal.deleted_at is not None and time.monotonic() >= cal.deleted_at:
+            del self._calendars[cal_id]
+            cal = None
+        if cal is None and autocreate and self.features.is_supported("create-calendar.auto"):
+            cal = self._calendars[cal_id] = _Calendar()
+        return cal
+
+    def _make_calendar(self, cal_id, body, method="mkcalendar"):
+        create = self.features.is_supported("create-calendar", dict)
+        if create.get("support") == "unsupported":
+            raise _Error(403, "calendar creation is not allowed")
+        if create.get("behaviour") == "mkcol-required" and method != "mkcol":
+            raise _Error(403, "use MKCOL")
+        name = None
+        components = None
+        if body:
+            root = etree.fromstring(body)
+            displayname = root.find(f".//{_tag(DAV, 'displayname')}")
+            if displayname is not None:
+                name = displayname.text
+            comps = root.findall(f".//{_tag(CALDAV, 'supported-calendar-component-set')}/{_tag(CALDAV, 'comp')}")
+            if comps:
+                components = {x.get("name") for x in comps}
+        if components is None and not self.features.is_supported("save-load.todo.mixed-calendar"):
+            components = {"VEVENT"}
+        with self._lock:
+            if self._calendar(cal_id, autocreate=False) is not None:
+                raise _Error(405, "calendar exists already")
+            self._calendars[cal_id] = _Calendar(name, components)
+
+    def _delete_calendar(self, cal_id):
+        delete = self.features.is_supported("delete-calendar", dict)
+        if delete.get("support") == "unsupported":
+            raise _Error(403, "calendar deletion is not allowed")
+        with self._lock:
+            cal = self._calendar(cal_id, autocreate=False)
+            if cal is None:
+                raise _Error(404)
+            if delete.get("behaviour") == "delayed deletion":
+                if cal.deleted_at is None:
+                    cal.deleted_at = time.monotonic() + delete.get("delay", 1)
+            else:
+                del self._calendars[cal_id]
+
+    def _put(self, cal_id, obj_name, data, if_none_match=None, if_match=None):
+        try:
+            ical = icalendar.Calendar.from_ical(data)
+        except ValueError as e:
+            raise _Error(400, str(e))
+        with self._lock:
+            cal = self._calendar(cal_id)
+            if cal is None:
+                raise _Error(409, "no such calendar")
+            if cal.components is not None:
+                for comp in ical.subcomponents:
+                    if comp.name in ("VEVENT", "VTODO", "VJOURNAL") and comp.name not in cal.components:
+                        raise _Error(403, f"{comp.name} not supported in this calendar")
+            existing = cal.objects.get(obj_name)
+            if if_none_match == "*" and existing is not None:
+                raise _Error(412)
+            if if_match is not None and (existing is None or if_match not in ("*", existing[1])):
+                raise _Error(412)
+            etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+            cal.objects[obj_name] = (data.decode("utf-8"), etag)
+            cal.changed(obj_name)
+        return (204 if existing else 201, etag)
+
+    ## Searching
+
+    def _instances(self, ical, comp_name, start, end, expand=True):
+        """
+        The instances of comp_name components within the time range.
+        With expand=False, recurrence rules are ignored.
+        """
+        if expand:
+            return recurring_ical_events.of(ical, components=[comp_name]).between(start, end)
+        ret = []
+        for comp in ical.walk(comp_name):
+            comp = copy.deepcopy(comp)
+            for prop in ("RRULE", "RDATE", "EXDATE", "RECURRENCE-ID"):
+                comp.pop(prop, None)
+            single = icalendar.Calendar()
+            single.add_component(comp)
+            ret.extend(recurring_ical_events.of(single, components=[comp_name]).between(start, end))
+        return ret
+
+    def _match_time_range(self, ical, comp_names, time_range):
+        start = _parse_time(time_range.get("start"), _MIN)
+        end = _parse_time(time_range.get("end"), _MAX)
+        for comp_name in comp_names:
+            kind = {"VEVENT": "event", "VTODO": "todo"}.get(comp_name)
+            if kind and not self.features.is_supported(f"search.time-range.{kind}"):
+                continue
+            expand = not kind or self.features.is_supported(f"search.recurrences.includes-implicit.{kind}")
+            if self._instances(ical, comp_name, start, end, expand):
+                return True
+        return False
+
+    def _match_text(self, prop_name, value, text_match):
+        text = text_match.text or ""
+        negate = text_match.get("negate-condition") == "yes"
+        if prop_name == "CATEGORIES":
+            category = self.features.is_supported("search.category", str)
+            if category == "ungraceful":
+                raise _Error(500, "category search not implemented")
+            if not self.features.is_supported("search.category"):
+                return False
+            if "," in text and self.features.is_supported("search.category.fullstring.smart"):
+                wanted = {x.strip().lower() for x in text.split(",")}
+                have = {x.strip().lower() for x in value.split(",")}
+                return wanted.issubset(have) != negate
+        return (text.lower() in value.lower()) != negate
+
+    def _match_prop_filter(self, ical, comp_names, prop_filter):
+        prop_name = prop_filter.get("name").upper()
+        is_not_defined = prop_filter.find(_tag(CALDAV, "is-not-defined")) is not None
+        text_match = prop_filter.find(_tag(CALDAV, "text-match"))
+        for comp_name in comp_names:
+            for comp in ical.walk(comp_name):
+                values = _prop_values(comp, prop_name)
+                if is_not_defined:
+                    if not values:
+                        return True
+                elif text_match is None:
+                    if values:
+                        return True
+                elif any(self._match_text(prop_name, x, text_match) for x in values):
+                    return True
+        return False
+
+    def _match_filter(self, ical, comp_filter, comp_names=("VEVENT", "VTODO", "VJOURNAL")):
+        """
+        Checks if a calendar object matches the comp-filter.  This is
+        a simplified version of the logic in RFC4791 section 9.7.
+        """
+        conditions = []
+        for child in comp_filter:
+            if child.tag == _tag(CALDAV, "comp-filter"):
+                name = child.get("name").upper()
+                if not any(True for x in ical.walk(name)):
+                    conditions.append(False)
+                elif len(child):
+                    conditions.append(self._match_filter(ical, child, (name,)))
+                else:
+                    conditions.append(True)
+            elif child.tag == _tag(CALDAV, "time-range"):
+                conditions.append(self._match_time_range(ical, comp_names, child))
+            elif child.tag == _tag(CALDAV, "prop-filter"):
+                conditions.append(self._match_prop_filter(ical, comp_names, child))
+        if not conditions:
+            return True
+        if self.features.is_supported("search.combined-is-logical-and"):
+            return all(conditions)
+        return any(conditions)
+
+    def _expand(self, data, expand):
+        """
+        The calendar data, with the recurrences within the time range
+        of the expand element expanded
+        """
+        ical = icalendar.Calendar.from_ical(data)
+        start = _parse_time(expand.get("start"), _MIN)
+        end = _parse_time(expand.get("end"), _MAX)
+        ret = icalendar.Calendar()
+        for key, value in ical.property_items(recursive=False)[1:-1]:
+            ret.add(key, value)
+        recurring = {str(x["UID"]) for x in ical.subcomponents if "RRULE" in x or "RDATE" in x}
+        for comp in recurring_ical_events.of(ical, components=["VEVENT", "VTODO", "VJOURNAL"]).between(start, end):
+            for prop in ("RRULE", "RDATE", "EXDATE"):
+                comp.pop(prop, None)
+            if str(comp.get("UID")) in recurring and "RECURRENCE-ID" not in comp:
+                comp.add("RECURRENCE-ID", comp["DTSTART"].dt)
+            ret.add_component(comp)
+        return ret.to_ical().decode("utf-8")
+
+    def _report(self, path, cal_id, body):
+        root = etree.fromstring(body)
+        with self._lock:
+            cal = self._calendar(cal_id)
+            if cal is None:
+                raise _Error(404)
+            objects = dict(cal.objects)
+            changes = dict(cal.changes)
+            revision = cal.revision
+        expand = root.find(f"{_tag(DAV, 'prop')}/{_tag(CALDAV, 'calendar-data')}/{_tag(CALDAV, 'expand')}")
+        comp_filter = root.find(f"{_tag(CALDAV, 'filter')}/{_tag(CALDAV, 'comp-filter')}/{_tag(CALDAV, 'comp-filter')}")
+        kind = {"VEVENT": "event", "VTODO": "todo"}.get(comp_filter.get("name") if comp_filter is not None else None)
+        expanded = f"search.recurrences.expanded.{kind}" if kind else "search.recurrences.expanded"
+        if expand is not None and not self.features.is_supported(expanded):
+            expand = None
+
+        if root.tag == _tag(CALDAV, "calendar-multiget") and self.features.is_supported("multiget"):
+            found = []
+            for href in root.iterfind(_tag(DAV, "href")):
+                obj_name = urlsplit(href.text).path.rstrip("/").rsplit("/", 1)[-1]
+                found.append((href.text, objects.get(obj_name)))
+        elif root.tag == _tag(CALDAV, "calendar-query"):
+            vcalendar = root.find(f"{_tag(CALDAV, 'filter')}/{_tag(CALDAV, 'comp-filter')}")
+            found = []
+            for obj_name, obj in sorted(objects.items()):
+                ical = icalendar.Calendar.from_ical(obj[0])
+                if vcalendar is not None and not any(x.tag == _tag(CALDAV, "comp-filter") for x in vcalendar):
+                    if not self.features.is_supported("search.comp-type-optional"):
+                        continue
+                if vcalendar is None or self._match_filter(ical, vcalendar):
+                    found.append((path + obj_name, obj))
+        elif root.tag == _tag(DAV, "sync-collection") and self.features.is_supported("sync-token"):
+            (found, sync_token, truncated) = self._sync(path, cal_id, root, objects, changes, revision)
+        else:
+            raise _Error(403, f"report {root.tag} not supported")
+
+        wanted = root.find(_tag(DAV, "prop"))
+        with_data = wanted is None or wanted.find(_tag(CALDAV, "calendar-data")) is not None
+        multistatus = etree.Element(_tag(DAV, "multistatus"), nsmap=NSMAP)
+        for href, obj in found:
+            response = etree.SubElement(multistatus, _tag(DAV, "response"))
+            etree.SubElement(response, _tag(DAV, "href")).text = href
+            if obj is None:
+                etree.SubElement(response, _tag(DAV, "status")).text = "HTTP/1.1 404 Not Found"
+                continue
+            props = {_tag(DAV, "getetag"): obj[1]}
+            if with_data:
+                props[_tag(CALDAV, "calendar-data")] = obj[0] if expand is None else self._expand(obj[0], expand)
+            _propstat(response, props)
+        if root.tag == _tag(DAV, "sync-collection"):
+            if truncated:
+                response = etree.SubElement(multistatus, _tag(DAV, "response"))
+                etree.SubElement(response, _tag(DAV, "href")).text = path
+                etree.SubElement(response, _tag(DAV, "status")).text = "HTTP/1.1 507 Insufficient Storage"
+            etree.SubElement(multistatus, _tag(DAV, "sync-token")).text = sync_token
+        return multistatus
+
+    def _sync(self, path, cal_id, root, objects, changes, revision):
+        """
+        The sync-collection REPORT (RFC6578).  Returns the objects
+        (href, object or None if deleted), the new sync token and
+        if the result was truncated.
+        """
+        prefix = f"http://stand-in/sync/{cal_id}/"
+        token = (root.findtext(_tag(DAV, "sync-token")) or "").strip()
+        since = 0
+        if token:
+            valid = token.startswith(prefix) and token[len(prefix):].isdigit() and int(token[len(prefix):]) <= revision
+            if not valid and self.features.is_supported("sync-token.invalid-token"):
+                raise _Error(403, "invalid sync token", precondition="valid-sync-token")
+            if valid and self.features.is_supported("sync-token.incremental"):
+                since = int(token[len(prefix):])
+        ## Oldest changes first, so a truncated result can be continued
+        names = sorted((x for x in changes if changes[x] > since), key=changes.get)
+        if not since or not self.features.is_supported("sync-token.incremental.delete"):
+            names = [x for x in names if x in objects]
+        limit = root.findtext(f"{_tag(DAV, 'limit')}/{_tag(DAV, 'nresults')}")
+        truncated = False
+        if limit and self.features.is_supported("sync-token.limit") and int(limit) < len(names):
+            names = names[: int(limit)]
+            truncated = True
+            revision = changes[names[-1]] if names else since
+        return ([(path + x, objects.get(x)) for x in names], f"{prefix}{revision}", truncated)
+
+    ## Properties
+
+    def _resources(self, path, depth):
+        """
+        Returns a list of (href, properties) for the resource at path
+        and (with depth 1) the resources below it
+        """
+        ret = []
+        with self._lock:
+            if path == "/":
+                ret.append((path, {
+                    _tag(DAV, "resourcetype"): [_tag(DAV, "collection")],
+                }))
+            elif path == PRINCIPAL:
+                ret.append((path, {
+                    _tag(DAV, "resourcetype"): [_tag(DAV, "principal")],
+                    _tag(DAV, "displayname"): "user",
+                    _tag(CALDAV, "calendar-home-set"): [(_tag(DAV, "href"), HOME)],
+                }))
+            elif path == HOME:
+                ret.append((path, {
+                    _tag(DAV, "resourcetype"): [_tag(DAV, "collection")],
+                }))
+                if depth:
+                    for cal_id in list(self._calendars):
+                        cal = self._calendar(cal_id, autocreate=False)
+                        if cal is not None:
+                            ret.append((f"{HOME}{cal_id}/", self._calendar_props(cal)))
+            else:
+                cal_id, obj_name = _split_path(path)
+                cal = self._calendar(cal_id)
+                if cal is None:
+                    raise _Error(404)
+                if obj_name is None:
+                    ret.append((path, self._calendar_props(cal)))
+                    if depth:
+                        for obj_name, obj in cal.objects.items():
+                            ret.append((f"{HOME}{cal_id}/{obj_name}", _object_props(obj)))
+                elif obj_name in cal.objects:
+                    ret.append((path, _object_props(cal.objects[obj_name])))
+                else:
+                    raise _Error(404)
+        for href, props in ret:
+            props[_tag(DAV, "current-user-principal")] = [(_tag(DAV, "href"), PRINCIPAL)]
+        return ret
+
+    def _calendar_props(self, cal):
+        props = {
+            _tag(DAV, "resourcetype"): [_tag(DAV, "collection"), _tag(CALDAV, "calendar")],
+            _tag(CALDAV, "supported-calendar-component-set"): [
+                (_tag(CALDAV, "comp"), {"name": x})
+                for x in sorted(cal.components or ("VEVENT", "VTODO", "VJOURNAL"))
+            ],
+        }
+        if cal.name is not None:
+            props[_tag(DAV, "displayname")] = cal.name
+        return props
+
+    def _propfind(self, path, depth, body):
+        wanted = None
+        if body:
+            prop = etree.fromstring(body).find(_tag(DAV, "prop"))
+            if prop is not None:
+                wanted = [x.tag for x in prop]
+        multistatus = etree.Element(_tag(DAV, "multistatus"), nsmap=NSMAP)
+        for href, props in self._resources(path, depth):
+            response = etree.SubElement(multistatus, _tag(DAV, "response"))
+            etree.SubElement(response, _tag(DAV, "href")).text = href
+            if wanted is None:
+                _propstat(response, props)
+            else:
+                _propstat(response, {x: props[x] for x in wanted if x in props})
+                missing = [x for x in wanted if x not in props]
+                if missing:
+                    _propstat(response, {x: None for x in missing}, "HTTP/1.1 404 Not Found")
+        return multistatus
+
+    def _proppatch(self, path, body):
+        cal_id, obj_name = _split_path(path)
+        root = etree.fromstring(body)
+        with self._lock:
+            cal = self._calendar(cal_id)
+            if cal is None or obj_name is not None:
+                raise _Error(404)
+            displayname = root.find(f".//{_tag(DAV, 'set')}//{_tag(DAV, 'displayname')}")
+            if displayname is not None:
+                cal.name = displayname.text
+        multistatus = etree.Element(_tag(DAV, "multistatus"), nsmap=NSMAP)
+        response = etree.SubElement(multistatus, _tag(DAV, "response"))
+        etree.SubElement(response, _tag(DAV, "href")).text = path
+        _propstat(response, {x.tag: None for x in root.iterfind(f".//{_tag(DAV, 'prop')}/*")})
+        return multistatus
+
+
+def _parse_time(value, default):
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+
+
+def _split_path(path):
+    """
+    /calendars/user/<cal_id>/<obj_name> -> (cal_id, obj_name)
+    """
+    if not path.startswith(HOME):
+        raise _Error(404)
+    parts = path[len(HOME):].split("/")
+    if not parts[0] or len(parts) > 2:
+        raise _Error(404)
+    return (unquote(parts[0]), parts[1] if len(parts) == 2 and parts[1] else None)
+
+
+def _prop_values(component, prop_name):
+    value = component.get(prop_name)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    ret = []
+    for x in value:
+        if hasattr(x, "cats"):
+            ret.append(",".join(str(c) for c in x.cats))
+        elif hasattr(x, "to_ical") and not isinstance(x, str):
+            ret.append(x.to_ical().decode("utf-8"))
+        else:
+            ret.append(str(x))
+    return ret
+
+
+def _object_props(obj):
+    return {
+        _tag(DAV, "resourcetype"): [],
+        _tag(DAV, "getetag"): obj[1],
+        _tag(DAV, "getcontenttype"): "text/calendar; charset=utf-8",
+    }
+
+
+def _propstat(response, props, status="HTTP/1.1 200 OK"):
+    """
+    Adds a propstat to the response.  The property values may be
+    text, or a list of child elements - tags or (tag, text or
+    attributes) tuples.
+    """
+    propstat = etree.SubElement(response, _tag(DAV, "propstat"))
+    prop = etree.SubElement(propstat, _tag(DAV, "prop"))
+    for tag, value in props.items():
+        element = etree.SubElement(prop, tag)
+        if isinstance(value, str):
+            element.text = value
+        elif value:
+            for child in value:
+                if isinstance(child, str):
+                    etree.SubElement(element, child)
+                elif isinstance(child[1], dict):
+                    etree.SubElement(element, child[0], child[1])
+                else:
+                    etree.SubElement(element, child[0]).text = child[1]
+    etree.SubElement(propstat, _tag(DAV, "status")).text = status
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin = None  ## set on the subclass made by StandInServer.start
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "caldav-server-tester-stand-in/0.1"
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", content_type=None, headers=None):
+        if isinstance(body, etree._Element):
+            body = etree.tostring(body, xml_declaration=True, encoding="utf-8")
+            content_type = 'application/xml; charset="utf-8"'
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _dispatch(self, method):
+        path = urlsplit(self.path).path
+        body = self._body()
+        try:
+            method(path, body)
+        except _Error as e:
+            if e.precondition:
+                body = etree.Element(_tag(DAV, "error"), nsmap=NSMAP)
+                etree.SubElement(body, _tag(DAV, e.precondition))
+                self._send(e.status, body)
+            else:
+                self._send(e.status, e.reason, "text/plain")
+        except etree.XMLSyntaxError as e:
+            self._send(400, str(e), "text/plain")
+
+    def do_OPTIONS(self):
+        self._dispatch(lambda path, body: self._send(200, headers={
+            "DAV": "1, 2, 3, calendar-access",
+            "Allow": "OPTIONS, GET, HEAD, PUT, DELETE, PROPFIND, PROPPATCH, REPORT, MKCALENDAR, MKCOL",
+        }))
+
+    def do_PROPFIND(self):
+        depth = 0 if self.headers.get("Depth", "0") == "0" else 1
+        self._dispatch(lambda path, body: self._send(207, self.standin._propfind(path, depth, body)))
+
+    def do_PROPPATCH(self):
+        self._dispatch(lambda path, body: self._send(207, self.standin._proppatch(path, body)))
+
+    def do_REPORT(self):
+        def report(path, body):
+            cal_id, obj_name = _split_path(path)
+            if obj_name is not None:
+                raise _Error(403, "reports are only supported on calendars")
+            self._send(207, self.standin._report(path, cal_id, body))
+
+        self._dispatch(report)
+
+    def _mkcalendar(self, path, body, method="mkcalendar"):
+        cal_id, obj_name = _split_path(path)
+        if obj_name is not None:
+            raise _Error(403)
+        self.standin._make_calendar(cal_id, body, method)
+        self._send(201)
+
+    def do_MKCALENDAR(self):
+        self._dispatch(self._mkcalendar)
+
+    def do_MKCOL(self):
+        ## Extended MKCOL (RFC5689) - works the same way as MKCALENDAR
+        ## as long as the calendar resourcetype is given
+        def mkcol(path, body):
+            if not body or etree.fromstring(body).find(f".//{_tag(CALDAV, 'calendar')}") is None:
+                raise _Error(403, "only calendar collections can be made")
+            self._mkcalendar(path, body, "mkcol")
+
+        self._dispatch(mkcol)
+
+    def do_PUT(self):
+        def put(path, body):
+            cal_id, obj_name = _split_path(path)
+            if obj_name is None:
+                raise _Error(405)
+            (status, etag) = self.standin._put(
+                cal_id, obj_name, body,
+                if_none_match=self.headers.get("If-None-Match"),
+                if_match=self.headers.get("If-Match"),
+            )
+            self._send(status, headers={"ETag": etag})
+
+        self._dispatch(put)
+
+    def do_GET(self):
+        def get(path, body):
+            cal_id, obj_name = _split_path(path)
+            with self.standin._lock:
+                cal = self.standin._calendar(cal_id)
+                obj = cal.objects.get(obj_name) if cal is not None and obj_name else None
+            if obj is None:
+                raise _Error(404)
+            self._send(200, obj[0], "text/calendar; charset=utf-8", {"ETag": obj[1]})
+
+        self._dispatch(get)
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        def delete(path, body):
+            cal_id, obj_name = _split_path(path)
+            if obj_name is None:
+                self.standin._delete_calendar(cal_id)
+            else:
+                with self.standin._lock:
+                    cal = self.standin._calendar(cal_id, autocreate=False)
+                    if cal is None or cal.objects.pop(obj_name, None) is None:
+                        raise _Error(404)
+                    cal.changed(obj_name)
+            self._send(204)
+
+        self._dispatch(delete)
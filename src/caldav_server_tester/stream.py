@@ -0,0 +1,47 @@
+"""
+Streaming progress output - one JSON record per line (NDJSON).
+
+The report is only available when all the checks are done.  With a
+Stream given to the ServerQuirkChecker, a record is written when a
+check starts, for every feature set by a check and when a check is
+done, so the results can be consumed as they arrive (and a check
+hanging can be spotted - there will be a `check_started` without a
+`check_done`).
+
+All records have an `event` and a `time` (UTC, ISO 8601).
+"""
+
+import json
+import threading
+from datetime import datetime
+from datetime import timezone
+
+
+class Stream:
+    def __init__(self, file):
+        self.file = file
+        ## Checks may be run in parallel
+        self._lock = threading.Lock()
+
+    def write(self, event, **data):
+        record = {
+            "event": event,
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        }
+        record.update(data)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def check_started(self, check):
+        self.write("check_started", check=check.__class__.__name__)
+
+    def feature(self, check, feature, value):
+        self.write("feature", check=check.__class__.__name__, feature=feature, value=value)
+
+    def check_done(self, check):
+        self.write("check_done", check=check.__class__.__name__, timing=check.timing.as_dict())
+
+    def check_cached(self, check_class):
+        self.write("check_cached", check=check_class.__name__)
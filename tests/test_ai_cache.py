@@ -0,0 +1,188 @@
+"""Unit tests for the persistent result cache"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import json
+import time
+from unittest.mock import Mock
+
+from caldav.compatibility_hints import FeatureSet
+from caldav_server_tester.cache import MAX_AGE, ResultCache, check_version
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.checks_base import Check
+
+
+class CachedCheck(Check):
+    features_to_be_checked = {"create-calendar"}
+    executions = 0
+
+    def _run_check(self) -> None:
+        CachedCheck.executions += 1
+        self.set_feature("create-calendar", False)
+
+
+class UncachedCheck(Check):
+    features_to_be_checked = set()
+    cacheable = False
+    executions = 0
+
+    def _run_check(self) -> None:
+        UncachedCheck.executions += 1
+
+
+class PrerequisiteCheck(Check):
+    features_to_be_checked = {"get-current-user-principal"}
+    prerequisite = True
+    executions = 0
+
+    def _run_check(self) -> None:
+        PrerequisiteCheck.executions += 1
+        self.set_feature("get-current-user-principal")
+
+
+class DependentCheck(Check):
+    features_to_be_checked = {"search.category"}
+    depends_on = {PrerequisiteCheck}
+    cacheable = True
+    executions = 0
+
+    def _run_check(self) -> None:
+        DependentCheck.executions += 1
+        self.set_feature("search.category", False)
+
+
+def create_checker(result_cache) -> ServerQuirkChecker:
+    client = Mock()
+    client.features = FeatureSet()
+    client.url = "https://caldav.example.com/"
+    client.options.return_value.headers = {"Server": "FooDAV/1.0", "DAV": "1, 2, calendar-access"}
+    checker = ServerQuirkChecker(client, debug_mode=None, result_cache=result_cache)
+    checker._check_classes = lambda: [CachedCheck, UncachedCheck]
+    return checker
+
+
+class TestResultCache:
+    """Test the ResultCache class"""
+
+    def test_put_and_get(self, tmp_path) -> None:
+        """A stored entry should be returned, also from a new cache object"""
+        path = tmp_path / "results.json"
+        cache = ResultCache(3600, path=str(path))
+        cache.put("key", {"create-calendar": {"support": "full"}})
+
+        assert cache.get("key") == {"create-calendar": {"support": "full"}}
+        assert ResultCache(3600, path=str(path)).get("key") == {"create-calendar": {"support": "full"}}
+
+    def test_old_entries_are_not_used(self, tmp_path) -> None:
+        """Entries older than max_age should not be returned, but kept for runs with a longer max_age"""
+        path = tmp_path / "results.json"
+        path.write_text(json.dumps({"old": {"ts": time.time() - 7200, "features": {}}}))
+        cache = ResultCache(3600, path=str(path))
+
+        assert cache.get("old") is None
+        cache.put("new", {})
+        assert set(json.loads(path.read_text())) == {"old", "new"}
+        assert ResultCache(10000, path=str(path)).get("old") == {}
+
+    def test_ancient_entries_are_pruned(self, tmp_path) -> None:
+        """Entries older than MAX_AGE should be removed when the cache is written"""
+        path = tmp_path / "results.json"
+        path.write_text(json.dumps({"ancient": {"ts": time.time() - MAX_AGE - 1, "features": {}}}))
+        cache = ResultCache(MAX_AGE * 2, path=str(path))
+        cache.put("new", {})
+        assert set(json.loads(path.read_text())) == {"new"}
+
+    def test_concurrent_writers_are_merged(self, tmp_path) -> None:
+        """Two cache objects writing to the same file should not lose each others entries"""
+        path = str(tmp_path / "results.json")
+        cache1 = ResultCache(3600, path=path)
+        cache2 = ResultCache(3600, path=path)
+        cache1.put("key1", {})
+        cache2.put("key2", {})
+
+        assert set(json.loads(open(path).read())) == {"key1", "key2"}
+
+    def test_key_depends_on_fingerprint_and_check(self, tmp_path) -> None:
+        """The key should change with the server fingerprint and the check"""
+        cache = ResultCache(3600, path=str(tmp_path / "results.json"))
+        key = cache.key("https://example.com/", "Server: FooDAV/1.0", CachedCheck)
+
+        assert key != cache.key("https://example.com/", "Server: FooDAV/1.1", CachedCheck)
+        assert key != cache.key("https://example.com/", "Server: FooDAV/1.0", UncachedCheck)
+
+    def test_check_version_is_source_hash(self) -> None:
+        """check_version should be stable and differ between checks"""
+        assert check_version(CachedCheck) == check_version(CachedCheck)
+        assert check_version(CachedCheck) != check_version(UncachedCheck)
+
+
+class TestCheckerWithCache:
+    """Test that cached checks are skipped by the checker"""
+
+    def test_second_run_uses_cache(self, tmp_path) -> None:
+        """A cached check should not be run again, but the features should be restored"""
+        path = str(tmp_path / "results.json")
+        CachedCheck.executions = 0
+        UncachedCheck.executions = 0
+
+        checker1 = create_checker(ResultCache(3600, path=path))
+        checker1.check_all()
+        checker2 = create_checker(ResultCache(3600, path=path))
+        checker2.check_all()
+
+        assert CachedCheck.executions == 1
+        assert UncachedCheck.executions == 2
+        assert checker2.checks_cached == {CachedCheck}
+        assert not checker2.features_checked.is_supported("create-calendar")
+        assert checker2.report(return_what=dict)["checks_cached"] == ["CachedCheck"]
+
+    def test_server_upgrade_invalidates_cache(self, tmp_path) -> None:
+        """A different Server header should cause the checks to be rerun"""
+        path = str(tmp_path / "results.json")
+        CachedCheck.executions = 0
+
+        create_checker(ResultCache(3600, path=path)).check_all()
+        checker = create_checker(ResultCache(3600, path=path))
+        checker._client_obj.options.return_value.headers = {"Server": "FooDAV/2.0"}
+        checker.check_all()
+
+        assert CachedCheck.executions == 2
+
+    def test_prerequisite_not_run_when_dependents_are_cached(self, tmp_path) -> None:
+        """A prerequisite check should be taken from the cache if nothing depending on it is run"""
+        path = str(tmp_path / "results.json")
+        PrerequisiteCheck.executions = 0
+        DependentCheck.executions = 0
+
+        for _ in range(2):
+            checker = create_checker(ResultCache(3600, path=path))
+            checker._check_classes = lambda: [PrerequisiteCheck, DependentCheck]
+            checker.check_all()
+
+        assert PrerequisiteCheck.executions == 1
+        assert DependentCheck.executions == 1
+        assert checker.checks_cached == {PrerequisiteCheck, DependentCheck}
+        assert checker.features_checked.is_supported("get-current-user-principal")
+        assert not checker.features_checked.is_supported("search.category")
+
+    def test_prerequisite_run_when_a_dependent_is_run(self, tmp_path) -> None:
+        """A prerequisite check should be run if a check depending on it is to be run"""
+        path = str(tmp_path / "results.json")
+        PrerequisiteCheck.executions = 0
+        DependentCheck.executions = 0
+
+        checker = create_checker(ResultCache(3600, path=path))
+        checker._check_classes = lambda: [PrerequisiteCheck, DependentCheck]
+        checker.check_all()
+        ## The cached result for the dependent check has expired
+        entries = json.loads((tmp_path / "results.json").read_text())
+        entries[checker._cache_key(DependentCheck)]["ts"] -= 7200
+        (tmp_path / "results.json").write_text(json.dumps(entries))
+
+        checker = create_checker(ResultCache(3600, path=path))
+        checker._check_classes = lambda: [PrerequisiteCheck, DependentCheck]
+        checker.check_all()
+
+        assert PrerequisiteCheck.executions == 2
+        assert DependentCheck.executions == 2
+        assert checker.checks_cached == set()
@@ -0,0 +1,180 @@
+"""Unit tests for recording and replaying HTTP traffic"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+from unittest.mock import Mock
+import gzip
+import json
+import pytest
+
+from caldav.compatibility_hints import FeatureSet
+from caldav.davclient import DAVResponse
+from caldav.lib.error import NotFoundError
+from caldav_server_tester.cassette import FILENAME, Cassette, CassetteMiss
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.standin import StandInServer
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+        self.headers = headers or {}
+        self.reason = "OK"
+
+
+def create_recording_client(responses) -> Mock:
+    """A mock client where request() gives the responses (or raises the exceptions) in order"""
+    client = Mock()
+    client.url = "https://caldav.example.com/dav/"
+    client.server_name = "Example"
+    client.features = FeatureSet({"search.category": {"support": "unsupported"}})
+
+    def request(url, method="GET", body="", headers=None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return DAVResponse(response)
+
+    client.request = request
+    return client
+
+
+class TestCassette:
+    """Test the Cassette class"""
+
+    def test_record_and_replay_roundtrip(self, tmp_path) -> None:
+        """Recorded responses should be replayed from the saved cassette"""
+        recording = create_recording_client([
+            FakeResponse(200, b"BEGIN:VCALENDAR\nEND:VCALENDAR\n", {"Content-Type": "text/calendar"}),
+            NotFoundError(url="https://caldav.example.com/dav/missing.ics", reason="gone"),
+        ])
+        cassette = Cassette()
+        cassette.record(recording)
+        recording.request("https://caldav.example.com/dav/event.ics", "GET")
+        with pytest.raises(NotFoundError):
+            recording.request("https://caldav.example.com/dav/missing.ics", "GET")
+        cassette.save(str(tmp_path))
+
+        loaded = Cassette.load(str(tmp_path))
+        assert loaded.name == "Example"
+        assert loaded.features == {"search.category": {"support": "unsupported"}}
+        replaying = Mock()
+        loaded.replay(replaying)
+
+        response = replaying.request("https://caldav.example.com/dav/event.ics", "GET")
+        assert response.status == 200
+        assert b"BEGIN:VCALENDAR" in response._raw
+        with pytest.raises(NotFoundError):
+            replaying.request("https://caldav.example.com/dav/missing.ics", "GET")
+
+    def test_repeated_requests_replayed_in_order(self) -> None:
+        """The same request sent twice should get the recorded responses in order, and then the last one repeated"""
+        recording = create_recording_client([FakeResponse(200), FakeResponse(404)])
+        cassette = Cassette()
+        cassette.record(recording)
+        recording.request("https://caldav.example.com/dav/cal/", "PROPFIND", "<propfind/>")
+        recording.request("https://caldav.example.com/dav/cal/", "PROPFIND", "<propfind/>")
+
+        replaying = Mock()
+        cassette.replay(replaying)
+        statuses = [
+            replaying.request("https://caldav.example.com/dav/cal/", "PROPFIND", "<propfind/>").status
+            for i in range(3)
+        ]
+        assert statuses == [200, 404, 404]
+
+    def test_dtstamp_and_uuids_are_normalized(self) -> None:
+        """Requests differing only in DTSTAMP and random UUIDs should match"""
+        recording = create_recording_client([FakeResponse(201)])
+        cassette = Cassette()
+        cassette.record(recording)
+        recording.request(
+            "https://caldav.example.com/dav/testcalendar-0b4f6c8e-7d1a-4c37-9d8c-1e2f3a4b5c6d/event.ics",
+            "PUT",
+            "DTSTAMP:20250101T000000Z\nSUMMARY:foo",
+        )
+
+        replaying = Mock()
+        cassette.replay(replaying)
+        response = replaying.request(
+            "https://caldav.example.com/dav/testcalendar-9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d/event.ics",
+            "PUT",
+            "DTSTAMP:20261017T120000Z\nSUMMARY:foo",
+        )
+        assert response.status == 201
+
+    def test_queries_are_matched_on_the_body(self) -> None:
+        """REPORT requests should get the response recorded for the same query, other queries are a miss"""
+        recording = create_recording_client([FakeResponse(207, b"first"), FakeResponse(207, b"second")])
+        cassette = Cassette()
+        cassette.record(recording)
+        url = "https://caldav.example.com/dav/cal/"
+        recording.request(url, "REPORT", "<query>first</query>")
+        recording.request(url, "REPORT", "<query>second</query>")
+        assert [x["request_body"] for x in cassette.exchanges] == ["<query>first</query>", "<query>second</query>"]
+        assert [x["body"] for x in cassette.exchanges] == ["first", "second"]
+
+        replaying = Mock()
+        cassette.replay(replaying)
+        assert replaying.request(url, "REPORT", "<query>second</query>")._raw == b"second"
+        assert replaying.request(url, "REPORT", "<query>first</query>")._raw == b"first"
+        with pytest.raises(CassetteMiss):
+            replaying.request(url, "REPORT", "<query>third</query>")
+
+    def test_old_cassettes_are_refused(self, tmp_path) -> None:
+        """Cassettes without the request bodies should not be loaded"""
+        cassette = Cassette(url="https://caldav.example.com/")
+        cassette.save(str(tmp_path))
+        with gzip.open(tmp_path / FILENAME, "rt") as f:
+            data = json.load(f)
+        data["version"] = 1
+        with gzip.open(tmp_path / FILENAME, "wt") as f:
+            json.dump(data, f)
+        with pytest.raises(ValueError):
+            Cassette.load(str(tmp_path))
+
+    def test_unknown_request_raises(self) -> None:
+        """A request not in the cassette should raise CassetteMiss"""
+        cassette = Cassette(url="https://caldav.example.com/")
+        replaying = Mock()
+        cassette.replay(replaying)
+        with pytest.raises(CassetteMiss):
+            replaying.request("https://caldav.example.com/", "OPTIONS")
+
+    def test_replaying_disables_rate_limit(self) -> None:
+        """The rate limiter should not slow down replays"""
+        cassette = Cassette(url="https://caldav.example.com/", features={"rate-limit": {"enable": True, "interval": 10, "count": 1}})
+        client = cassette.client()
+        checker = ServerQuirkChecker(client, cassette=cassette)
+        assert checker._rate_limiter is None
+        assert client.server_name is None
+
+
+class TestRecordReplayStandIn:
+    """Record a checker run towards the stand-in server, and replay it"""
+
+    @pytest.mark.parametrize("quirks", [
+        {},
+        {"search.combined-is-logical-and": {"support": "unsupported"}, "sync-token.incremental": {"support": "unsupported"}},
+    ])
+    def test_replay_gives_the_same_features(self, tmp_path, quirks) -> None:
+        """The features found when replaying should be the ones found when recording"""
+        with StandInServer(quirks) as server:
+            client = server.client()
+            client.server_name = "stand-in"
+            cassette = Cassette()
+            cassette.record(client)
+            recorded = ServerQuirkChecker(client, debug_mode=None, cassette=cassette)
+            recorded.check_one("CheckSearch")
+            recorded.check_one("CheckSyncToken")
+        cassette.save(str(tmp_path))
+
+        loaded = Cassette.load(str(tmp_path))
+        replayed = ServerQuirkChecker(loaded.client(), debug_mode=None, cassette=loaded)
+        replayed.check_one("CheckSearch")
+        replayed.check_one("CheckSyncToken")
+
+        assert replayed.features_checked.dotted_feature_set_list() == recorded.features_checked.dotted_feature_set_list()
+
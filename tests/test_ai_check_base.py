@@ -2,12 +2,20 @@
 
 ## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
 
+from datetime import datetime, timezone
 from unittest.mock import Mock, MagicMock, patch
+import asyncio
 import logging
+import threading
+import types
 import pytest
 
 from caldav.compatibility_hints import FeatureSet
-from caldav_server_tester.checks_base import Check
+from caldav.lib.error import ReportError
+from caldav_server_tester import checks
+from caldav_server_tester import checks_base
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.checks_base import AsyncCheck, Check, FeatureJournal, all_checks, checks_for_features, feature_index, find_check
 
 
 class TestCheckSetFeature:
@@ -140,6 +148,18 @@ class TestCheckFeatureChecked:
         assert isinstance(result, dict)
         assert result == {"support": "full", "behaviour": "test"}
 
+    def test_feature_checked_takes_the_lock(self) -> None:
+        """feature_checked should wait while another thread holds the lock"""
+        check = self.create_check_instance()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(check.feature_checked("create-calendar")))
+        with checks_base._lock:
+            thread.start()
+            thread.join(timeout=0.1)
+            assert results == []
+        thread.join()
+        assert results == [True]
+
 
 class TestCheckRunCheck:
     """Test the Check.run_check method and dependency resolution"""
@@ -298,3 +318,319 @@ class TestCheckRunCheck:
 
         with pytest.raises(NotImplementedError):
             check.run_check()
+
+
+class TestAsyncCheck:
+    """Test the AsyncCheck base class"""
+
+    def create_mock_checker(self) -> Mock:
+        checker = Mock()
+        checker._features_checked = FeatureSet()
+        checker._checks_run = set()
+        checker._client_obj = Mock()
+        checker._client_obj.features = FeatureSet()
+        checker.async_calendar.return_value = None
+        return checker
+
+    def test_sync_run_check_runs_async_check(self) -> None:
+        """The sync run_check API should still work for async checks"""
+
+        class TestCheck(AsyncCheck):
+            executed = False
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                TestCheck.executed = True
+
+        checker = self.create_mock_checker()
+        TestCheck(checker).run_check()
+
+        assert TestCheck.executed
+        assert TestCheck in checker._checks_run
+
+    def test_run_check_async_runs_sync_and_async_dependencies(self) -> None:
+        """run_check_async should run both sync and async dependencies first"""
+        order = []
+
+        class SyncDependency(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                order.append("sync")
+
+        class AsyncDependency(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                order.append("async")
+
+        class MainCheck(AsyncCheck):
+            depends_on = {SyncDependency, AsyncDependency}
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                order.append("main")
+
+        checker = self.create_mock_checker()
+        asyncio.run(MainCheck(checker).run_check_async())
+
+        assert sorted(order[:2]) == ["async", "sync"]
+        assert order[2] == "main"
+
+    def test_search_falls_back_to_thread_without_async_client(self) -> None:
+        """Without an async client, search should call the blocking calendar.search"""
+
+        class TestCheck(AsyncCheck):
+            features_to_be_checked = set()
+
+        checker = self.create_mock_checker()
+        calendar = Mock()
+        calendar.search.return_value = ["event"]
+
+        result = asyncio.run(TestCheck(checker).search(calendar, event=True))
+
+        assert result == ["event"]
+        calendar.search.assert_called_once_with(event=True)
+
+    def test_run_check_restores_client_features(self) -> None:
+        """The client features should be blanked out while the check runs, and restored afterwards"""
+        seen = []
+
+        class TestCheck(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                seen.append(self.checker._client_obj.features)
+
+        checker = self.create_mock_checker()
+        original_features = checker._client_obj.features
+        TestCheck(checker).run_check()
+
+        assert seen == [checker._features_checked]
+        assert checker._client_obj.features is original_features
+
+
+class TestRecurrenceSearch:
+    """Test the searches done by CheckRecurrenceSearch"""
+
+    def create_check(self, features) -> checks.CheckRecurrenceSearch:
+        checker = Mock()
+        checker._features_checked = FeatureSet(features)
+        checker.features_checked = checker._features_checked
+        checker.debug_mode = None
+        checker.stream = None
+        check = checks.CheckRecurrenceSearch(checker)
+        check.calls = []
+
+        def found(dtstart, **component):
+            obj = Mock()
+            obj.component = {"dtstart": dtstart, **component}
+            return obj
+
+        async def search(calendar, **searchargs):
+            check.calls.append(searchargs)
+            if searchargs.get("todo"):
+                raise ReportError("no task searches on this server")
+            if searchargs["start"].hour == 11:
+                return [found(
+                    datetime(2000, 2, 13, 12, tzinfo=timezone.utc),
+                    summary="February recurrence with different summary",
+                    RECURRENCE_ID=Mock(dt=datetime(2000, 2, 13, 12, tzinfo=timezone.utc)),
+                )]
+            return [found(datetime(2000, 2, 12, 12, tzinfo=timezone.utc))]
+
+        check.search = search
+        return check
+
+    def test_failing_task_search_keeps_event_features(self) -> None:
+        """A failing task search should not lose the event features, and the guarded task search should not be sent"""
+        check = self.create_check({"search.time-range.todo": {"support": "unsupported"}})
+        with pytest.raises(ReportError):
+            asyncio.run(check._run_check())
+
+        for feature in (
+            "search.recurrences.includes-implicit.event",
+            "search.recurrences.includes-implicit.infinite-scope",
+            "search.recurrences.expanded.event",
+            "search.recurrences.expanded.exception",
+        ):
+            assert check.journal.features()[feature] == {"support": "full"}
+        assert not [x for x in check.calls if x.get("todo") and x["start"].month == 1]
+
+
+class TestFeatureIndex:
+    """Test the mapping from features to checks"""
+
+    classes = [
+        checks.PrepareCalendar,
+        checks.CheckSearch,
+        checks.CheckRecurrenceSearch,
+        checks.CheckMakeDeleteCalendar,
+        checks.CheckServerLatency,
+    ]
+
+    def test_index(self) -> None:
+        """Every declared feature should map to the check declaring it"""
+        index = feature_index(self.classes)
+        assert index["search.category"] == {checks.CheckSearch}
+        assert index["save-load.event"] == {checks.PrepareCalendar}
+
+    def test_closure_includes_dependencies(self) -> None:
+        """The checks needed should include the checks depended on, transitively"""
+        found = checks_for_features(self.classes, ["search.recurrences.expanded.event"])
+        assert checks.CheckRecurrenceSearch in found
+        assert checks.PrepareCalendar in found
+        assert checks.CheckGetCurrentUserPrincipal in found
+        assert checks.CheckServerLatency not in found
+
+    def test_parent_feature(self) -> None:
+        """A parent feature should give the checks for all its subfeatures"""
+        assert checks.CheckSearch in checks_for_features(self.classes, ["search"])
+        assert checks.CheckRecurrenceSearch in checks_for_features(self.classes, ["search"])
+
+    def test_subfeature(self) -> None:
+        """A subfeature not checked by itself should give the check for the parent feature"""
+        found = checks_for_features(self.classes, ["search.category.fullstring.smart.nonexisting"])
+        assert checks.CheckSearch in found
+
+    def test_unknown_feature(self) -> None:
+        """A feature no check knows about should raise ValueError"""
+        with pytest.raises(ValueError):
+            checks_for_features(self.classes, ["no-such-feature"])
+
+
+def _plugin_module(name, features=()):
+    """A module with a check, as if it was installed from another package"""
+    module = types.ModuleType(name)
+    exec(
+        "from caldav_server_tester.checks_base import Check\n"
+        "class CheckPlugin(Check):\n"
+        f"    features_to_be_checked = {set(features)!r}\n",
+        module.__dict__,
+    )
+    return module
+
+
+class _EntryPoint:
+    def __init__(self, name, obj):
+        self.name = name
+        self.obj = obj
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        return self.obj
+
+
+class TestRegistry:
+    """Test the check registry"""
+
+    def test_builtin_checks(self) -> None:
+        """All the checks in the checks module should be registered, but not the base classes"""
+        found = all_checks()
+        assert checks.CheckSearch in found
+        assert checks.PrepareCalendar in found
+        assert Check not in found
+        assert AsyncCheck not in found
+
+    def test_checks_from_elsewhere_not_included(self) -> None:
+        """Check classes defined outside the check modules (like in the tests) should not be included"""
+
+        class CheckInTest(Check):
+            features_to_be_checked = set()
+
+        assert CheckInTest not in all_checks()
+        with pytest.raises(ValueError):
+            find_check("CheckInTest")
+
+    def test_entry_points(self) -> None:
+        """Checks from entry points should be included"""
+        module = _plugin_module("fake_plugin_all")
+        entry_points = [_EntryPoint("CheckPlugin", module.CheckPlugin)]
+        with patch.object(checks_base, "_entry_points", return_value=entry_points):
+            assert module.CheckPlugin in all_checks()
+
+    def test_find_check_loads_only_the_named_entry_point(self) -> None:
+        """Finding a check should not load the other plugins"""
+        module = _plugin_module("fake_plugin_find")
+        other = _EntryPoint("CheckOther", None)
+        entry_points = [other, _EntryPoint("CheckPlugin", module)]
+        with patch.object(checks_base, "_entry_points", return_value=entry_points):
+            assert find_check("CheckPlugin") is module.CheckPlugin
+            assert find_check("CheckSearch") is checks.CheckSearch
+        assert not other.loaded
+
+    def test_check_features_loads_plugins_only_when_needed(self) -> None:
+        """The built-in checks should be tried first when resolving features"""
+        module = _plugin_module("fake_plugin_features", features={"plugin-feature"})
+        entry_point = _EntryPoint("CheckPlugin", module.CheckPlugin)
+        client = Mock()
+        client.features = FeatureSet()
+        checker = ServerQuirkChecker(client)
+        with patch.object(checks_base, "_entry_points", return_value=[entry_point]):
+            assert checks.CheckSearch in checker.checks_for_features(["search.category"])
+            assert not entry_point.loaded
+            assert module.CheckPlugin in checker.checks_for_features(["plugin-feature"])
+            assert entry_point.loaded
+
+
+class TestFeatureJournal:
+    """Test the journaling of the features written by a check"""
+
+    def create_checker(self) -> Mock:
+        checker = Mock()
+        checker._features_checked = FeatureSet()
+        checker._checks_run = set()
+        checker._client_obj = Mock()
+        checker._client_obj.features = FeatureSet()
+        checker.debug_mode = None
+        return checker
+
+    def test_writes_are_recorded(self) -> None:
+        """All writes should be recorded in order, and the values merged"""
+        fs = FeatureSet()
+        journal = FeatureJournal()
+        journal.write(fs, "create-calendar", {"support": "fragile"})
+        journal.write(fs, "create-calendar", {"behaviour": "slow"})
+        journal.write(fs, "delete-calendar", {"support": "full"})
+
+        assert [x[0] for x in journal.entries] == ["create-calendar", "create-calendar", "delete-calendar"]
+        assert journal.keys() == {"create-calendar", "delete-calendar"}
+        assert journal.features()["create-calendar"] == {"support": "fragile", "behaviour": "slow"}
+        assert fs.is_supported("create-calendar", dict) == {"support": "fragile", "behaviour": "slow"}
+
+    def test_set_feature_goes_through_journal(self) -> None:
+        """set_feature should record the feature in the journal of the check"""
+        check = Check(self.create_checker())
+        check.expected_features = FeatureSet()
+        check.set_feature("create-calendar", False)
+        assert check.journal.features() == {"create-calendar": {"support": "unsupported"}}
+
+    def test_run_check_does_not_scan_feature_set(self) -> None:
+        """The validation after a check should not need to scan the whole feature set"""
+
+        class TestCheck(Check):
+            features_to_be_checked = {"create-calendar"}
+
+            def _run_check(self) -> None:
+                self.set_feature("create-calendar", True)
+
+        checker = self.create_checker()
+        with patch.object(FeatureSet, "dotted_feature_set_list", side_effect=AssertionError("scanned")):
+            TestCheck(checker).run_check()
+        assert TestCheck in checker._checks_run
+
+    def test_undeclared_feature_already_set(self) -> None:
+        """Writing an undeclared feature should be caught also if another check has set it before"""
+
+        class TestCheck(Check):
+            features_to_be_checked = {"create-calendar"}
+
+            def _run_check(self) -> None:
+                self.set_feature("create-calendar", True)
+                self.set_feature("delete-calendar", True)
+
+        checker = self.create_checker()
+        checker._features_checked.copyFeatureSet({"delete-calendar": {"support": "full"}}, collapse=False)
+        with pytest.raises(AssertionError):
+            TestCheck(checker).run_check()
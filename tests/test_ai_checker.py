@@ -96,9 +96,9 @@ class TestServerQuirkCheckerProperties:
 class TestServerQuirkCheckerCheckOne:
     """Test ServerQuirkChecker.check_one method"""
 
-    @patch('caldav_server_tester.checker.checks')
-    def test_check_one_retrieves_check_by_name(self, mock_checks) -> None:
-        """check_one should retrieve check class by name from checks module"""
+    @patch('caldav_server_tester.checker.find_check')
+    def test_check_one_retrieves_check_by_name(self, mock_find_check) -> None:
+        """check_one should retrieve check class by name from the check registry"""
         client = Mock()
         client.features = FeatureSet()
         checker = ServerQuirkChecker(client)
@@ -107,12 +107,13 @@ class TestServerQuirkCheckerCheckOne:
         MockCheck = MagicMock(spec=Check)
         mock_check_instance = MagicMock(spec=Check)
         MockCheck.return_value = mock_check_instance
-        mock_checks.TestCheck = MockCheck
+        mock_find_check.return_value = MockCheck
 
         checker.check_one("TestCheck")
 
         # Verify the check was retrieved and instantiated
-        mock_checks.TestCheck.assert_called_once_with(checker)
+        mock_find_check.assert_called_once_with("TestCheck")
+        MockCheck.assert_called_once_with(checker)
         mock_check_instance.run_check.assert_called_once()
 
 
@@ -194,6 +195,24 @@ class TestServerQuirkCheckerReport:
         assert "features" in result
         assert isinstance(result["features"], dict)
 
+    def test_report_partial(self) -> None:
+        """report should tell if not all the (non opt-in) checks were run"""
+        client = Mock()
+        client.features = FeatureSet()
+        client.server_name = "Test Server"
+        client.url = "https://example.com/caldav"
+        checker = ServerQuirkChecker(client)
+        check1 = Mock(opt_in=False)
+        check2 = Mock(opt_in=False)
+        slow_check = Mock(opt_in=True)
+        checker._check_classes = lambda plugins=True: [check1, check2, slow_check]
+
+        checker._checks_run.add(check1)
+        assert checker.report(return_what=dict)["partial"] is True
+
+        checker._checks_run.add(check2)
+        assert checker.report(return_what=dict)["partial"] is False
+
     def test_report_json_returns_valid_json_string(self) -> None:
         """report(return_what='json') should return a valid JSON string"""
         client = Mock()
@@ -259,6 +278,50 @@ class TestServerQuirkCheckerReport:
         assert isinstance(result, dict)
 
 
+class TestServerQuirkCheckerExpectationDiff:
+    """Test the comparison of observed and expected features after the run"""
+
+    def create_checker(self, expected) -> ServerQuirkChecker:
+        client = Mock()
+        client.features = FeatureSet(expected)
+        client.server_name = "Test Server"
+        client.url = "https://example.com/caldav"
+        return ServerQuirkChecker(client, debug_mode="report")
+
+    def test_diff_in_report(self) -> None:
+        """Features not as expected should be found in diff1 and diff2"""
+        checker = self.create_checker({"create-calendar": {"support": "unsupported"}})
+        checker._features_checked.copyFeatureSet({
+            "create-calendar": {"support": "full"},
+            "delete-calendar": {"support": "full"},
+        }, collapse=False)
+
+        report = checker.report(return_what=dict)
+        assert report["diff1"] == {"create-calendar": {"support": "unsupported"}}
+        assert report["diff2"] == {"create-calendar": {"support": "full"}}
+
+    def test_ignored_differences(self) -> None:
+        """Free-text information, delays, fragile support and observations should not count as differences"""
+        checker = self.create_checker({"delete-calendar": {"support": "fragile"}})
+        checker._features_checked.copyFeatureSet({
+            "create-calendar": {"support": "full", "behaviour": "slow", "delay": 2},
+            "delete-calendar": {"support": "full"},
+            "latency.report": {"support": "full", "p50": 3},
+        }, collapse=False)
+
+        assert checker.expectation_diff() == ({}, {})
+
+    def test_report_mode_does_not_log(self, caplog) -> None:
+        """With debug_mode report, set_feature should not compare nor log anything"""
+        checker = self.create_checker({"create-calendar": {"support": "unsupported"}})
+        check = Check(checker)
+        check.expected_features = checker.expected_features
+        check.set_feature("create-calendar", True)
+
+        assert not caplog.records
+        assert "create-calendar" in checker.expectation_diff()[1]
+
+
 class TestServerQuirkCheckerCleanup:
     """Test ServerQuirkChecker.cleanup method"""
 
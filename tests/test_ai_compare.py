@@ -0,0 +1,141 @@
+"""Unit tests for comparing reports with previous reports"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import json
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+from caldav_server_tester.compare import compare_reports
+from caldav_server_tester.compare import compare_with
+from caldav_server_tester.compare import load_reports
+
+
+def report(name, features, ts=0, checked=None):
+    ret = {"name": name, "url": f"https://{name}.example.com/", "ts": ts, "features": features}
+    if checked is not None:
+        ret["features_checked"] = checked
+    return ret
+
+
+class TestCompareReports:
+    """Test the comparison of the features in two reports"""
+
+    def test_no_changes(self) -> None:
+        """Identical reports should give an empty diff"""
+        features = {"search.category": {"support": "unsupported"}}
+        diff = compare_reports(report("a", features), report("a", features))
+        assert diff == {"added": {}, "removed": {}, "changed": {}, "regressions": [], "improvements": []}
+
+    def test_regression_and_improvement(self) -> None:
+        """Worse support should be a regression, better support an improvement"""
+        previous = report("a", {"search.category": {"support": "unsupported"}})
+        current = report("a", {"search.text": {"support": "broken"}})
+        diff = compare_reports(previous, current)
+        assert diff["added"] == {"search.text": {"support": "broken"}}
+        assert diff["removed"] == {"search.category": {"support": "unsupported"}}
+        assert diff["changed"] == {
+            "search.category": {"previous": "unsupported", "current": "full"},
+            "search.text": {"previous": "full", "current": "broken"},
+        }
+        assert diff["regressions"] == ["search.text"]
+        assert diff["improvements"] == ["search.category"]
+
+    def test_collapsed_parent(self) -> None:
+        """A feature not given should have the value of the nearest parent"""
+        previous = report("a", {"search.category": {"support": "unsupported"}})
+        current = report("a", {"search.category": {"support": "unsupported"}, "search.category.fullstring": {"support": "full"}})
+        diff = compare_reports(previous, current)
+        assert diff["added"] == {}
+        assert diff["improvements"] == ["search.category.fullstring"]
+
+    def test_unknown_and_observations(self) -> None:
+        """Changes to or from unknown are neither regressions nor improvements, observations are not compared"""
+        previous = report("a", {"search.text": {"support": "unknown"}, "latency.report": {"p50": 10}})
+        current = report("a", {"search.text": {"support": "unsupported"}, "latency.report": {"p50": 20}})
+        diff = compare_reports(previous, current)
+        assert diff["changed"] == {"search.text": {"previous": "unknown", "current": "unsupported"}}
+        assert diff["regressions"] == diff["improvements"] == []
+
+    def test_partial_run(self) -> None:
+        """Only features checked in both runs should be compared"""
+        previous = report(
+            "a",
+            {"search.text": {"support": "broken"}, "search.category": {"support": "unsupported"}},
+            checked=["search.text", "search.category", "sync-token"],
+        )
+        ## Only search.category and sync-token checked, both with the default value
+        current = report("a", {}, checked=["search.category", "sync-token"])
+        diff = compare_reports(previous, current)
+        assert diff["changed"] == {"search.category": {"previous": "unsupported", "current": "full"}}
+        assert diff["removed"] == {"search.category": {"support": "unsupported"}}
+        assert diff["improvements"] == ["search.category"]
+
+        ## The other way around
+        diff = compare_reports(current, report("a", {"sync-token": {"support": "broken"}}, checked=["sync-token"]))
+        assert diff["regressions"] == ["sync-token"]
+        assert diff["added"] == {"sync-token": {"support": "broken"}}
+
+    def test_subfeatures_checked(self) -> None:
+        """A feature is checked if a parent feature was written"""
+        previous = report("a", {}, checked=["search.category"])
+        current = report("a", {"search.category": {"support": "unsupported"}}, checked=["search.category"])
+        assert compare_reports(previous, current)["regressions"] == ["search.category"]
+        current["features"]["search.category.fullstring"] = {"support": "broken"}
+        assert compare_reports(previous, current)["regressions"] == ["search.category", "search.category.fullstring"]
+
+
+class TestLoadReports:
+    """Test loading previous reports"""
+
+    def test_single_reports_and_lists(self, tmp_path) -> None:
+        """Files with one report or a list of reports should be accepted, the newest report for each server is used"""
+        (tmp_path / "a.json").write_text(json.dumps(report("a", {}, ts=2)))
+        (tmp_path / "fleet.json").write_text(json.dumps([
+            report("a", {"search.text": {"support": "broken"}}, ts=1),
+            report("b", {}, ts=1),
+            {"name": "c", "error": "ConnectionError: nope"},
+        ]))
+        previous = load_reports([tmp_path / "a.json", tmp_path / "fleet.json"])
+        assert set(previous) == {"a", "b"}
+        assert previous["a"]["ts"] == 2
+
+    def test_compare_with(self) -> None:
+        """The report should be compared with the previous report for the same server"""
+        previous = {"a": report("a", {}), "b": report("b", {"search.text": {"support": "broken"}})}
+        assert compare_with(previous, report("b", {}))["improvements"] == ["search.text"]
+        assert compare_with(previous, report("c", {})) is None
+        assert compare_with(previous, {"name": "a", "error": "ConnectionError: nope"}) is None
+
+
+class TestCompareCli:
+    """Test --compare"""
+
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_fleet_regressions(self, check_fleet, tmp_path) -> None:
+        """A regression for any of the servers should give exit status 1"""
+        previous = tmp_path / "previous.json"
+        previous.write_text(json.dumps([report("a", {}), report("b", {})]))
+        check_fleet.return_value = iter([report("a", {}), report("b", {"search.text": {"support": "broken"}})])
+
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b", "--compare", str(previous)])
+
+        assert result.exit_code == 1
+        reports = json.loads(result.output[result.output.index("["):])
+        assert [x["comparison"]["regressions"] for x in reports] == [[], ["search.text"]]
+
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_fleet_no_regressions(self, check_fleet, tmp_path) -> None:
+        """Improvements only should give exit status 0"""
+        previous = tmp_path / "previous.json"
+        previous.write_text(json.dumps([report("a", {"search.text": {"support": "broken"}})]))
+        check_fleet.return_value = iter([report("a", {}), report("b", {})])
+
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b", "--compare", str(previous)])
+
+        assert result.exit_code == 0
+        reports = json.loads(result.output[result.output.index("["):])
+        assert reports[0]["comparison"]["improvements"] == ["search.text"]
+        assert reports[1]["comparison"] is None
@@ -4,7 +4,6 @@
 
 from datetime import date, datetime, timezone
 from unittest.mock import Mock
-import pytest
 
 from caldav_server_tester.checks import _filter_2000
 
@@ -12,10 +11,11 @@ from caldav_server_tester.checks import _filter_2000
 class TestFilter2000:
     """Test the _filter_2000 function that filters calendar objects by date range"""
 
-    def create_mock_object(self, dtstart=None, dtend=None, due=None) -> Mock:
+    def create_mock_object(self, dtstart=None, dtend=None, due=None, uid="csc_test") -> Mock:
         """Helper to create a mock calendar object with date properties"""
         obj = Mock()
         component = Mock()
+        component.get = lambda key, default=None: uid if key == "uid" else default
 
         # Set up the component properties
         if dtstart is not None:
@@ -87,12 +87,15 @@ class TestFilter2000:
         assert result[0] == obj
 
     def test_filter_excludes_objects_without_dates(self) -> None:
-        """Objects without any date fields should cause TypeError (code has bug with date(1980))"""
+        """Objects without any date fields should be excluded"""
         obj = self.create_mock_object()
-        # Note: This test documents a bug in the actual code - date(1980) is missing month/day
-        # The code should use date(1980, 1, 1) instead
-        with pytest.raises(TypeError, match="missing required argument"):
-            list(_filter_2000([obj]))
+        assert list(_filter_2000([obj])) == []
+
+    def test_filter_excludes_foreign_objects(self) -> None:
+        """Objects not made by the checker should be excluded, without looking at the dates"""
+        dated = self.create_mock_object(dtstart=date(2000, 6, 15), uid="someone-elses-event")
+        undated = self.create_mock_object(uid="someone-elses-task")
+        assert list(_filter_2000([dated, undated])) == []
 
     def test_filter_handles_multiple_objects(self) -> None:
         """Filter should correctly handle multiple objects"""
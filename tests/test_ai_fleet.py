@@ -0,0 +1,110 @@
+"""Unit tests for the fleet mode"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from click.testing import CliRunner
+
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+from caldav_server_tester.fleet import check_fleet, check_server
+
+
+class TestCheckServer:
+    """Test checking one server in the fleet"""
+
+    @patch('caldav.davclient.get_davclient')
+    def test_connection_errors_are_reported_not_raised(self, get_davclient) -> None:
+        """A failing server should give an error report rather than an exception"""
+        get_davclient.side_effect = ConnectionError("no route to host")
+
+        result = check_server("broken-server")
+
+        assert result["name"] == "broken-server"
+        assert "no route to host" in result["error"]
+
+    @patch('caldav_server_tester.checker.ServerQuirkChecker')
+    @patch('caldav.davclient.get_davclient')
+    def test_returns_report_dict(self, get_davclient, checker_class) -> None:
+        """A successful run should return the report as a dict"""
+        get_davclient.return_value = MagicMock()
+        checker_class.return_value.report.return_value = {"name": "good-server", "features": {}}
+
+        result = check_server("good-server", jobs=3)
+
+        assert result == {"name": "good-server", "features": {}}
+        checker_class.return_value.check_all.assert_called_once_with(jobs=3)
+        assert checker_class.call_args.kwargs["debug_mode"] == "logging"
+        get_davclient.assert_called_once_with(name="good-server", testconfig=True)
+
+
+class TestCheckFleet:
+    """Test checking multiple servers in worker processes"""
+
+    def test_failures_are_isolated_per_server(self) -> None:
+        """Every server should get a report, even if all of them fail"""
+        with patch.dict('os.environ', {"CALDAV_CONFIG_FILE": "/nonexistent"}):
+            results = list(check_fleet(["server1", "server2"], processes=2))
+
+        assert sorted(x["name"] for x in results) == ["server1", "server2"]
+        assert all("error" in x for x in results)
+
+
+class TestFleetCli:
+    """Test the fleet mode of the command line interface"""
+
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_multiple_names_streams_json_list(self, check_fleet) -> None:
+        """Giving --name multiple times should output one JSON list with all reports"""
+        check_fleet.return_value = iter([{"name": "a"}, {"name": "b"}])
+
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b", "--json"])
+
+        assert result.exit_code == 0
+        output = result.output[result.output.index("["):]
+        assert json.loads(output) == [{"name": "a"}, {"name": "b"}]
+        assert list(check_fleet.call_args[0][0]) == ["a", "b"]
+
+    @pytest.mark.parametrize("options", [
+        ["--stream"],
+        ["--check-features", "search"],
+        ["--run-checks", "CheckSearch"],
+        ["--asyncio"],
+        ["--record", "cassette"],
+        ["--replay", "cassette"],
+        ["--load-test"],
+        ["--caldav-url", "https://example.com/"],
+        ["--caldav-username", "someone"],
+        ["--caldav-password", "secret"],
+    ])
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_unsupported_options(self, check_fleet, options) -> None:
+        """Options not supported in fleet mode should give a usage error rather than being ignored"""
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b"] + options)
+        assert result.exit_code == 2
+        assert f"{options[0]} can't be used when checking multiple servers" in result.output
+        check_fleet.assert_not_called()
+
+    @pytest.mark.parametrize("options, debug_mode", [
+        ([], "logging"),
+        (["--debug-mode", "report"], "report"),
+        (["--debug-mode", "none"], None),
+    ])
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_debug_mode(self, check_fleet, options, debug_mode) -> None:
+        """The debug mode should be passed on to the servers, logging by default"""
+        check_fleet.return_value = iter([])
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b"] + options)
+        assert result.exit_code == 0, result.output
+        assert check_fleet.call_args.kwargs["debug_mode"] == debug_mode
+
+    @patch('caldav_server_tester.fleet.check_fleet')
+    def test_no_debugger_in_fleet_mode(self, check_fleet) -> None:
+        """The debugger can't be started in the worker processes"""
+        result = CliRunner().invoke(check_server_compatibility, ["--name", "a", "--name", "b", "--debug-mode", "pdb"])
+        assert result.exit_code == 2
+        check_fleet.assert_not_called()
+
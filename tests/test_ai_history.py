@@ -0,0 +1,103 @@
+"""Unit tests for the history database"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from caldav_server_tester.caldav_server_tester import history as history_cli
+from caldav_server_tester.history import History
+
+
+def report(name, features, ts, caldav_version="2.1.2", checked=None, partial=None):
+    ret = {"name": name, "url": f"https://{name}.example.com/", "ts": ts, "caldav_version": caldav_version, "features": features}
+    if checked is not None:
+        ret["features_checked"] = checked
+    if partial is not None:
+        ret["partial"] = partial
+    return ret
+
+
+@pytest.fixture
+def history(tmp_path):
+    with History(str(tmp_path / "history.sqlite")) as history:
+        yield history
+
+
+class TestHistory:
+    """Test the History class"""
+
+    def test_add_once(self, history) -> None:
+        """A report should only be added once, reports without features not at all"""
+        assert history.add(report("a", {}, ts=1))
+        assert not history.add(report("a", {}, ts=1))
+        assert not history.add({"name": "b", "error": "ConnectionError: nope"})
+        assert history.servers("search.text") == {"a": "full"}
+
+    def test_changes(self, history) -> None:
+        """Only the runs where the support changed should be listed, features resolved through their parents"""
+        history.add(report("a", {}, ts=1))
+        history.add(report("a", {"search": {"support": "unsupported"}}, ts=2, caldav_version="2.2.0"))
+        history.add(report("a", {"search.text": {"support": "unsupported"}}, ts=3))
+        history.add(report("a", {}, ts=4))
+        history.add(report("b", {"search.text": {"support": "broken"}}, ts=2))
+
+        changes = history.changes("a", "search.text")
+        assert [(x["ts"], x["support"]) for x in changes] == [(1, "full"), (2, "unsupported"), (4, "full")]
+        assert changes[1]["caldav_version"] == "2.2.0"
+        assert changes[1]["value"] == {"support": "unsupported"}
+
+    def test_servers(self, history) -> None:
+        """The support on each server should be taken from the latest run"""
+        history.add(report("a", {"search.text": {"support": "broken"}}, ts=1))
+        history.add(report("a", {}, ts=2))
+        history.add(report("b", {"search.text": {"support": "broken"}}, ts=2))
+        history.add(report("c", {"search": {"support": "unsupported"}}, ts=1))
+        assert history.servers("search.text") == {"a": "full", "b": "broken", "c": "unsupported"}
+
+    def test_partial_runs(self, history) -> None:
+        """Runs not checking the feature should be ignored"""
+        history.add(report("a", {"search.text": {"support": "broken"}}, ts=1))
+        history.add(report("a", {}, ts=2, checked=["sync-token"], partial=True))
+        history.add(report("a", {}, ts=3, checked=["search"], partial=True))
+        history.add(report("a", {}, ts=4, checked=["sync-token"], partial=True))
+        history.add(report("b", {"search.text": {"support": "broken"}}, ts=1, checked=["search.text"], partial=True))
+        history.add(report("b", {}, ts=2, checked=["sync-token"], partial=True))
+        history.add(report("c", {}, ts=1, checked=["sync-token"], partial=True))
+
+        assert [(x["ts"], x["support"]) for x in history.changes("a", "search.text")] == [(1, "broken"), (3, "full")]
+        assert history.changes("c", "search.text") == []
+        assert history.servers("search.text") == {"a": "full", "b": "broken"}
+        assert history.servers("sync-token") == {"a": "full", "b": "full", "c": "full"}
+
+    def test_full_runs(self, history) -> None:
+        """A full run counts for all features, also those not in features_checked (having the default value)"""
+        history.add(report("a", {"search.text": {"support": "broken"}}, ts=1, checked=["search.text"], partial=False))
+        history.add(report("a", {}, ts=2, checked=["sync-token"], partial=False))
+        assert [(x["ts"], x["support"]) for x in history.changes("a", "search.text")] == [(1, "broken"), (2, "full")]
+        assert history.servers("search.text") == {"a": "full"}
+
+
+class TestHistoryCli:
+    """Test the caldav-server-tester-history command"""
+
+    def test_import_and_query(self, tmp_path) -> None:
+        """Stored reports should be importable, and queryable afterwards"""
+        db = str(tmp_path / "history.sqlite")
+        (tmp_path / "fleet.json").write_text(json.dumps([
+            report("a", {}, ts=1),
+            report("b", {"search.text": {"support": "broken"}}, ts=1),
+        ]))
+        (tmp_path / "a.json").write_text(json.dumps(report("a", {"search.text": {"support": "fragile"}}, ts=2)))
+
+        result = CliRunner().invoke(history_cli, ["--db", db, "import", str(tmp_path / "fleet.json"), str(tmp_path / "a.json")])
+        assert result.exit_code == 0, result.output
+        assert "3 reports added" in result.output
+
+        result = CliRunner().invoke(history_cli, ["--db", db, "servers", "search.text", "--support", "broken", "--json"])
+        assert json.loads(result.output) == {"b": "broken"}
+
+        result = CliRunner().invoke(history_cli, ["--db", db, "changes", "a", "search.text", "--json"])
+        assert [x["support"] for x in json.loads(result.output)] == ["full", "fragile"]
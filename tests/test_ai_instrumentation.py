@@ -0,0 +1,103 @@
+"""Unit tests for the per-check timing instrumentation"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import asyncio
+import time
+from unittest.mock import Mock
+
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.instrumentation import Timing, wrap
+from caldav_server_tester.standin import StandInServer
+
+
+def slow_request(url, method="GET", body="", headers=None):
+    time.sleep(0.01)
+    response = Mock()
+    response._raw = b"x" * 100
+    return response
+
+
+class TestTiming:
+    """Test the Timing class and the request wrapper"""
+
+    def test_requests_are_counted_in_the_running_timing(self) -> None:
+        """Requests within measure() should be counted, with bytes sent and received"""
+        request = wrap(slow_request)
+        timing = Timing()
+        with timing.measure():
+            request("url", "PUT", "12345")
+            request("url", "GET")
+        result = timing.as_dict()
+        assert result["requests"] == 2
+        assert result["bytes_sent"] == 5
+        assert result["bytes_received"] == 200
+        assert result["network"] >= 0.02
+        assert result["wall"] >= result["network"]
+        assert result["client"] == round(max(timing.wall - timing.network, 0), 3)
+
+    def test_requests_outside_measure_are_not_counted(self) -> None:
+        """Requests when no check is running should pass through uncounted"""
+        request = wrap(slow_request)
+        timing = Timing()
+        request("url", "GET")
+        assert timing.requests == 0
+
+    def test_failed_requests_are_counted(self) -> None:
+        """A request raising an exception should still be counted"""
+        def failing_request(url, method="GET", body="", headers=None):
+            raise ValueError("no")
+
+        request = wrap(failing_request)
+        timing = Timing()
+        with timing.measure():
+            try:
+                request("url", "GET")
+            except ValueError:
+                pass
+        assert timing.requests == 1
+        assert timing._inflight == 0
+
+    def test_concurrent_requests_network_time_counted_once(self) -> None:
+        """Overlapping requests should not count the network time twice"""
+        async def async_request(url, method="GET", body="", headers=None):
+            await asyncio.sleep(0.05)
+
+        request = wrap(async_request)
+        timing = Timing()
+
+        async def run():
+            with timing.measure():
+                await asyncio.gather(*(request("url") for _ in range(4)))
+
+        asyncio.run(run())
+        assert timing.requests == 4
+        assert timing.network < 0.15
+        assert timing.network <= timing.wall
+
+    def test_add(self) -> None:
+        """Adding a Timing should sum up the requests, bytes and network time"""
+        request = wrap(slow_request)
+        inner = Timing()
+        with inner.measure():
+            request("url", "PUT", "12345")
+        outer = Timing()
+        outer.add(inner)
+        assert outer.requests == 1
+        assert outer.bytes_sent == 5
+        assert outer.network == inner.network
+
+
+class TestReportTimings:
+    """Test the timings section of the report"""
+
+    def test_report_has_timings_per_check(self) -> None:
+        """Each check run should get an entry in the timings"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckMakeDeleteCalendar")
+        timings = checker.report(return_what=dict)["timings"]
+        assert set(timings) == {"CheckGetCurrentUserPrincipal", "CheckMakeDeleteCalendar"}
+        assert timings["CheckMakeDeleteCalendar"]["requests"] > 1
+        assert timings["CheckMakeDeleteCalendar"]["bytes_received"] > 0
+
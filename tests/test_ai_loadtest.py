@@ -0,0 +1,66 @@
+"""Unit tests for the load testing mode"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.loadtest import find_saturation
+from caldav_server_tester.standin import StandInServer
+
+
+def _level(clients, throughput, error_rate=0, p95=10):
+    return {"clients": clients, "throughput": throughput, "error_rate": error_rate, "p95": p95}
+
+
+class TestFindSaturation:
+    """Test how the saturation point is found"""
+
+    def test_scaling(self) -> None:
+        """No saturation while the throughput keeps on scaling"""
+        assert find_saturation([_level(1, 10), _level(2, 19), _level(4, 35)]) is None
+
+    def test_throughput_stops_scaling(self) -> None:
+        """The saturation point is the last level giving more throughput"""
+        saturation = find_saturation([_level(1, 10), _level(2, 19), _level(4, 20)])
+        assert saturation == {"clients": 2, "throughput": 19, "reason": "throughput stopped scaling"}
+
+    def test_errors(self) -> None:
+        """Errors means saturation, even if the throughput is scaling"""
+        saturation = find_saturation([_level(1, 10), _level(2, 19, error_rate=0.05)])
+        assert saturation["clients"] == 1
+        assert saturation["reason"] == "error rate"
+
+    def test_errors_from_start(self) -> None:
+        """If even one client gives errors, the server can't take any clients"""
+        assert find_saturation([_level(1, 10, error_rate=0.5)])["clients"] == 0
+
+    def test_latency(self) -> None:
+        """Climbing latency means saturation"""
+        saturation = find_saturation([_level(1, 10), _level(2, 19), _level(4, 40, p95=31)])
+        assert saturation["clients"] == 2
+        assert saturation["reason"] == "latency climbing"
+
+
+class TestLoadTest:
+    """Run a short load test towards the stand-in server"""
+
+    def test_load_test_report(self) -> None:
+        """The load test result should be found in the report, and no events should be left behind"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            result = checker.run_load_test(duration=0.2, max_clients=4)
+            assert not [x for x in checker.calendar.events() if "load test" in x.data]
+        assert result["levels"][0]["clients"] == 1
+        assert [x["clients"] for x in result["levels"]] == [1, 2, 4][: len(result["levels"])]
+        for level in result["levels"]:
+            assert level["operations"] > 0
+            assert level["error_rate"] == 0
+        assert result["max_throughput"] > 0
+        assert result["rate_limited"] is False
+        assert checker.report(return_what=dict)["load_test"] is result
+
+    def test_no_load_test_in_report(self) -> None:
+        """Without a load test, there should be no load_test section"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+        assert "load_test" not in checker.report(return_what=dict)
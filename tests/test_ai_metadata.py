@@ -0,0 +1,77 @@
+"""Unit tests for the precomputed metadata and the listing options"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from caldav_server_tester import metadata
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+
+SRC = os.path.dirname(os.path.dirname(metadata.__file__))
+
+
+class TestMetadata:
+    """Test the precomputed metadata"""
+
+    def test_up_to_date(self) -> None:
+        """metadata.json should be regenerated when the checks are changed (python -m caldav_server_tester.metadata)"""
+        with open(metadata.FILENAME) as f:
+            assert json.load(f) == metadata.generate()
+
+    def test_other_caldav_version(self) -> None:
+        """With another caldav version, the precomputed metadata should still be used"""
+        with patch.object(metadata, "_caldav_version", return_value="0.0.1"), \
+                patch.object(metadata, "generate") as generate:
+            assert metadata.load()["caldav_version"] != "0.0.1"
+        generate.assert_not_called()
+
+    def test_changed_checks(self) -> None:
+        """With changed check definitions, the metadata should be generated on the fly"""
+        with patch.object(metadata, "_checks_hash", return_value="0123"), \
+                patch.object(metadata, "generate", return_value={"checks": []}) as generate:
+            assert metadata.load() == {"checks": []}
+        generate.assert_called_once()
+
+    def test_missing_file(self, tmp_path) -> None:
+        """Without the file, the metadata should be generated on the fly"""
+        with patch.object(metadata, "FILENAME", str(tmp_path / "nonexistent.json")):
+            assert "CheckSearch" in [x["name"] for x in metadata.load()["checks"]]
+
+
+class TestListing:
+    """Test --list-checks and --list-features"""
+
+    def test_list_checks(self) -> None:
+        """--list-checks should list the checks with their features"""
+        result = CliRunner().invoke(check_server_compatibility, ["--list-checks"])
+        assert result.exit_code == 0
+        assert "CheckSearch" in result.output
+        assert "search.category" in result.output
+        assert "WARNING" not in result.output
+
+    def test_list_features_json(self) -> None:
+        """--list-features --json should give the features as JSON"""
+        result = CliRunner().invoke(check_server_compatibility, ["--list-features", "--json"])
+        assert result.exit_code == 0
+        features = json.loads(result.output)["features"]
+        assert features["latency.report"]["type"] == "server-observation"
+        assert "search.category" in features
+
+    def test_no_caldav_import(self) -> None:
+        """Listing the checks should not import the caldav library"""
+        code = (
+            "import sys\n"
+            "from caldav_server_tester import check_server_compatibility\n"
+            "check_server_compatibility(['--list-checks'], standalone_mode=False)\n"
+            "assert 'caldav' not in sys.modules, 'caldav was imported'\n"
+        )
+        env = dict(os.environ, PYTHONPATH=SRC)
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        assert "CheckSearch" in result.stdout
@@ -0,0 +1,124 @@
+"""Unit tests for polling the server, and the use of it in the checks"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+from unittest.mock import Mock, patch
+
+from caldav.compatibility_hints import FeatureSet
+from caldav.lib.error import NotFoundError
+from caldav_server_tester.checks import CheckMakeDeleteCalendar
+from caldav_server_tester.polling import wait_until
+
+
+class TestWaitUntil:
+    """Test the wait_until function"""
+
+    def test_returns_elapsed_time_when_condition_is_met(self) -> None:
+        """wait_until should return the time spent when the condition is met"""
+        attempts = []
+
+        def condition():
+            attempts.append(1)
+            return len(attempts) == 3
+
+        elapsed = wait_until(condition, timeout=5, interval=0.01)
+
+        assert elapsed is not None
+        assert 0.01 + 0.02 + 0.04 <= elapsed < 5
+        assert len(attempts) == 3
+
+    def test_returns_none_on_timeout(self) -> None:
+        """wait_until should give up at the deadline"""
+        assert wait_until(lambda: False, timeout=0.1, interval=0.01) is None
+
+    @patch('caldav_server_tester.polling.time.sleep')
+    def test_backoff_is_exponential_and_capped(self, sleep) -> None:
+        """The interval between the attempts should double up to max_interval"""
+        attempts = []
+
+        def condition():
+            attempts.append(1)
+            return len(attempts) == 6
+
+        wait_until(condition, timeout=1000, interval=1, backoff=2, max_interval=5)
+
+        assert [x.args[0] for x in sleep.call_args_list] == [1, 2, 4, 5, 5, 5]
+
+    @patch('caldav_server_tester.polling.time.sleep')
+    def test_no_sleeping_when_replaying(self, sleep) -> None:
+        """When replaying a cassette, the intervals should be counted rather than slept"""
+        attempts = []
+
+        def condition():
+            attempts.append(1)
+            return len(attempts) == 3
+
+        assert wait_until(condition, timeout=10, interval=1, max_interval=5, replaying=True) == 1 + 2 + 4
+        assert wait_until(lambda: False, timeout=10, interval=1, replaying=True) is None
+        sleep.assert_not_called()
+
+
+class TestDelayedCalendarDeletion:
+    """Test that CheckMakeDeleteCalendar detects delayed deletion without sleeping a fixed time"""
+
+    def create_check(self) -> CheckMakeDeleteCalendar:
+        checker = Mock()
+        checker._features_checked = FeatureSet()
+        checker._features_checked.copyFeatureSet({"create-calendar.auto": {"support": "unsupported"}}, collapse=False)
+        checker.debug_mode = None
+        checker.replaying = False
+        checker._client_obj = Mock()
+        return CheckMakeDeleteCalendar(checker)
+
+    def test_delayed_deletion_records_delay(self) -> None:
+        """A calendar disappearing after a while should be recorded with the observed delay"""
+        check = self.create_check()
+        lookups = []
+
+        def events():
+            lookups.append(1)
+            ## Found on creation, once after deletion, and on the first poll
+            if len(lookups) > 3:
+                raise NotFoundError()
+            return [Mock()]
+
+        check.checker.principal.make_calendar.return_value.events.return_value = []
+        check.checker.principal.calendar.return_value.events.side_effect = events
+
+        with patch('caldav_server_tester.polling.time.sleep'):
+            ret = check._try_make_calendar(cal_id="foo")
+
+        assert ret[0] is True
+        result = check.feature_checked("delete-calendar", dict)
+        assert result["support"] == "fragile"
+        assert result["behaviour"] == "delayed deletion"
+        assert "delay" in result
+
+    def test_delete_exception_retried(self) -> None:
+        """A delete failing at first and succeeding later should be fragile"""
+        check = self.create_check()
+        cal = check.checker.principal.make_calendar.return_value
+        cal.events.return_value = []
+        cal.delete.side_effect = [Exception("too early"), Exception("too early"), None]
+
+        with patch('caldav_server_tester.polling.time.sleep'):
+            check._try_make_calendar(cal_id="foo")
+
+        result = check.feature_checked("delete-calendar", dict)
+        assert result["support"] == "fragile"
+        assert cal.delete.call_count == 3
+
+    @patch('caldav_server_tester.polling.time.sleep')
+    def test_replayed_deletion_does_not_sleep(self, sleep) -> None:
+        """When replaying a cassette, the polling should not sleep"""
+        check = self.create_check()
+        check.checker.replaying = True
+        cal = check.checker.principal.make_calendar.return_value
+        cal.events.return_value = []
+        cal.delete.side_effect = [Exception("too early"), None]
+
+        check._try_make_calendar(cal_id="foo")
+
+        assert check.feature_checked("delete-calendar", dict)["delay"] == 0.1
+        sleep.assert_not_called()
+
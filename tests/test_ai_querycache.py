@@ -0,0 +1,100 @@
+"""Unit tests for the REPORT query cache"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+from datetime import datetime, timezone
+import pytest
+
+from caldav_server_tester import querycache
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.standin import StandInServer
+
+utc = timezone.utc
+
+EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tests//en
+BEGIN:VEVENT
+UID:querycache-test-event
+DTSTART:20000107T120000Z
+DTEND:20000107T130000Z
+DTSTAMP:20240429T181103Z
+SUMMARY:test event
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture
+def checker():
+    with StandInServer() as server:
+        checker = ServerQuirkChecker(server.client())
+        checker.calendar = checker._client_obj.principal().make_calendar(cal_id="querycache")
+        yield checker
+
+
+def _search(calendar):
+    return calendar.search(event=True, start=datetime(2000, 1, 1, tzinfo=utc), end=datetime(2000, 2, 1, tzinfo=utc))
+
+
+class TestNormalize:
+    """Test the normalization of the query XML"""
+
+    def test_declaration_and_prefixes(self) -> None:
+        """The XML declaration and namespace prefixes should not matter"""
+        a = '<C:calendar-query xmlns:C="urn:ietf:params:xml:ns:caldav"><C:filter/></C:calendar-query>'
+        b = '<?xml version="1.0"?>\n<x:calendar-query xmlns:x="urn:ietf:params:xml:ns:caldav"><x:filter></x:filter></x:calendar-query>'
+        assert querycache._normalize(a) == querycache._normalize(b)
+
+    def test_text_whitespace(self) -> None:
+        """Whitespace in a text-match is significant"""
+        a = '<C:text-match xmlns:C="urn:ietf:params:xml:ns:caldav">hands</C:text-match>'
+        b = '<C:text-match xmlns:C="urn:ietf:params:xml:ns:caldav"> hands</C:text-match>'
+        assert querycache._normalize(a) != querycache._normalize(b)
+
+    def test_different_queries(self) -> None:
+        """Different queries should not be mixed up"""
+        a = '<C:calendar-query xmlns:C="urn:ietf:params:xml:ns:caldav"><C:filter/></C:calendar-query>'
+        b = '<C:calendar-multiget xmlns:C="urn:ietf:params:xml:ns:caldav"><C:filter/></C:calendar-multiget>'
+        assert querycache._normalize(a) != querycache._normalize(b)
+
+
+class TestQueryCache:
+    """Test the query cache on a checker towards the stand-in server"""
+
+    def test_repeated_search(self, checker) -> None:
+        """A repeated search should be answered from the cache, with fresh objects"""
+        checker.calendar.save_event(EVENT)
+        first = _search(checker.calendar)
+        stats = checker._query_cache.stats()
+        second = _search(checker.calendar)
+        assert checker._query_cache.hits == stats["hits"] + 1
+        assert [x.data for x in first] == [x.data for x in second]
+        assert first[0] is not second[0]
+
+    def test_write_clears_cache(self, checker) -> None:
+        """After a write, the search should go to the server again"""
+        assert _search(checker.calendar) == []
+        checker.calendar.save_event(EVENT)
+        assert len(_search(checker.calendar)) == 1
+
+    def test_bypass(self, checker) -> None:
+        """Within bypass, requests should go to the server"""
+        _search(checker.calendar)
+        hits = checker._query_cache.hits
+        with querycache.bypass():
+            _search(checker.calendar)
+        assert checker._query_cache.hits == hits
+
+    def test_report(self, checker) -> None:
+        """The cache statistics should be in the report"""
+        _search(checker.calendar)
+        _search(checker.calendar)
+        assert checker.report(return_what=dict)["query_cache"]["hits"] >= 1
+
+    def test_checks_use_cache(self) -> None:
+        """The search checks should not send the same query twice"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckSearch")
+        assert checker._query_cache.hits > 0
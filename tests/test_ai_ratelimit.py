@@ -0,0 +1,97 @@
+"""Unit tests for the rate limiter"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+
+from caldav.compatibility_hints import FeatureSet
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.ratelimit import RateLimiter, from_features
+
+
+class TestRateLimiter:
+    """Test the RateLimiter class"""
+
+    def test_burst_up_to_count_is_not_delayed(self) -> None:
+        """The first `count` requests should go through without waiting"""
+        limiter = RateLimiter(5, 60)
+        start = time.monotonic()
+        for i in range(5):
+            limiter.acquire()
+        assert time.monotonic() - start < 0.5
+
+    def test_requests_beyond_count_are_delayed(self) -> None:
+        """Requests beyond the burst should wait until the first ones are an interval old"""
+        limiter = RateLimiter(2, 0.2)
+        start = time.monotonic()
+        for i in range(4):
+            limiter.acquire()
+        assert time.monotonic() - start >= 0.19
+
+    def test_never_more_than_count_per_interval(self) -> None:
+        """Any window of `interval` seconds should hold at most `count` requests"""
+        limiter = RateLimiter(3, 0.15)
+        slots = []
+        for i in range(9):
+            limiter.acquire()
+            ## the time slot reserved for this request is not in the future
+            assert limiter.times[-1] <= time.monotonic()
+            slots.append(limiter.times[-1])
+        for i in range(len(slots) - 3):
+            assert slots[i + 3] - slots[i] >= 0.149
+
+    def test_concurrent_callers_are_queued(self) -> None:
+        """Threads sharing a limiter should together not exceed the rate"""
+        limiter = RateLimiter(1, 0.05)
+        start = time.monotonic()
+        threads = [threading.Thread(target=limiter.acquire) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert time.monotonic() - start >= 0.19
+
+    def test_wrap_sync_and_async(self) -> None:
+        """wrap should work both for sync and async request methods"""
+        limiter = RateLimiter(10, 1)
+        request = Mock(return_value="response")
+
+        async def async_request(*largs):
+            return "async response"
+
+        assert limiter.wrap(request)("url", "GET") == "response"
+        request.assert_called_once_with("url", "GET")
+        assert asyncio.run(limiter.wrap(async_request)("url")) == "async response"
+
+
+class TestFromFeatures:
+    """Test configuring the rate limiter from the compatibility hints"""
+
+    def test_no_rate_limit_configured(self) -> None:
+        assert from_features(FeatureSet()) is None
+
+    def test_disabled_rate_limit(self) -> None:
+        features = FeatureSet({"rate-limit": {"enable": False, "interval": 10, "count": 1}})
+        assert from_features(features) is None
+
+    def test_configured_rate_limit(self) -> None:
+        features = FeatureSet({"rate-limit": {"enable": True, "interval": 10, "count": 2}})
+        limiter = from_features(features)
+        assert limiter.count == 2
+        assert limiter.interval == 10
+
+    def test_checker_wraps_client_request(self) -> None:
+        """The checker should route all client requests through the rate limiter"""
+        client = Mock()
+        client.features = FeatureSet({"rate-limit": {"enable": True, "interval": 10, "count": 2}})
+        request = client.request
+
+        checker = ServerQuirkChecker(client)
+        checker._client_obj.request("url", "GET")
+
+        assert checker._rate_limiter is not None
+        request.assert_called_once_with("url", "GET")
+        assert len(checker._rate_limiter.times) == 1
@@ -0,0 +1,282 @@
+"""Unit tests for the parallel check scheduler"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+import pytest
+from click.testing import CliRunner
+
+from caldav.compatibility_hints import FeatureSet
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.checks_base import AsyncCheck, Check
+from caldav_server_tester.scheduler import dependency_graph, run_checks, run_checks_async
+
+
+def create_checker() -> ServerQuirkChecker:
+    client = Mock()
+    client.features = FeatureSet()
+    return ServerQuirkChecker(client, debug_mode=None)
+
+
+class TestDependencyGraph:
+    """Test building the dependency graph"""
+
+    def test_graph_includes_transitive_dependencies(self) -> None:
+        """Dependencies of dependencies should be included in the graph"""
+
+        class A(Check):
+            pass
+
+        class B(Check):
+            depends_on = {A}
+
+        class C(Check):
+            depends_on = {B}
+
+        graph = dependency_graph([C])
+        assert graph == {C: {B}, B: {A}, A: set()}
+
+
+class TestRunChecks:
+    """Test running checks on a worker pool"""
+
+    def test_dependencies_are_run_first(self) -> None:
+        """A check should not be started before its dependencies are done"""
+        order = []
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                order.append(A)
+
+        class B(Check):
+            depends_on = {A}
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                order.append(B)
+
+        checker = create_checker()
+        run_checks(checker, [B, A], jobs=4)
+        assert order == [A, B]
+        assert checker._checks_run == {A, B}
+
+    def test_independent_checks_run_concurrently(self) -> None:
+        """Independent checks should run at the same time"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                barrier.wait()
+
+        class B(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                barrier.wait()
+
+        checker = create_checker()
+        ## Would raise BrokenBarrierError if run one by one
+        run_checks(checker, [A, B], jobs=2)
+
+    def test_exclusive_checks_run_alone(self) -> None:
+        """A check writing to the shared calendar should not overlap with any other check"""
+        lock = threading.Lock()
+        running = set()
+        overlaps = []
+
+        def run(cl) -> None:
+            with lock:
+                if running and (cl.exclusive or any(x.exclusive for x in running)):
+                    overlaps.append((cl, set(running)))
+                running.add(cl)
+            time.sleep(0.05)
+            with lock:
+                running.remove(cl)
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                run(A)
+
+        class Writer(Check):
+            features_to_be_checked = set()
+            exclusive = True
+
+            def _run_check(self) -> None:
+                run(Writer)
+
+        class B(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                run(B)
+
+        class C(Check):
+            depends_on = {A}
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                run(C)
+
+        checker = create_checker()
+        run_checks(checker, [A, Writer, B, C], jobs=4)
+        assert checker._checks_run == {A, Writer, B, C}
+        assert overlaps == []
+
+    def test_features_are_blanked_out_during_run(self) -> None:
+        """The client should see the checked features during the run, and get the expected features back afterwards"""
+        checker = create_checker()
+        expected = checker._client_obj.features
+        seen = []
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                seen.append(self.client.features)
+                seen.append(self.expected_features)
+
+        run_checks(checker, [A], jobs=2)
+        assert seen == [checker._features_checked, expected]
+        assert checker._client_obj.features is expected
+
+    def test_exceptions_are_passed_on(self) -> None:
+        """An exception in a check should propagate to the caller"""
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                raise ValueError("boom")
+
+        checker = create_checker()
+        with pytest.raises(ValueError):
+            run_checks(checker, [A], jobs=2)
+
+    def test_circular_dependencies_raise(self) -> None:
+        """A dependency cycle should be detected rather than hang"""
+
+        class A(Check):
+            features_to_be_checked = set()
+
+        class B(Check):
+            depends_on = {A}
+            features_to_be_checked = set()
+
+        A.depends_on = {B}
+
+        checker = create_checker()
+        with pytest.raises(RuntimeError):
+            run_checks(checker, [A, B], jobs=2)
+
+
+class TestRunChecksAsync:
+    """Test running checks in an event loop"""
+
+    def test_async_checks_are_overlapped(self) -> None:
+        """Independent async checks should run at the same time"""
+        event = asyncio.Event()
+
+        class A(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                await asyncio.wait_for(event.wait(), timeout=5)
+
+        class B(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                event.set()
+
+        checker = create_checker()
+        asyncio.run(run_checks_async(checker, [A, B]))
+        assert checker._checks_run == {A, B}
+
+    def test_exclusive_checks_run_alone(self) -> None:
+        """A check writing to the shared calendar should not overlap with the async checks"""
+        running = set()
+        overlaps = []
+
+        class A(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                running.add(A)
+                await asyncio.sleep(0.05)
+                running.remove(A)
+
+        class Writer(Check):
+            features_to_be_checked = set()
+            exclusive = True
+
+            def _run_check(self) -> None:
+                if running:
+                    overlaps.append(set(running))
+
+        checker = create_checker()
+        asyncio.run(run_checks_async(checker, [Writer, A]))
+        assert checker._checks_run == {A, Writer}
+        assert overlaps == []
+
+    def test_sync_dependencies_are_run_first(self) -> None:
+        """Sync checks should be run (in a thread) before the async checks depending on them"""
+        order = []
+
+        class A(Check):
+            features_to_be_checked = set()
+
+            def _run_check(self) -> None:
+                order.append(A)
+
+        class B(AsyncCheck):
+            depends_on = {A}
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                order.append(B)
+
+        checker = create_checker()
+        asyncio.run(run_checks_async(checker, [B]))
+        assert order == [A, B]
+
+    def test_check_all_async_without_async_client(self) -> None:
+        """check_all_async should work also when the caldav library has no async client"""
+
+        class A(AsyncCheck):
+            features_to_be_checked = set()
+
+            async def _run_check(self) -> None:
+                pass
+
+        checker = create_checker()
+        checker._check_classes = lambda: [A]
+        checker._make_async_client = lambda: None
+        asyncio.run(checker.check_all_async())
+        assert A in checker._checks_run
+        assert checker._async_client_obj is None
+
+
+class TestAsyncioCli:
+    """Test the --asyncio option"""
+
+    @pytest.mark.parametrize("options", [
+        ["--run-checks", "CheckSearch"],
+        ["--check-features", "search"],
+        ["--jobs", "4"],
+    ])
+    def test_unsupported_combinations(self, options) -> None:
+        """--asyncio runs all the checks, combinations it would ignore should give a usage error"""
+        result = CliRunner().invoke(check_server_compatibility, ["--asyncio"] + options)
+        assert result.exit_code == 2
+        assert "--asyncio can't be combined" in result.output
+
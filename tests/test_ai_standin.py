@@ -0,0 +1,380 @@
+"""Unit tests for the in-process stand-in CalDAV server"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import inspect
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from caldav.collection import Calendar
+from caldav.lib.error import NotFoundError
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.checks import CheckCalendarScaling
+from caldav_server_tester.checks import CheckGetCurrentUserPrincipal
+from caldav_server_tester.checks import CheckServerLatency
+from caldav_server_tester.checks import CheckSyncToken
+from caldav_server_tester.checks import PrepareCalendar
+from caldav_server_tester.standin import StandInServer
+
+utc = timezone.utc
+
+EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//tests//en
+BEGIN:VEVENT
+UID:standin-test-event
+DTSTART:20000107T120000Z
+DTEND:20000107T130000Z
+DTSTAMP:20240429T181103Z
+CATEGORIES:hands,feet,head
+SUMMARY:test event
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture
+def server():
+    with StandInServer() as server:
+        yield server
+
+
+class TestStandInServer:
+    """Test the stand-in server with a plain caldav client"""
+
+    def test_calendar_lifecycle(self, server) -> None:
+        """It should be possible to create a calendar, save, load and delete objects, and delete the calendar"""
+        principal = server.client().principal()
+        cal = principal.make_calendar(cal_id="lifecycle", name="Lifecycle")
+        assert principal.calendar(name="Lifecycle").url == cal.url
+
+        event = cal.save_event(EVENT)
+        assert "test event" in cal.event_by_uid("standin-test-event").data
+        event.load()
+        assert event.component["summary"] == "test event"
+
+        event.delete()
+        assert cal.events() == []
+        cal.delete()
+        with pytest.raises(NotFoundError):
+            principal.calendar(cal_id="lifecycle").events()
+
+    def test_no_overwrite(self, server) -> None:
+        """A PUT with If-None-Match should not overwrite an existing object"""
+        client = server.client()
+        cal = client.principal().make_calendar(cal_id="overwrite")
+        event = cal.save_event(EVENT)
+        response = client.put(str(event.url), EVENT, {"If-None-Match": "*"})
+        assert response.status == 412
+
+    def test_time_range_and_category_search(self, server) -> None:
+        """Searches should respect both the time range and the category"""
+        cal = server.client().principal().make_calendar(cal_id="search")
+        cal.save_event(EVENT)
+        assert len(cal.search(event=True, start=datetime(2000, 1, 7, tzinfo=utc), end=datetime(2000, 1, 8, tzinfo=utc))) == 1
+        assert len(cal.search(event=True, start=datetime(2000, 1, 8, tzinfo=utc), end=datetime(2000, 1, 9, tzinfo=utc))) == 0
+        assert len(cal.search(event=True, category="feet")) == 1
+        assert len(cal.search(event=True, category="toes")) == 0
+
+    def test_category_search_quirk(self) -> None:
+        """With search.category unsupported, category searches should yield nothing"""
+        with StandInServer({"search.category": {"support": "unsupported"}}) as server:
+            cal = server.client().principal().make_calendar(cal_id="search")
+            cal.save_event(EVENT)
+            assert cal.search(event=True, category="feet") == []
+
+    def test_multiget(self, server) -> None:
+        """calendar-multiget should return the requested objects"""
+        cal = server.client().principal().make_calendar(cal_id="multiget")
+        event = cal.save_event(EVENT)
+        found = list(cal._multiget([event.url]))
+        assert len(found) == 1
+        assert "standin-test-event" in found[0][1]
+
+    def test_sync_collection(self, server) -> None:
+        """An initial sync should return all the objects, with a sync token"""
+        cal = server.client().principal().make_calendar(cal_id="sync")
+        cal.save_event(EVENT)
+        objects = cal.objects(load_objects=True)
+        assert objects.sync_token
+        assert [x.component["uid"] for x in objects] == ["standin-test-event"]
+
+    def test_incremental_sync(self, server) -> None:
+        """A sync with the previous token should only return the changes"""
+        cal = server.client().principal().make_calendar(cal_id="sync")
+        event = cal.save_event(EVENT)
+        token = cal.objects().sync_token
+        assert list(cal.objects_by_sync_token(token)) == []
+        event.delete()
+        changes = cal.objects_by_sync_token(token)
+        assert [str(x.url) for x in changes] == [str(event.url)]
+        assert changes.sync_token != token
+
+    def test_options_headers(self, server) -> None:
+        """OPTIONS should announce calendar-access"""
+        response = server.client().options(server.url)
+        assert "calendar-access" in response.headers["DAV"]
+
+
+class TestChecksAgainstStandIn:
+    """Run the checks end-to-end towards the stand-in server"""
+
+    @pytest.mark.parametrize(
+        "quirks",
+        [
+            {},
+            {"search.category": {"support": "ungraceful"}},
+            {"search.category": {"support": "unsupported"}},
+            {
+                "search.category.fullstring.smart": {"support": "unsupported"},
+                "search.combined-is-logical-and": {"support": "unsupported"},
+            },
+            {"search.time-range.todo": {"support": "unsupported"}},
+            {"search.comp-type-optional": {"support": "unsupported"}},
+            {"save-load.todo.mixed-calendar": {"support": "unsupported"}},
+            {"create-calendar.auto": {"support": "full"}},
+            {"multiget": {"support": "unsupported"}},
+            {"delete-calendar": {"support": "fragile", "behaviour": "delayed deletion", "delay": 0.2}},
+        ],
+    )
+    def test_checks_detect_quirks(self, quirks) -> None:
+        """The checks should find exactly the quirks the server is configured with"""
+        with StandInServer(quirks) as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckSearch")
+        for feature, value in quirks.items():
+            observed = checker.features_checked.is_supported(feature, dict)
+            assert observed["support"] == value["support"], feature
+            if "behaviour" in value:
+                assert observed["behaviour"] == value["behaviour"]
+        if not quirks:
+            ## A server without quirks, but also without the optional extras
+            features = checker.features_checked.dotted_feature_set_list()
+            assert {x for x in features if features[x]["support"] != "full"} == {
+                "create-calendar.auto",
+                "get-current-user-principal.has-calendar",
+            }
+
+    @pytest.mark.skipif(
+        "post_filter" not in inspect.signature(Calendar.search).parameters,
+        reason="CheckRecurrenceSearch needs a caldav library with search(post_filter=...)",
+    )
+    @pytest.mark.parametrize(
+        "quirks",
+        [
+            {},
+            {"search.recurrences.includes-implicit.event": {"support": "unsupported"}},
+            {"search.recurrences.expanded.event": {"support": "unsupported"}},
+        ],
+    )
+    def test_recurrence_checks_detect_quirks(self, quirks) -> None:
+        """The recurrence search checks should find the quirks the server is configured with"""
+        with StandInServer(quirks) as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckRecurrenceSearch")
+        for feature, value in quirks.items():
+            assert checker.features_checked.is_supported(feature, dict)["support"] == value["support"]
+
+    def test_prepare_calendar(self) -> None:
+        """All the fixtures should be uploaded, and the concurrent requests counted on the check"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            uids = {x.component["uid"] for x in checker.calendar.events() + checker.calendar.todos()}
+        assert len(uids) == checker.cnt == 11
+        assert checker.features_checked.is_supported("save-load.event.recurrences")
+        ## 2 searches, 11 PUTs and 4 GETs, and a few more for finding the calendar
+        assert checker.timings["PrepareCalendar"]["requests"] >= 17
+
+    def test_prepare_calendar_verifies_fixtures(self) -> None:
+        """Fixtures not coming back from the server as saved should be noticed"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            assert checker.features_checked.is_supported("save-load.event", dict) == {"support": "full"}
+            event = checker.calendar.event_by_uid("csc_simple_event2")
+            event.component["summary"] = "changed by the server"
+            event.save()
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+        observed = checker.features_checked.is_supported("save-load.event", dict)
+        assert observed["support"] == "fragile"
+        assert "csc_simple_event2" in observed["behaviour"]
+        assert checker.features_checked.is_supported("save-load.todo", dict) == {"support": "full"}
+
+    @pytest.mark.parametrize("sync_token", [True, False])
+    def test_prepare_calendar_discovery(self, sync_token) -> None:
+        """Existing fixtures should be found with one sync-collection request, or two searches as fallback"""
+        quirks = {} if sync_token else {"sync-token": {"support": "unsupported"}}
+        with StandInServer(quirks) as server:
+            ServerQuirkChecker(server.client()).check_one("PrepareCalendar")
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            uids = {x.component["uid"] for x in checker.calendar.events() + checker.calendar.todos()}
+        ## Nothing is uploaded on the second run.  The task search
+        ## is done in several requests by the caldav library
+        assert len(uids) == checker.cnt == 11
+        assert checker.timings["PrepareCalendar"]["requests"] == (8 if sync_token else 10)
+
+    def test_prepare_calendar_new_calendar(self) -> None:
+        """On a new calendar, the sync-collection REPORT should be the only request for finding the test objects"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckGetCurrentUserPrincipal")
+            calendar = checker.principal.make_calendar(cal_id="new-calendar")
+            methods = []
+            request = checker._client_obj.request
+
+            def counted_request(url, method="GET", *largs, **kwargs):
+                methods.append(method)
+                return request(url, method, *largs, **kwargs)
+
+            checker._client_obj.request = counted_request
+            check = PrepareCalendar(checker)
+            check.expected_features = checker.expected_features
+            assert check._existing_objects(calendar) == []
+        assert methods == ["REPORT"]
+
+    @pytest.mark.parametrize("sync_token", [True, False])
+    def test_prepare_calendar_foreign_objects(self, sync_token) -> None:
+        """Objects not made by the checker (also undated ones) should be left alone"""
+        quirks = {} if sync_token else {"sync-token": {"support": "unsupported"}}
+        with StandInServer(quirks) as server:
+            ServerQuirkChecker(server.client()).check_one("PrepareCalendar")
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            checker.calendar.save_todo(summary="undated task", uid="someone-elses-task")
+            checker.calendar.save_event(EVENT)
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+        assert checker.cnt == 11
+
+    def test_check_features(self) -> None:
+        """Only the checks needed for the feature should be run"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_features(["search.category"])
+        assert set(checker.timings) == {
+            "CheckGetCurrentUserPrincipal",
+            "CheckMakeDeleteCalendar",
+            "PrepareCalendar",
+            "CheckSearch",
+        }
+        assert checker.features_checked.is_supported("search.category")
+        checker._client_obj.server_name = "stand-in"
+        features_checked = checker.report(return_what=dict)["features_checked"]
+        assert "search.category" in features_checked
+        assert "sync-token" not in features_checked
+
+    def test_check_features_cli_errors(self) -> None:
+        """Only unknown features should give a usage error, not a ValueError from the checks"""
+        with StandInServer() as server:
+            client = server.client()
+            client.server_name = "stand-in"
+            with patch("caldav.davclient.get_davclient", return_value=client):
+                result = CliRunner().invoke(check_server_compatibility, ["--check-features", "no-such-feature"])
+                assert result.exit_code == 2
+                with patch.object(CheckGetCurrentUserPrincipal, "_run_check", side_effect=ValueError("bug")):
+                    result = CliRunner().invoke(check_server_compatibility, ["--check-features", "get-current-user-principal"])
+        assert result.exit_code == 1
+        assert isinstance(result.exception, ValueError)
+
+    def test_latency_observations(self) -> None:
+        """The latency check should record percentiles for each operation, and leave no events behind"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckServerLatency")
+            assert not [x for x in checker.calendar.events() if "latency" in x.data]
+        for operation in ("propfind", "report", "put", "get", "delete"):
+            observed = checker.features_checked.is_supported(f"latency.{operation}", dict)
+            assert observed["samples"] == 20
+            assert 0 < observed["p50"] <= observed["p95"] <= observed["p99"]
+        assert checker.timings["CheckServerLatency"]["requests"] == 100
+
+    def test_latency_cleanup_on_failure(self) -> None:
+        """The latency events should be deleted even if loading them fails"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            request = checker._client_obj.request
+
+            def failing_get(url, method="GET", *largs, **kwargs):
+                if method == "GET" and "csc_latency" in str(url):
+                    raise ConnectionError("simulated failure")
+                return request(url, method, *largs, **kwargs)
+
+            with patch.object(checker._client_obj, "request", failing_get):
+                checker.check_one("CheckServerLatency")
+            assert not [x for x in checker.calendar.events() if "latency" in x.data]
+
+    @patch.object(CheckCalendarScaling, "sizes", (10, 40))
+    def test_calendar_scaling(self) -> None:
+        """The scaling check should give a growth curve for each operation, and delete its calendar"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckCalendarScaling")
+            calendars = [x.id for x in checker.principal.calendars()]
+        assert CheckCalendarScaling.cal_id not in calendars
+        for operation, expected in (("time-range-search", [10, 31]), ("category-search", [1, 4]), ("list", [10, 40])):
+            observed = checker.features_checked.is_supported(f"scaling.{operation}", dict)
+            assert [x["objects"] for x in observed["curve"]] == [10, 40]
+            assert [x["results"] for x in observed["curve"]] == expected
+            assert observed["truncated"] == []
+            assert observed["exponent"] is not None
+
+    def test_opt_in_checks(self) -> None:
+        """check_all should not run the scaling and latency checks"""
+        classes = [CheckGetCurrentUserPrincipal, CheckCalendarScaling, CheckServerLatency]
+        with StandInServer() as server, patch.object(ServerQuirkChecker, "_check_classes", return_value=classes):
+            checker = ServerQuirkChecker(server.client())
+            checker.check_all()
+        assert set(checker.timings) == {"CheckGetCurrentUserPrincipal"}
+
+    @pytest.mark.parametrize(
+        "quirks",
+        [
+            {},
+            {"sync-token": {"support": "unsupported"}},
+            {"sync-token.incremental": {"support": "unsupported"}},
+            {"sync-token.incremental.delete": {"support": "unsupported"}},
+            {"sync-token.invalid-token": {"support": "unsupported"}},
+            {"sync-token.limit": {"support": "unsupported"}},
+        ],
+    )
+    def test_sync_token_checks_detect_quirks(self, quirks) -> None:
+        """The sync-collection check should find the quirks the server is configured with"""
+        with StandInServer(quirks) as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("CheckSyncToken")
+            assert not [x for x in checker.calendar.events() if "sync check" in x.data]
+        for feature in CheckSyncToken.features_to_be_checked - {"sync-token.efficiency"}:
+            expected = server.features.is_supported(feature, str)
+            assert checker.features_checked.is_supported(feature, str) == expected, feature
+        if not quirks:
+            efficiency = checker.features_checked.is_supported("sync-token.efficiency", dict)
+            assert efficiency["incremental_objects"] == 1
+            assert efficiency["ratio"] < 1
+
+    def test_sync_token_concurrent_changes(self) -> None:
+        """Changes done by other checks in parallel should not be taken as a full sync"""
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client())
+            checker.check_one("PrepareCalendar")
+            cal = Calendar(client=server.client(), url=checker.calendar.url)
+            sync = CheckSyncToken._sync
+            written = []
+
+            def sync_with_concurrent_writes(check, token="", limit=None):
+                if token and not written:
+                    for i in range(20):
+                        written.append(cal.save_event(EVENT.replace("standin-test-event", f"concurrent-{i}")))
+                return sync(check, token, limit)
+
+            with patch.object(CheckSyncToken, "_sync", sync_with_concurrent_writes):
+                checker.check_one("CheckSyncToken")
+        assert checker.features_checked.is_supported("sync-token.incremental", str) == "full"
+        assert checker.features_checked.is_supported("sync-token.efficiency", str) == "unknown"
@@ -0,0 +1,79 @@
+"""Unit tests for the streaming NDJSON progress output"""
+
+## DISCLAIMER: those tests are AI-generated, gone through a very quick human QA
+
+import io
+import json
+from datetime import datetime
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from caldav_server_tester.caldav_server_tester import check_server_compatibility
+from caldav_server_tester.checker import ServerQuirkChecker
+from caldav_server_tester.standin import StandInServer
+from caldav_server_tester.stream import Stream
+
+
+def records(output):
+    return [json.loads(x) for x in output.splitlines()]
+
+
+class TestStream:
+    """Test the Stream class"""
+
+    def test_one_record_per_line(self) -> None:
+        """Every record should be a line of JSON with the event and a timestamp"""
+        f = io.StringIO()
+        stream = Stream(f)
+        check = Mock()
+        check.__class__.__name__ = "CheckFoo"
+        stream.check_started(check)
+        stream.feature(check, "foo.bar", {"support": "full"})
+
+        lines = records(f.getvalue())
+        assert [x["event"] for x in lines] == ["check_started", "feature"]
+        assert lines[1]["feature"] == "foo.bar"
+        assert lines[1]["value"] == {"support": "full"}
+        assert all(x["check"] == "CheckFoo" for x in lines)
+        assert datetime.fromisoformat(lines[0]["time"]).tzinfo is not None
+
+
+class TestStreamingChecker:
+    """Run checks towards the stand-in server with a stream"""
+
+    def test_records_as_checks_complete(self) -> None:
+        """Every check should be started, set its features and be done - in that order"""
+        f = io.StringIO()
+        with StandInServer() as server:
+            checker = ServerQuirkChecker(server.client(), debug_mode="report", stream=Stream(f))
+            checker.check_one("PrepareCalendar")
+
+        lines = records(f.getvalue())
+        for check in checker.timings:
+            events = [x for x in lines if x["check"] == check]
+            assert events[0]["event"] == "check_started"
+            assert events[-1]["event"] == "check_done"
+            assert events[-1]["timing"]["requests"] == checker.timings[check]["requests"]
+            assert {x["event"] for x in events[1:-1]} <= {"feature"}
+        features = {x["feature"] for x in lines if x["event"] == "feature"}
+        assert "create-calendar" in features
+        assert "save-load.event" in features
+
+    def test_cli(self) -> None:
+        """With --stream, stdout should be NDJSON, with the report as the last record"""
+        with StandInServer() as server:
+            client = server.client()
+            client.server_name = "stand-in"
+            with patch("caldav.davclient.get_davclient", return_value=client):
+                result = CliRunner().invoke(
+                    check_server_compatibility,
+                    ["--stream", "--run-checks", "CheckGetCurrentUserPrincipal"],
+                )
+        assert result.exit_code == 0, result.output
+        lines = records(result.stdout)
+        assert lines[0] == {"event": "check_started", "check": "CheckGetCurrentUserPrincipal", "time": lines[0]["time"]}
+        assert lines[-1]["event"] == "report"
+        assert "CheckGetCurrentUserPrincipal" in lines[-1]["report"]["timings"]
+        assert "WARNING" in result.stderr